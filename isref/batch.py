@@ -0,0 +1,322 @@
+# coding: utf-8
+"""Modulo para calcular ISREF y Complejidad del Lenguaje de varios corpus a la vez."""
+from pathlib import Path
+import argparse
+import datetime
+import glob
+import logging
+import multiprocessing
+import os
+
+import helpers as hp
+import isref as isr
+import readability as rd
+
+# modelo y opciones de la corrida. Se definen antes de crear el pool de procesos,
+# que los hereda sin copiarlos (fork, copy-on-write).
+_STATE = {}
+
+
+def corpus_dirs(patterns):
+    """
+    Directorios de documentos que coinciden con patterns y tienen carpeta corpus.
+
+    Parameters
+    ----------
+    patterns: list of str
+        Rutas o patrones glob.
+
+    Returns
+    -------
+    list of Path
+        Sin repetidos, en el orden de patterns.
+    """
+    dirs = []
+    for pattern in patterns:
+        for dirpath in sorted(glob.glob(pattern)) or [pattern]:
+            dirpath = Path(dirpath)
+            if (dirpath / 'corpus').is_dir() and dirpath not in dirs:
+                dirs.append(dirpath)
+
+    return dirs
+
+
+def score_task(task):
+    """
+    Procesa un documento con spacy una sola vez y calcula frecuencias de palabras
+    para ISREF y estadísticas de complejidad. Usa modelo y opciones en _STATE.
+    Las medidas de complejidad se calculan en el proceso principal, que tiene
+    la tabla de sílabas.
+
+    Parameters
+    ----------
+    task: tuple (str, Path)
+        Nombre del corpus y documento.
+
+    Returns
+    -------
+    tuple (str, str, str, collections.Counter, readability.ReadabilityStats)
+        Corpus, documento, huella del texto, frecuencias para ISREF y
+        estadísticas de complejidad.
+    """
+    name, fpath = task
+    text = hp.read_text(fpath)
+    doc = hp.parse_text(text, _STATE['nlp'], _STATE['caches'].get(name), name=fpath)
+
+    counts = isr.doc_counts(doc, _STATE['isref_extra'], _STATE['matcher'])
+
+    stats = rd.ReadabilityStats()
+    for tokens in hp.doc_sentences(doc, _STATE['readability_extra']):
+        stats.add(tokens)
+
+    return name, fpath.stem, hp.text_hash(text), counts, stats
+
+
+def write_isref(dir_docs, docnames, hashes, file_stats, counts, lexicon, config, args):
+    """
+    Actualiza matriz documento-palabra, manifest, resultados y gráfica de ISREF
+    de un corpus, en isref/<corpus> como isref.py.
+
+    Parameters
+    ----------
+    dir_docs: Path
+    docnames: list of str
+    hashes: dict (documento, huella del texto)
+    file_stats: dict (documento, hp.file_stat)
+    counts: dict (documento, collections.Counter)
+        Frecuencias de documentos procesados en esta corrida.
+    lexicon: dict (positive, negative)
+    config: str
+    args: argparse.Namespace
+    """
+    from scipy import sparse
+    import numpy as np
+    import pandas as pd
+
+    dir_output = os.path.join('isref', dir_docs.name)
+    os.makedirs(dir_output, exist_ok=True)
+    manifest = hp.Manifest(os.path.join(dir_output, 'manifest.json'))
+    lexhash = hp.config_hash(lexicon)
+
+    try:
+        previous = isr.load_doc_terms(dir_output)
+    except FileNotFoundError:
+        previous = (sparse.csr_matrix((0, 0), dtype=np.int64), [], [])
+
+    names = list(counts)
+    new = isr.doc_term_matrix(counts[n] for n in names) + (names,)
+    doc_terms = isr.merge_doc_terms(previous, new, docnames)
+    isr.save_doc_terms(dir_output, *doc_terms)
+
+    matrix, vocab, docnames = doc_terms
+    lexicons = isr.lexicon_matrix(vocab, [(lexicon['positive'], lexicon['negative'])])
+    scores = []
+    for name, score in zip(docnames, isr.fss_matrix(matrix, lexicons)[:, 0]):
+        manifest.update(name, score, hash=hashes[name], stat=file_stats[name], config=config,
+                        lexicon=lexhash)
+        scores.append(dict(score=score, doc=name))
+    manifest.prune(docnames)
+    manifest.save()
+
+    isref = pd.DataFrame(scores)
+    isref.dropna(subset=['score'], inplace=True)
+    if args.store == 'parquet':
+        run = dict(options=sorted(_STATE['isref_extra']), parser=args.parser, fast=False,
+                   lexicon=Path(args.wdfile).name)
+        hp.ResultStore(args.store_dir).upsert(
+            'isref', dir_docs.name, hp.config_hash(_STATE['isref_extra'], words=lexhash, **run),
+            isref, keep=isref['doc'], description=run)
+    else:
+        isref.to_csv(os.path.join(dir_output, 'isref.csv'), index=False, encoding='utf-8')
+
+    if not args.no_plot:
+        isr.plot_isref(isref, os.path.join(dir_output, 'isref.html'))
+
+    logging.info(f'{dir_docs.name}: ISREF calculado para {len(isref.index)} documentos')
+
+
+def write_readability(dir_docs, docnames, hashes, file_stats, results, config, args):
+    """
+    Actualiza manifest, resultados y gráfica de Complejidad del Lenguaje
+    de un corpus, en readability/<corpus> como readability.py.
+
+    Parameters
+    ----------
+    dir_docs: Path
+    docnames: list of str
+    hashes: dict (documento, huella del texto)
+    file_stats: dict (documento, hp.file_stat)
+    results: dict (documento, dict)
+        Medidas de documentos procesados en esta corrida.
+    config: str
+    args: argparse.Namespace
+    """
+    import pandas as pd
+
+    dir_output = os.path.join('readability', dir_docs.name)
+    os.makedirs(dir_output, exist_ok=True)
+    manifest = hp.Manifest(os.path.join(dir_output, 'manifest.json'))
+
+    for name, scores in results.items():
+        manifest.update(name, scores, hash=hashes[name], stat=file_stats[name], config=config)
+    scores = [dict(manifest.result(name), doc=name) for name in docnames]
+    manifest.prune(docnames)
+    manifest.save()
+
+    readability = pd.DataFrame(scores, columns=list(rd.COLUMNS))
+    if args.store == 'parquet':
+        run = dict(options=sorted(_STATE['readability_extra']), parser=args.parser)
+        hp.ResultStore(args.store_dir).upsert(
+            'readability', dir_docs.name, config, readability,
+            keep=readability['doc'], description=run)
+    else:
+        readability.to_csv(os.path.join(dir_output, 'readability.csv'),
+                           index=False, encoding='utf-8')
+
+    if not args.no_plot:
+        rd.plot_readability(readability, os.path.join(dir_output, 'readability.html'))
+
+    logging.info(f'{dir_docs.name}: complejidad calculada para {len(readability.index)} documentos')
+
+
+def add_arguments(parser):
+    """
+    Agrega a parser los argumentos de línea de comandos de batch.
+    """
+    desc_dirdocs = "Ubicación de los documentos de cada corpus (acepta patrones glob)"
+    parser.add_argument("dirdocs", nargs='+', help=desc_dirdocs)
+    desc_wdfile = "Ubicación de archivo json de palabras positivas y negativas"
+    parser.add_argument("--wdfile", required=True, help=desc_wdfile)
+    desc_stopsfile = "Ubicación de archivo excel de palabras a ignorar (stopwords)"
+    parser.add_argument("--stopsfile", required=True, help=desc_stopsfile)
+    desc_jobs = "Número de procesos que comparten el modelo de spacy"
+    parser.add_argument("--jobs", type=int, default=1, help=desc_jobs)
+    desc_nocache = "No usar cache de documentos procesados (<dirdocs>/cache)"
+    parser.add_argument("--no-cache", action="store_true", help=desc_nocache)
+    desc_parser = "Segmentar frases con el parser de spacy en lugar del sentencizer"
+    parser.add_argument("--parser", action="store_true", help=desc_parser)
+    desc_full = "Recalcular todos los documentos, ignorando resultados de corridas anteriores"
+    parser.add_argument("--full", action="store_true", help=desc_full)
+    desc_noplot = "No generar gráficas html (evita importar plotly)"
+    parser.add_argument("--no-plot", action="store_true", help=desc_noplot)
+    desc_store = ("Formato de resultados: csv o parquet "
+                  "(particionado por corpus y configuración, en --store-dir)")
+    parser.add_argument("--store", choices=['csv', 'parquet'], default='csv', help=desc_store)
+    desc_storedir = "Ubicación del almacén parquet de resultados (default: resultados)"
+    parser.add_argument("--store-dir", default='resultados', help=desc_storedir)
+
+
+def main(args):
+    """
+    Calcula ISREF y Complejidad del Lenguaje de todos los corpus en args.dirdocs,
+    cargando el modelo de spacy una sola vez.
+    """
+    dir_logs = os.path.join('batch', 'logs')
+    os.makedirs(dir_logs, exist_ok=True)
+
+    rundate = f'{datetime.date.today():%Y-%m-%d}'
+    logfile = os.path.join(dir_logs, '{}.log'.format(rundate))
+    log_format = '%(asctime)s : %(levelname)s : %(message)s'
+    log_datefmt = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(format=log_format, datefmt=log_datefmt,
+                        level=logging.INFO, filename=logfile, filemode='w')
+
+    words = hp.load_lexicon(args.wdfile, args.stopsfile, 'english', col='word')
+    lexicon = dict(positive=words['positive'], negative=words['negative'])
+
+    # mismas opciones que isref.py y readability.py
+    stops = words['stopwords']
+    ents = ['PER', 'ORG']
+    isref_extra = dict(stopwords=stops, entities=ents, )
+    readability_extra = dict(entities=ents, )
+    matcher = isr.lexicon_matcher(lexicon['positive'], lexicon['negative'], isref_extra)
+    isref_config = isr.manifest_config(isref_extra, args.parser, matcher)
+    readability_config = rd.manifest_config(readability_extra, args.parser)
+
+    # documentos nuevos, modificados o con otra configuración, en isref o readability
+    corpora, tasks = {}, []
+    for dir_docs in corpus_dirs(args.dirdocs):
+        filepaths = list(hp.ordered_filepaths(dir_docs / 'corpus'))
+        isref_manifest = hp.Manifest(os.path.join('isref', dir_docs.name, 'manifest.json'))
+        readability_manifest = hp.Manifest(
+            os.path.join('readability', dir_docs.name, 'manifest.json'))
+
+        # hash guardado de archivos sin cambios de tamaño ni fecha; los demás se
+        # procesan y score_task devuelve su hash, así cada archivo se lee una vez
+        file_stats = {fpath.stem: hp.file_stat(fpath) for fpath in filepaths}
+        hashes = {name: (isref_manifest.known_hash(name, stat) or
+                         readability_manifest.known_hash(name, stat))
+                  for name, stat in file_stats.items()}
+        try:
+            tokenized = set(isr.load_doc_terms(os.path.join('isref', dir_docs.name))[2])
+        except FileNotFoundError:
+            tokenized = set()
+
+        for fpath in filepaths:
+            keys = dict(hash=hashes[fpath.stem])
+            if (args.full or fpath.stem not in tokenized or hashes[fpath.stem] is None or
+                    not isref_manifest.is_current(fpath.stem, config=isref_config, **keys) or
+                    not readability_manifest.is_current(
+                        fpath.stem, config=readability_config, **keys)):
+                tasks.append((dir_docs.name, fpath))
+
+        corpora[dir_docs.name] = dict(dir_docs=dir_docs, hashes=hashes, file_stats=file_stats,
+                                      counts={}, results={},
+                                      docnames=[fpath.stem for fpath in filepaths])
+
+    logging.info(f'Corpus: {list(corpora)}')
+    logging.info(f'Documentos a procesar: {len(tasks)}')
+
+    os.makedirs('readability', exist_ok=True)
+    syllables = rd.SyllableTable(os.path.join('readability', 'syllables.json'))
+    if tasks:
+        # entities de ambos scripts: el mismo pipeline sirve para los dos
+        nlp = hp.load_language('en_md', isref_extra, parser=args.parser)
+        caches = {}
+        if not args.no_cache:
+            caches = {name: hp.DocCache(corpus['dir_docs'] / 'cache', nlp)
+                      for name, corpus in corpora.items()}
+        _STATE.update(nlp=nlp, caches=caches, matcher=matcher,
+                      isref_extra=isref_extra, readability_extra=readability_extra)
+        logging.info(f'Pipeline de spacy: {nlp.pipe_names}')
+
+        # documentos más grandes primero, para que no queden al final en un solo proceso
+        tasks.sort(key=lambda task: task[1].stat().st_size, reverse=True)
+
+        pool = None
+        if args.jobs > 1:
+            pool = multiprocessing.get_context('fork').Pool(args.jobs)
+            done = pool.imap_unordered(score_task, tasks)
+        else:
+            done = map(score_task, tasks)
+
+        try:
+            for name, docname, key, counts, stats in done:
+                corpora[name]['hashes'][docname] = key
+                corpora[name]['counts'][docname] = counts
+                # sílabas y uso de palabras se registran solo aquí, una vez por documento
+                corpora[name]['results'][docname] = stats.scores(syllables)
+            if pool is not None:
+                pool.close()
+        finally:
+            # si algo falla, terminate detiene los procesos que siguen trabajando
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    else:
+        _STATE.update(isref_extra=isref_extra, readability_extra=readability_extra)
+
+    syllables.save()
+
+    for corpus in corpora.values():
+        write_isref(corpus['dir_docs'], corpus['docnames'], corpus['hashes'],
+                    corpus['file_stats'], corpus['counts'], lexicon, isref_config, args)
+        write_readability(corpus['dir_docs'], corpus['docnames'], corpus['hashes'],
+                          corpus['file_stats'], corpus['results'], readability_config, args)
+
+
+if __name__ == '__main__':
+    description = """Calcula ISREF y Complejidad del Lenguaje de varios corpus"""
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    main(parser.parse_args())
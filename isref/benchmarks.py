@@ -0,0 +1,560 @@
+# coding: utf-8
+"""Modulo para medir desempeño de las etapas del cálculo de indicadores."""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import warnings
+
+import extraction as ex
+import helpers as hp
+import isref as isr
+import readability as rd
+
+
+def bench_extraction(filepaths, server=None, sample=20000):
+    """
+    Compara, para cada archivo en filepaths, la extracción con la librería tika
+    (texto completo de vuelta al servidor para detectar idioma) con TikaClient
+    enviando texto completo y enviando solo una muestra para detectar idioma.
+
+    Para la librería tika los bytes son estimados: archivo enviado,
+    texto recibido y texto enviado de nuevo para detectar idioma.
+
+    Parameters
+    ----------
+    filepaths: iterable of Path
+    server: str, optional
+    sample: int
+
+    Returns
+    -------
+    list of dict (doc, mode, seconds, bytes_sent, bytes_received)
+    """
+    if server:
+        ex.use_tika_server(server)
+    completo = ex.TikaClient(server, sample=None)
+    muestra = ex.TikaClient(server, sample=sample)
+
+    results = []
+    for fpath in filepaths:
+        inicio = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            info = ex.extract(str(fpath))
+        secs = time.perf_counter() - inicio
+        nbytes = len((info.get('text') or '').encode('utf-8'))
+        results.append(dict(doc=fpath.name, mode='tika', seconds=secs,
+                            bytes_sent=fpath.stat().st_size + nbytes,
+                            bytes_received=nbytes))
+
+        for mode, client in (('completo', completo), ('muestra', muestra)):
+            sent, received = client.bytes_sent, client.bytes_received
+            inicio = time.perf_counter()
+            ex.extract(str(fpath), client=client)
+            secs = time.perf_counter() - inicio
+            results.append(dict(doc=fpath.name, mode=mode, seconds=secs,
+                                bytes_sent=client.bytes_sent - sent,
+                                bytes_received=client.bytes_received - received))
+
+    return results
+
+
+def generate_corpus(directory, positive, negative, stopwords, ndocs=10, nsents=500,
+                    sent_length=25, seed=0):
+    """
+    Crea corpus sintético de reportes en directory/corpus, con palabras
+    del diccionario positivo-negativo, stopwords y palabras de relleno.
+    Los documentos se nombran con fechas trimestrales, como los reportes reales.
+
+    Parameters
+    ----------
+    directory: str or Path
+    positive: list of str
+    negative: list of str
+    stopwords: set of str
+    ndocs: int
+    nsents: int
+        Frases por documento.
+    sent_length: int
+        Palabras promedio por frase.
+    seed: int
+
+    Returns
+    -------
+    list of Path
+    """
+    rng = random.Random(seed)
+    letters = 'abcdefghilmnoprstuv'
+    filler = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 12)))
+              for _ in range(5000)]
+    pools = [(list(stopwords), 0.45), (filler, 0.45), (positive, 0.05), (negative, 0.05)]
+    pools = [(pool, weight) for pool, weight in pools if pool]
+    words, weights = zip(*pools)
+
+    dir_corpus = Path(directory, 'corpus')
+    dir_corpus.mkdir(parents=True, exist_ok=True)
+
+    filepaths = []
+    fecha = datetime.date(2000, 1, 1)
+    for _ in range(ndocs):
+        paragraphs = []
+        sentences = []
+        for _ in range(nsents):
+            length = max(3, int(rng.gauss(sent_length, sent_length / 3)))
+            sent = [rng.choice(rng.choices(words, weights)[0]) for _ in range(length)]
+            sentences.append(' '.join(sent).capitalize() + '.')
+            if len(sentences) >= rng.randint(4, 10):
+                paragraphs.append(' '.join(sentences))
+                sentences = []
+        if sentences:
+            paragraphs.append(' '.join(sentences))
+
+        fpath = dir_corpus / f'{fecha:%Y-%m-%d}.txt'
+        with open(fpath, 'w', encoding='utf-8') as out:
+            out.write('\n\n'.join(paragraphs))
+        filepaths.append(fpath)
+
+        month = fecha.month + 3
+        fecha = fecha.replace(year=fecha.year + (month - 1) // 12, month=(month - 1) % 12 + 1)
+
+    return filepaths
+
+
+def peak_memory():
+    """
+    Memoria máxima (MB) usada hasta ahora por este proceso. resource solo existe
+    en Unix; en otros sistemas se usa psutil si está instalado.
+
+    Returns
+    -------
+    float or None
+        None si no hay cómo medirla.
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        # peak_wset (Windows) es el máximo; si no existe, rss es solo el uso actual
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en bytes en macOS y en kilobytes en Linux
+    if sys.platform == 'darwin':
+        return maxrss / 1024 ** 2
+
+    return maxrss / 1024
+
+
+def bench_pipeline(directory, lang, pos, neg, other=None, output=None):
+    """
+    Mide cada etapa del cálculo de ISREF y complejidad del lenguaje sobre
+    documentos en directory: leer, procesar con spacy, filtrar, calcular y escribir.
+
+    Parameters
+    ----------
+    directory: str or Path
+    lang: spacy.lang
+    pos: list of str
+    neg: list of str
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    output: str or Path, optional
+        Directorio donde escribir resultados. Por defecto uno temporal que se borra
+        al terminar, fuera de directory para que los scripts no lo lean como corpus.
+
+    Returns
+    -------
+    dict
+        Segundos por etapa, documentos, tokens, bytes, docs/sec, tokens/sec y memoria máxima.
+    """
+    pos, neg = set(pos), set(neg)
+    stages = dict(read=0.0, parse=0.0, filter=0.0, score=0.0, write=0.0)
+    ndocs, ntokens, nbytes = (0, 0, 0)
+    scores = []
+    syllables = rd.SyllableTable()
+
+    for fpath in hp.ordered_filepaths(directory):
+        inicio = time.perf_counter()
+        text = hp.read_text(fpath)
+        stages['read'] += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        doc = lang(text)
+        stages['parse'] += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        sentences = list(hp.doc_sentences(doc, other))
+        stages['filter'] += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        result = rd.sentences_readability(sentences, syllables)
+        result['score'] = isr.sentences_fss(sentences, pos, neg)
+        result['doc'] = fpath.stem
+        scores.append(result)
+        stages['score'] += time.perf_counter() - inicio
+
+        ndocs += 1
+        ntokens += len(doc)
+        nbytes += len(text.encode('utf-8'))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dir_output = Path(output or tmpdir)
+        dir_output.mkdir(parents=True, exist_ok=True)
+        inicio = time.perf_counter()
+        with open(dir_output / 'scores.json', 'w', encoding='utf-8') as out:
+            json.dump(scores, out)
+        stages['write'] += time.perf_counter() - inicio
+
+    total = sum(stages.values())
+
+    return dict(stages=stages, seconds=total, docs=ndocs, tokens=ntokens, bytes=nbytes,
+                docs_per_sec=ndocs / total if total else None,
+                tokens_per_sec=ntokens / total if total else None,
+                peak_memory_mb=peak_memory())
+
+
+def bench_micorpus(directory, lang, other=None):
+    """
+    Mide construcción de hp.MiCorpus y una pasada completa sobre el corpus.
+
+    Parameters
+    ----------
+    directory: str or Path
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Returns
+    -------
+    dict
+    """
+    inicio = time.perf_counter()
+    corpus = hp.MiCorpus(str(directory), lang, other)
+    build = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    ndocs = sum(1 for _ in corpus)
+    iteration = time.perf_counter() - inicio
+
+    return dict(stages=dict(build=build, iteration=iteration), docs=ndocs,
+                terms=len(corpus.diccionario),
+                docs_per_sec=ndocs / iteration if iteration else None,
+                peak_memory_mb=peak_memory())
+
+
+def bench_startup(commands, repeat=5):
+    """
+    Mide tiempo de arranque de cli.py en procesos nuevos: ayuda general y ayuda
+    de cada subcomando en commands, comparado con iniciar Python sin importar nada.
+
+    Parameters
+    ----------
+    commands: list of str
+    repeat: int
+
+    Returns
+    -------
+    list of dict (mode, seconds)
+    """
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    cases = dict(python=[sys.executable, '-c', 'pass'], help=[sys.executable, cli, '--help'])
+    for command in commands:
+        cases[command] = [sys.executable, cli, command, '--help']
+
+    results = []
+    for _ in range(repeat):
+        for mode, args in cases.items():
+            inicio = time.perf_counter()
+            subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            results.append(dict(mode=mode, seconds=time.perf_counter() - inicio))
+
+    return results
+
+
+# metadata de StubTikaHandler, con un valor repetido como los que devuelve TIKA
+STUB_METADATA = {'Content-Type': 'text/plain', 'xmpTPg:NPages': '1',
+                 'Creation-Date': ['2019-06-30T00:00:00Z', '2019-07-01T00:00:00Z']}
+
+
+def stub_unpack(text, metadata):
+    """
+    Respuesta de /unpack/all: tar con __TEXT__ y __METADATA__ (csv, valores
+    repetidos como columnas adicionales).
+
+    Parameters
+    ----------
+    text: str
+    metadata: dict
+
+    Returns
+    -------
+    bytes
+    """
+    rows = io.StringIO()
+    writer = csv.writer(rows)
+    for key, value in metadata.items():
+        writer.writerow([key] + (value if isinstance(value, list) else [value]))
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, data in (('__METADATA__', rows.getvalue()), ('__TEXT__', text)):
+            data = data.encode('utf-8')
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+
+    return buffer.getvalue()
+
+
+class StubTikaHandler(BaseHTTPRequestHandler):
+    """
+    Responde como TIKA Rest Server, para medir y probar extracción sin Java:
+    /rmeta/text y /unpack/all devuelven el archivo recibido como texto, con
+    STUB_METADATA, y /language/string devuelve 'en', después de esperar delay segundos.
+    """
+    delay = 0.0
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.delay)
+        text = body.decode('utf-8', 'replace')
+
+        if self.path.startswith('/rmeta'):
+            meta = dict(STUB_METADATA, **{'X-TIKA:content': text})
+            data, ctype = json.dumps([meta]).encode('utf-8'), 'application/json'
+        elif self.path.startswith('/unpack'):
+            data, ctype = stub_unpack(text, STUB_METADATA), 'application/x-tar'
+        elif self.path.startswith('/language'):
+            data, ctype = b'en', 'text/plain'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubTikaServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve_stub_tika(port=0, delay=0.0):
+    """
+    Inicia StubTikaHandler en un hilo en localhost.
+
+    Parameters
+    ----------
+    port: int
+        0 para usar un puerto libre.
+    delay: float
+        Segundos de espera por respuesta, para simular latencia de TIKA.
+
+    Returns
+    -------
+    tuple (StubTikaServer, str)
+        Servidor (detener con shutdown) y su URL.
+    """
+    handler = type('StubTikaHandler', (StubTikaHandler,), dict(delay=delay))
+    server = StubTikaServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def version():
+    """
+    Commit de git del código medido, si está disponible.
+
+    Returns
+    -------
+    str or None
+    """
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return out.stdout.decode().strip()
+    except Exception:
+        return None
+
+
+def summarize(results, key='mode'):
+    """
+    Promedia segundos y bytes por documento para cada valor de key en results.
+
+    Parameters
+    ----------
+    results: list of dict
+    key: str
+
+    Returns
+    -------
+    dict
+    """
+    summary = {}
+    for row in results:
+        group = summary.setdefault(row[key], dict(docs=0))
+        group['docs'] += 1
+        for k, v in row.items():
+            if k not in (key, 'doc') and isinstance(v, (int, float)):
+                group[k] = group.get(k, 0) + v
+
+    for group in summary.values():
+        ndocs = group.pop('docs')
+        for k in list(group):
+            group[k] = group[k] / ndocs
+        group['docs'] = ndocs
+
+    return summary
+
+
+def write_results(filepath, results, summary, **params):
+    """
+    Guarda resultados y resumen del benchmark en json, junto con
+    versión del código, fecha y parámetros, para comparar entre versiones.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    results: list of dict
+    summary: dict
+    params: parámetros de la medición
+    """
+    data = dict(version=version(), date=f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S}',
+                params=params, results=results, summary=summary)
+    with open(filepath, 'w', encoding='utf-8') as out:
+        json.dump(data, out, indent=1)
+
+
+def load_inputs(wdfile, stopsfile):
+    """
+    Lee palabras positivas, negativas y stopwords compiladas con hp.load_lexicon.
+
+    Parameters
+    ----------
+    wdfile: str
+    stopsfile: str
+
+    Returns
+    -------
+    tuple (hp.WordSet, hp.WordSet, hp.WordSet)
+    """
+    words = hp.load_lexicon(wdfile, stopsfile, 'english', col='word')
+
+    return words['positive'], words['negative'], words['stopwords']
+
+
+if __name__ == '__main__':
+    description = """Mide desempeño de las etapas del cálculo de indicadores"""
+    parser = argparse.ArgumentParser(description=description)
+    subparsers = parser.add_subparsers(dest='stage')
+
+    desc_extraction = "Bytes transferidos y latencia por documento de la extracción con TIKA"
+    p_extraction = subparsers.add_parser('extraction', help=desc_extraction)
+    p_extraction.add_argument("dirinput", help="Ubicación de los documentos")
+    p_extraction.add_argument("--server", help="URL del TIKA Rest Server")
+    p_extraction.add_argument("--sample", type=int, default=20000,
+                              help="Caracteres de texto usados para detectar idioma")
+    p_extraction.add_argument("--output", help="Archivo json de resultados")
+
+    desc_generate = "Crea corpus sintético con palabras del diccionario y stopwords"
+    p_generate = subparsers.add_parser('generate', help=desc_generate)
+    p_generate.add_argument("dirdocs", help="Ubicación del corpus a crear")
+    p_generate.add_argument("wdfile", help="Archivo json de palabras positivas y negativas")
+    p_generate.add_argument("stopsfile", help="Archivo excel de stopwords")
+    p_generate.add_argument("--docs", type=int, default=10, help="Número de documentos")
+    p_generate.add_argument("--sentences", type=int, default=500, help="Frases por documento")
+    p_generate.add_argument("--length", type=int, default=25, help="Palabras promedio por frase")
+    p_generate.add_argument("--seed", type=int, default=0, help="Semilla aleatoria")
+
+    desc_pipeline = "Tiempo por etapa (leer, procesar, filtrar, calcular, escribir) de ISREF y complejidad"
+    p_pipeline = subparsers.add_parser('pipeline', help=desc_pipeline)
+    desc_micorpus = "Tiempo de construcción y de una pasada de MiCorpus"
+    p_micorpus = subparsers.add_parser('micorpus', help=desc_micorpus)
+    for p in (p_pipeline, p_micorpus):
+        p.add_argument("dirdocs", help="Ubicación de los documentos")
+        p.add_argument("wdfile", help="Archivo json de palabras positivas y negativas")
+        p.add_argument("stopsfile", help="Archivo excel de stopwords")
+        p.add_argument("--output", help="Archivo json de resultados")
+
+    desc_startup = "Tiempo de arranque de cli.py y de la ayuda de cada subcomando"
+    p_startup = subparsers.add_parser('startup', help=desc_startup)
+    p_startup.add_argument("--repeat", type=int, default=5, help="Repeticiones de cada medición")
+    p_startup.add_argument("--output", help="Archivo json de resultados")
+
+    desc_stub = "Servidor que responde como TIKA, devolviendo cada archivo como texto"
+    p_stub = subparsers.add_parser('stub-tika', help=desc_stub)
+    p_stub.add_argument("--port", type=int, default=9998, help="Puerto del servidor")
+    p_stub.add_argument("--delay", type=float, default=0.0, help="Segundos de espera por respuesta")
+
+    args = parser.parse_args()
+
+    if args.stage == 'stub-tika':
+        server, url = serve_stub_tika(args.port, args.delay)
+        print(f'TIKA de prueba en {url} (Ctrl-C para terminar)')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        parser.exit()
+
+    elif args.stage == 'extraction':
+        filepaths = sorted(f for f in Path(args.dirinput).iterdir()
+                           if f.suffix.lower() in ex.FORMATOS)
+        results = bench_extraction(filepaths, args.server, args.sample)
+        summary = summarize(results)
+        params = dict(stage=args.stage, docs=len(filepaths), sample=args.sample)
+
+    elif args.stage == 'generate':
+        positive, negative, stops = load_inputs(args.wdfile, args.stopsfile)
+        filepaths = generate_corpus(args.dirdocs, positive, negative, stops, args.docs,
+                                    args.sentences, args.length, args.seed)
+        print(f'{len(filepaths)} documentos en {Path(args.dirdocs, "corpus")}')
+        parser.exit()
+
+    elif args.stage in ('pipeline', 'micorpus'):
+        positive, negative, stops = load_inputs(args.wdfile, args.stopsfile)
+        extra = dict(stopwords=stops, entities=['PER', 'ORG'])
+        nlp = hp.load_language('en_md', extra)
+        dir_corpus = os.path.join(args.dirdocs, 'corpus')
+        if args.stage == 'pipeline':
+            summary = bench_pipeline(dir_corpus, nlp, positive, negative, extra)
+        else:
+            summary = bench_micorpus(dir_corpus, nlp, extra)
+        results = []
+        params = dict(stage=args.stage, dirdocs=Path(args.dirdocs).name,
+                      pipeline=nlp.pipe_names, options=list(extra))
+
+    elif args.stage == 'startup':
+        commands = ['score', 'readability', 'extract', 'topics']
+        results = bench_startup(commands, args.repeat)
+        summary = summarize(results)
+        params = dict(stage=args.stage, repeat=args.repeat)
+
+    else:
+        parser.error('Falta etapa a medir')
+
+    print(json.dumps(summary, indent=1))
+    if args.output:
+        write_results(args.output, results, summary, **params)
@@ -0,0 +1,68 @@
+# coding: utf-8
+"""Punto de entrada único para los scripts de indicadores.
+
+Cada subcomando importa su módulo solo cuando se usa, para que la ayuda y
+las corridas que no necesitan spacy, gensim o plotly arranquen rápido.
+"""
+import argparse
+import importlib
+import sys
+
+# subcomando: (módulo con add_arguments y main, descripción)
+COMMANDS = {
+    'score': ('isref', 'Calcula ISREF de docs ubicados en dirdocs'),
+    'readability': ('readability', 'Calcula Complejidad del Lenguaje de docs ubicados en dirdocs'),
+    'extract': ('extraction', 'Extrae texto de documentos ubicados en dirinput usando TIKA'),
+    'topics': ('topics', 'Crea corpus y modelos de tópicos de docs ubicados en dirdocs'),
+    'batch': ('batch', 'Calcula ISREF y Complejidad del Lenguaje de varios corpus'),
+    'stream': ('stream', 'Extrae y calcula indicadores de documentos nuevos en dirinput'),
+}
+
+
+def build_parser(command=None):
+    """
+    Construye parser de línea de comandos. Solo se importa el módulo de command
+    para agregar sus argumentos; los demás subcomandos quedan sin argumentos.
+
+    Parameters
+    ----------
+    command: str, optional
+
+    Returns
+    -------
+    argparse.ArgumentParser
+    """
+    description = """Calcula indicadores de Reportes de Estabilidad Financiera"""
+    parser = argparse.ArgumentParser(prog='cli.py', description=description)
+    subparsers = parser.add_subparsers(dest='command')
+    for name, (module, desc) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=desc, description=desc)
+        if name == command:
+            importlib.import_module(module).add_arguments(subparser)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Ejecuta el subcomando indicado en argv.
+
+    Parameters
+    ----------
+    argv: list of str, optional
+        Default: sys.argv[1:]
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv and argv[0] in COMMANDS else None
+
+    parser = build_parser(command)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        parser.exit()
+
+    importlib.import_module(COMMANDS[args.command][0]).main(args)
+
+
+if __name__ == '__main__':
+    main()
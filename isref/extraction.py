@@ -1,28 +1,150 @@
 # coding: utf-8
 """Modulo para extraer texto de archivos binarios."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import argparse
 import csv
 import os
-import sys
+import threading
 import time
 import warnings
 
-from tika import unpack
-from tika import language
+from requests.adapters import HTTPAdapter
+import requests
 
 
-def extract(filepath):
+class TikaClient:
+    """
+    Cliente del TIKA Rest Server que reutiliza conexiones HTTP entre documentos.
+    Puede compartirse entre hilos: mantiene hasta workers conexiones abiertas.
+    El idioma se detecta con los primeros sample caracteres del texto,
+    en lugar de volver a enviar el texto completo al servidor.
+    Lleva la cuenta de bytes enviados y recibidos.
+    """
+
+    def __init__(self, url=None, workers=1, timeout=300, sample=20000):
+        url = url or os.environ.get('TIKA_SERVER_ENDPOINT', 'http://localhost:9998')
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.sample = sample
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def _count(self, sent, resp):
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += len(resp.content)
+
+    def parse(self, filepath):
+        """
+        Extrae contenido y metadata de archivo en filepath en una sola llamada (/rmeta/text).
+
+        Parameters
+        ----------
+        filepath: str
+
+        Returns
+        -------
+        tuple (str, dict)
+        """
+        with open(filepath, 'rb') as f:
+            resp = self.session.put(f'{self.url}/rmeta/text', data=f,
+                                    headers={'Accept': 'application/json'},
+                                    timeout=self.timeout)
+        self._count(os.path.getsize(filepath), resp)
+        resp.raise_for_status()
+        metadata = resp.json()[0]
+        text = metadata.pop('X-TIKA:content', None) or ''
+
+        return text, metadata
+
+    def language(self, text):
+        """
+        Detecta idioma de text, usando solo los primeros self.sample caracteres
+        (todo el texto si self.sample es None o 0).
+
+        Parameters
+        ----------
+        text: str
+
+        Returns
+        -------
+        str
+        """
+        if self.sample:
+            text = sample_text(text, self.sample)
+        data = text.encode('utf-8')
+        resp = self.session.put(f'{self.url}/language/string', data=data,
+                                timeout=self.timeout)
+        self._count(len(data), resp)
+        resp.raise_for_status()
+
+        return resp.text.strip()
+
+
+def use_tika_server(url):
+    """
+    Apunta la librería tika (extract sin TikaClient) a url, sin descargar ni
+    iniciar un servidor propio. La librería lee estas variables al importarse,
+    así que debe llamarse antes de la primera extracción.
+
+    Parameters
+    ----------
+    url: str
+    """
+    os.environ['TIKA_SERVER_ENDPOINT'] = url
+    os.environ['TIKA_CLIENT_ONLY'] = 'True'
+
+
+def sample_text(text, size):
+    """
+    Primeros size caracteres de text, cortando en el último espacio
+    para no enviar palabras incompletas.
+
+    Parameters
+    ----------
+    text: str
+    size: int
+
+    Returns
+    -------
+    str
+    """
+    if len(text) <= size:
+        return text
+
+    cut = text.rfind(' ', 0, size)
+
+    return text[:cut if cut > 0 else size]
+
+
+def extract(filepath, client=None):
     """
     De un archivo en filepath, extraer contenido, metadata e idioma.
 
     Parameters
     ----------
     filepath: str
+    client: TikaClient, optional
+        Si no se da, usa la librería tika (una conexión nueva por llamada).
 
     Returns
     -------
     dict ('contenido'(str), 'metadata'(dict), 'idioma'(str))
     """
+    if client is not None:
+        text, metadata = client.parse(filepath)
+        lang = client.language(text) if text else ''
+        return dict(text=text, metadata=metadata, lang=lang)
+
+    from tika import language, unpack
+
     parsed = unpack.from_file(filepath)
     text = parsed.get('content')
     lang = language.from_buffer(text)
@@ -32,6 +154,12 @@ def extract(filepath):
     return info
 
 
+# formatos a extraer y llaves de metadata con número de páginas y fecha de creación
+FORMATOS = ('.pdf', '.doc', '.docx')
+KPGS = ('xmpTPg:NPages', 'meta:page-count', 'Page-Count')
+KCDT = ('Creation-Date', 'meta:creation-date', 'date')
+
+
 def get_metavalue(meta, keys):
     """
     Saca valor de un diccionario según posibles keys presentes.
@@ -44,6 +172,8 @@ def get_metavalue(meta, keys):
     Returns
     -------
     str
+        Si el valor es una lista (metadata repetida, como varias fechas en
+        /rmeta), el primer elemento no vacío.
     """
     assert type(keys) is tuple
 
@@ -51,6 +181,8 @@ def get_metavalue(meta, keys):
     val = meta.get(first) if first in meta else meta.get(second)
     if not val:
         val = meta.get(third)
+    if isinstance(val, list):
+        val = next((v for v in val if v), '')
 
     return val
 
@@ -71,54 +203,153 @@ def append_to_processed(filepath, data):
         writer.writerow(data)
 
 
-if __name__ == '__main__':
+def save_extracted(filepath, info, dir_output, text=True, processed=True):
+    """
+    Guarda texto extraído de filepath en dir_output/<nombre>.txt y agrega
+    nombre, fecha, idioma y páginas a dir_output/procesados.csv.
+
+    Parameters
+    ----------
+    filepath: Path
+    info: dict (text, metadata, lang)
+    dir_output: str
+    text: bool
+        Si es False no guarda el texto.
+    processed: bool
+        Si es False no agrega fila a procesados.csv.
+    """
+    outname = f'{filepath.stem}.txt'
+    if text:
+        with open(os.path.join(dir_output, outname), "w", encoding='utf-8') as out:
+            out.write(info.get('text'))
+
+    if processed:
+        meta = info.get('metadata') or {}
+        paginas = get_metavalue(meta, KPGS) if meta else ''
+        fecha = get_metavalue(meta, KCDT) if meta else ''
+        datos = (outname, fecha, info.get('lang') or '', paginas)
+        append_to_processed(os.path.join(dir_output, 'procesados.csv'), datos)
+
+
+def safe_extract(filepath, client=None):
+    """
+    Llama extract, devolviendo dict vacío si falla la extracción.
+
+    Parameters
+    ----------
+    filepath: Path
+    client: TikaClient, optional
+
+    Returns
+    -------
+    dict
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            info = extract(filepath=str(filepath), client=client)
+
+    except Exception as e:
+        info = {}
+        logstr = 'TIKA {}:{}'.format(filepath, e)
+        print(logstr)
+
+    return info
+
+
+def bounded_map(executor, fn, items, window):
+    """
+    Como executor.map, pero con máximo window tareas pendientes a la vez,
+    para no acumular en memoria resultados de todo el directorio.
+
+    Parameters
+    ----------
+    executor: concurrent.futures.Executor
+    fn: callable
+    items: iterable
+    window: int
+
+    Yields
+    ------
+    tuple (item, resultado)
+        En el orden de items.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= window:
+            first, future = pending.popleft()
+            yield first, future.result()
+
+    while pending:
+        first, future = pending.popleft()
+        yield first, future.result()
+
+
+def add_arguments(parser):
+    """
+    Agrega a parser los argumentos de línea de comandos de extraction.
+    """
+    desc_dirinput = "Ubicación de los documentos"
+    parser.add_argument("dirinput", help=desc_dirinput)
+    desc_workers = "Número de documentos a extraer en paralelo (usa conexiones reutilizables)"
+    parser.add_argument("--workers", type=int, help=desc_workers)
+    desc_server = "URL del TIKA Rest Server (default: TIKA_SERVER_ENDPOINT o http://localhost:9998)"
+    parser.add_argument("--server", help=desc_server)
+    desc_sample = "Caracteres de texto usados para detectar idioma con --workers (0: todo el texto)"
+    parser.add_argument("--sample", type=int, default=20000, help=desc_sample)
+
+
+def main(args):
+    """
+    Extrae texto de documentos ubicados en args.dirinput a la carpeta corpus.
+    """
     inicio = time.time()
-    dir_input = sys.argv[1]
+    dir_input = args.dirinput
     dir_output = os.path.join(dir_input, 'corpus')
     os.makedirs(dir_output, exist_ok=True)
 
-    formatos = ('.pdf', '.doc', '.docx')
-    kpgs = ('xmpTPg:NPages', 'meta:page-count', 'Page-Count')
-    kcdt = ('Creation-Date', 'meta:creation-date', 'date')
-    procfile = os.path.join(dir_output, 'procesados.csv')
     bien = 0
     mal = 0
 
     path_input = Path(dir_input)
-    for f in path_input.iterdir():
-        if f.suffix.lower() in formatos:
-            outname = f'{f.stem}.txt'
-            outfile = os.path.join(dir_output, outname)
-            if not os.path.isfile(outfile):
-                try:
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore", category=RuntimeWarning)
-                        info = extract(filepath=str(f))
-
-                except Exception as e:
-                    info = {}
-                    logstr = 'TIKA {}:{}'.format(f, e)
-                    print(logstr)
-
-                texto = info.get('text') if info else ''
-                idioma = info.get('lang') if info else ''
-                meta = info.get('metadata') if info else {}
-                paginas = get_metavalue(meta, kpgs) if meta else ''
-                fecha = get_metavalue(meta, kcdt) if meta else ''
-
-                if texto:
-                    bien += 1
-                    with open(outfile, "w", encoding='utf-8') as out:
-                        out.write(texto)
-
-                    datos = (outname, fecha, idioma, paginas)
-                    append_to_processed(procfile, datos)
-
-                else:
-                    mal += 1
+    pendientes = (f for f in path_input.iterdir()
+                  if f.suffix.lower() in FORMATOS and
+                  not os.path.isfile(os.path.join(dir_output, f'{f.stem}.txt')))
+
+    if args.workers:
+        client = TikaClient(args.server, workers=args.workers, sample=args.sample)
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+        extraidos = bounded_map(executor, lambda f: safe_extract(f, client),
+                                pendientes, window=2 * args.workers)
+    else:
+        if args.server:
+            use_tika_server(args.server)
+        executor = None
+        extraidos = ((f, safe_extract(f)) for f in pendientes)
+
+    # si la extracción falla a medias, se espera a las (máximo 2 * workers)
+    # tareas pendientes para no dejar hilos vivos
+    try:
+        for f, info in extraidos:
+            if info and info.get('text'):
+                bien += 1
+                save_extracted(f, info, dir_output)
+            else:
+                mal += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     fin = time.time()
     secs = fin - inicio
 
     logstr = '{:.2f} mins, {} bien y {} mal'.format(secs / 60, bien, mal)
     print(logstr)
+
+
+if __name__ == '__main__':
+    description = """Extrae texto de documentos ubicados en dirinput usando TIKA"""
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,14 +1,18 @@
 # coding: utf-8
 """Modulo para variables y funciones de uso comun."""
+from contextlib import contextmanager
 from pathlib import Path
+import hashlib
+import json
 import logging
+import os
+import re
+import shutil
+import tempfile
+import time
 
-from gensim.corpora import Dictionary
-from gensim.models import Phrases
-from gensim.models.phrases import Phraser
-from unidecode import unidecode
-import pandas as pd
-import spacy
+# gensim, numpy, pandas, spacy y unidecode se importan en las funciones que los usan,
+# para que los scripts arranquen sin cargar librerías que la corrida no necesita.
 
 
 def change_filename(filepath):
@@ -28,6 +32,7 @@ def change_filename(filepath):
     filename = fp.name
 
     if not all(ord(char) < 128 for char in filename):
+        from unidecode import unidecode
         deconame = unidecode(filename)
         newpath = Path(dirpath, deconame)
         fp.rename(newpath)
@@ -67,85 +72,1163 @@ def get_docnames(directory):
     return [fpath.stem for fpath in ordered_filepaths(directory)]
 
 
+# política para bytes que no son utf-8 válido: con una política explícita un
+# error de codificación no aparece a mitad de un documento leído por bloques
+ENCODING_ERRORS = 'replace'
+
+
 def read_text(filepath):
     """
-    Lee texto de archivo en filepath.
+    Lee texto de archivo en filepath. Bytes que no son utf-8 válido se
+    reemplazan por U+FFFD (ENCODING_ERRORS), igual que en read_chunks.
+
+    Parameters
+    ----------
+    filepath: str or Path
+
+    Returns
+    -------
+    str
+       Texto de archivo en filepath
+    """
+    try:
+        with open(filepath, encoding='utf-8', errors=ENCODING_ERRORS) as f:
+                text = f.read()
+    except Exception as e:
+        logging.info(f'Error leyendo {filepath}: {e}')
+        text = ''
+
+    return text
+
+
+# línea en blanco que separa párrafos
+PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n')
+
+
+def read_chunks(filepath, size=100000, digest=None):
+    """
+    Lee texto de archivo en filepath por bloques de al menos size caracteres,
+    cortando al final de un párrafo (línea en blanco). Si no hay fin de párrafo
+    antes de 2 * size caracteres, corta en el último salto de línea y, si tampoco
+    hay, en size caracteres, así que ningún bloque tiene más de 2 * size caracteres.
+    Como read_text, si el archivo no se puede abrir se trata como vacío y bytes que
+    no son utf-8 válido se reemplazan, así que el texto es el mismo en ambos casos.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    size: int
+    digest: hashlib sha1, optional
+        Se actualiza con el texto leído, para obtener text_hash del documento
+        sin volver a leerlo.
+
+    Yields
+    ------
+    str
+    """
+    try:
+        f = open(filepath, encoding='utf-8', errors=ENCODING_ERRORS)
+    except Exception as e:
+        logging.info(f'Error leyendo {filepath}: {e}')
+        return
+
+    limit = 2 * size
+    buffer = ''
+    with f:
+        for block in iter(lambda: f.read(size), ''):
+            if digest is not None:
+                digest.update(block.encode('utf-8'))
+            buffer += block
+            while len(buffer) >= size:
+                match = PARAGRAPH_BREAK.search(buffer, size - 1, limit)
+                if match:
+                    cut = match.end()
+                elif len(buffer) >= limit:
+                    cut = buffer.rfind('\n', 0, limit) + 1 or size
+                else:
+                    break
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+
+    if buffer:
+        yield buffer
+
+
+def file_stat(filepath):
+    """
+    Tamaño y fecha de modificación de filepath, para saber sin leerlo si cambió.
+
+    Parameters
+    ----------
+    filepath: str or Path
+
+    Returns
+    -------
+    list of int
+    """
+    stat = os.stat(filepath)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def text_hash(text):
+    """
+    Calcula huella sha1 de text, usada como llave de cache.
+
+    Parameters
+    ----------
+    text: str
+
+    Returns
+    -------
+    str
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def config_hash(other=None, **options):
+    """
+    Calcula huella de los criterios de filtrado en other y opciones adicionales,
+    para saber si resultados guardados se calcularon con la misma configuración.
+
+    Parameters
+    ----------
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    options: valores serializables en json
+
+    Returns
+    -------
+    str
+    """
+    config = dict(options)
+    for key, value in (other or {}).items():
+        if key == 'stemmer':
+            inner = getattr(value, 'stemmer', value)
+            config[key] = f'{type(value).__name__}:{type(inner).__name__}'
+        else:
+            config[key] = sorted(value)
+
+    return text_hash(json.dumps(config, sort_keys=True))
+
+
+class Manifest:
+    """
+    Registro en json, por documento, de hash de contenido, configuración y resultado.
+    Permite calcular solo documentos nuevos o modificados en corridas posteriores.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = Path(filepath)
+        self.entries = {}
+        if self.filepath.is_file():
+            with open(self.filepath, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def is_current(self, name, **keys):
+        """
+        Indica si hay resultado de name calculado con los mismos valores en keys.
+        """
+        entry = self.entries.get(name)
+
+        return entry is not None and all(entry.get(k) == v for k, v in keys.items())
+
+    def known_hash(self, name, stat):
+        """
+        Hash guardado del texto de name si el archivo tiene el mismo stat
+        (file_stat) que cuando se calculó, o None si hay que leerlo.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry.get('stat') != stat:
+            return None
+
+        return entry.get('hash')
+
+    def result(self, name):
+        return self.entries[name]['result']
+
+    def update(self, name, result, **keys):
+        self.entries[name] = dict(keys, result=result)
+
+    def prune(self, names):
+        """
+        Elimina documentos que no están en names.
+        """
+        names = set(names)
+        self.entries = {k: v for k, v in self.entries.items() if k in names}
+
+    def save(self):
+        tmp = self.filepath.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as out:
+            json.dump(self.entries, out, ensure_ascii=False, indent=1)
+        tmp.replace(self.filepath)
+
+
+class ResultStore:
+    """
+    Resultados en formato Parquet particionados por corpus y configuración:
+    <directorio>/<tabla>/corpus=<corpus>/config=<config>/part.parquet.
+    Cada corrida reescribe solo su partición, y quien lee puede elegir
+    columnas y particiones. <tabla>/_configs.json describe cada configuración.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = Path(directorio)
+
+    def partition(self, table, corpus, config):
+        return self.directorio / table / f'corpus={corpus}' / f'config={config}' / 'part.parquet'
+
+    def read_partition(self, table, corpus, config):
+        """
+        Resultados guardados de corpus y config.
+
+        Returns
+        -------
+        pandas.DataFrame or None
+            None si la partición no existe.
+        """
+        import pyarrow.parquet as pq
+
+        fpath = self.partition(table, corpus, config)
+        if not fpath.is_file():
+            return None
+
+        return pq.read_table(str(fpath)).to_pandas()
+
+    def write_partition(self, table, corpus, config, data, description=None):
+        """
+        Reemplaza resultados de corpus y config con data. Escribe a archivos
+        temporales y luego los renombra, para no dejar particiones ni
+        _configs.json incompletos.
+
+        Parameters
+        ----------
+        table: str
+        corpus: str
+        config: str
+        data: pandas.DataFrame
+        description: dict, optional
+            Opciones de la configuración, guardadas en _configs.json.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fpath = self.partition(table, corpus, config)
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fpath.with_suffix('.tmp')
+        pq.write_table(pa.Table.from_pandas(data, preserve_index=False), str(tmp))
+        tmp.replace(fpath)
+
+        if description is not None:
+            configs = self.directorio / table / '_configs.json'
+            try:
+                with open(configs, encoding='utf-8') as f:
+                    described = json.load(f)
+            except FileNotFoundError:
+                described = {}
+            described[config] = description
+            tmp = configs.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as out:
+                json.dump(described, out, ensure_ascii=False, indent=1, sort_keys=True)
+            tmp.replace(configs)
+
+    def append(self, table, corpus, config, data, description=None):
+        """
+        Agrega filas de data a resultados de corpus y config.
+        """
+        import pandas as pd
+
+        existing = self.read_partition(table, corpus, config)
+        if existing is not None:
+            data = pd.concat([existing, data], ignore_index=True)
+
+        self.write_partition(table, corpus, config, data, description)
+
+    def upsert(self, table, corpus, config, data, key='doc', keep=None, description=None):
+        """
+        Agrega filas de data a resultados de corpus y config, reemplazando
+        filas guardadas con el mismo valor de key.
+
+        Parameters
+        ----------
+        table: str
+        corpus: str
+        config: str
+        data: pandas.DataFrame
+        key: str
+        keep: iterable, optional
+            Si se da, elimina filas cuyo valor de key no está en keep.
+        description: dict, optional
+        """
+        import pandas as pd
+
+        existing = self.read_partition(table, corpus, config)
+        if existing is not None:
+            existing = existing[~existing[key].isin(data[key])]
+            data = pd.concat([existing, data], ignore_index=True)
+        if keep is not None:
+            data = data[data[key].isin(list(keep))]
+        data = data.sort_values(key, kind='mergesort')
+
+        self.write_partition(table, corpus, config, data, description)
+
+    def read(self, table, columns=None, corpus=None, config=None):
+        """
+        Lee resultados de table, solo de columns y de particiones de corpus y config si se dan.
+
+        Parameters
+        ----------
+        table: str
+        columns: list of str, optional
+            Pueden incluir corpus y config.
+        corpus: str or list of str, optional
+        config: str or list of str, optional
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        import pyarrow.parquet as pq
+
+        filters = []
+        for name, value in (('corpus', corpus), ('config', config)):
+            if isinstance(value, str):
+                filters.append((name, '=', value))
+            elif value is not None:
+                filters.append((name, 'in', list(value)))
+
+        data = pq.read_table(str(self.directorio / table), columns=columns,
+                             filters=filters or None)
+
+        return data.to_pandas()
+
+
+def directory_fingerprint(directory):
+    """
+    Huella barata de los documentos en directory: nombre, tamaño y fecha de modificación.
+
+    Parameters
+    ----------
+    directory: str or Path
+
+    Returns
+    -------
+    str
+    """
+    files = []
+    for fpath in ordered_filepaths(directory):
+        stat = fpath.stat()
+        files.append([fpath.name, stat.st_size, stat.st_mtime_ns])
+
+    return text_hash(json.dumps(files))
+
+
+def load_language(name, other=None, parser=False):
+    """
+    Carga modelo name de spacy con los componentes mínimos que necesitan
+    los filtros en other: tagger solo si hay postags y ner solo si hay entities.
+    Sin parser, las frases se segmentan con el sentencizer basado en reglas.
+
+    Parameters
+    ----------
+    name: str
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    parser: bool
+        Si es True conserva el parser para segmentar frases.
+
+    Returns
+    -------
+    spacy.lang
+    """
+    other = other or {}
+    disable = []
+    if 'postags' not in other:
+        disable.append('tagger')
+    if 'entities' not in other:
+        disable.append('ner')
+    if not parser:
+        disable.append('parser')
+
+    import spacy
+
+    lang = spacy.load(name, disable=disable)
+    if not parser:
+        lang.add_pipe(lang.create_pipe('sentencizer'), first=True)
+
+    return lang
+
+
+def pipeline_fingerprint(lang):
+    """
+    Identifica modelo, versión y componentes del pipeline de lang.
+
+    Parameters
+    ----------
+    lang: spacy.lang
+
+    Returns
+    -------
+    str
+    """
+    meta = lang.meta
+    pipes = '+'.join(lang.pipe_names) or 'tokenizer'
+
+    return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}-{pipes}"
+
+
+def doc_attrs(lang):
+    """
+    Atributos de token a serializar según los componentes del pipeline de lang.
+    Si no hay parser, las frases se conservan con SENT_START.
+
+    Parameters
+    ----------
+    lang: spacy.lang
+
+    Returns
+    -------
+    list of str
+    """
+    attrs = ['ORTH', 'TAG', 'POS', 'LEMMA', 'ENT_IOB', 'ENT_TYPE']
+    if 'parser' in lang.pipe_names:
+        attrs.extend(['HEAD', 'DEP'])
+    else:
+        attrs.append('SENT_START')
+
+    return attrs
+
+
+class DocCache:
+    """
+    Cache en disco de documentos procesados por spacy.
+    Cada documento se guarda como DocBin, identificado por el hash de su texto,
+    en una subcarpeta propia del modelo y pipeline que lo procesó.
+    """
+
+    def __init__(self, directorio, lenguaje):
+        self.lenguaje = lenguaje
+        self.atributos = doc_attrs(lenguaje)
+        self.directorio = Path(directorio, pipeline_fingerprint(lenguaje))
+        self.directorio.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        return self.directorio / f'{key}.spacy'
+
+    def __contains__(self, key):
+        return self.path(key).is_file()
+
+    def load(self, key):
+        """
+        Deserializa documento guardado con llave key.
+
+        Returns
+        -------
+        spacy.tokens.Doc
+        """
+        from spacy.tokens import DocBin
+
+        docbin = DocBin().from_bytes(self.path(key).read_bytes())
+
+        return next(docbin.get_docs(self.lenguaje.vocab))
+
+    def save(self, key, doc):
+        """
+        Serializa doc con llave key. Escribe a archivo temporal y luego lo
+        renombra, para no dejar archivos incompletos si el proceso se interrumpe.
+        """
+        from spacy.tokens import DocBin
+
+        docbin = DocBin(attrs=self.atributos)
+        docbin.add(doc)
+
+        # nombre temporal único: varios procesos pueden guardar el mismo documento a la vez
+        with tempfile.NamedTemporaryFile(dir=self.directorio, suffix='.tmp', delete=False) as out:
+            out.write(docbin.to_bytes())
+        Path(out.name).replace(self.path(key))
+
+
+def load_doc(filepath, lang, cache=None):
+    """
+    Lee y procesa con lang el texto de archivo en filepath.
+    Si hay cache, solo procesa documentos cuyo texto no esté en ella.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    lang: spacy.lang
+    cache: DocCache, optional
+
+    Returns
+    -------
+    spacy.tokens.Doc
+    """
+    return parse_text(read_text(filepath), lang, cache, name=filepath)
+
+
+def parse_text(text, lang, cache=None, name=None):
+    """
+    Procesa text con lang. Si hay cache, solo procesa textos que no estén en ella.
+
+    Parameters
+    ----------
+    text: str
+    lang: spacy.lang
+    cache: DocCache, optional
+    name: str or Path, optional
+        Nombre del documento para el log.
+
+    Returns
+    -------
+    spacy.tokens.Doc
+    """
+    if cache is None:
+        return lang(text)
+
+    key = text_hash(text)
+    if key in cache:
+        try:
+            return cache.load(key)
+        except Exception as e:
+            logging.info(f'Error leyendo cache de {name}: {e}')
+
+    doc = lang(text)
+    cache.save(key, doc)
+
+    return doc
+
+
+def iter_parsed(filepaths, lang, cache=None, n_process=1, batch_size=4, profiler=None,
+                hashes=None):
+    """
+    Procesa con lang.pipe los textos de archivos en filepaths,
+    en lotes de batch_size y usando n_process procesos.
+    Documentos que ya están en cache no se vuelven a procesar.
+
+    Parameters
+    ----------
+    filepaths: iterable of str or Path
+    lang: spacy.lang
+    cache: DocCache, optional
+    n_process: int
+    batch_size: int
+    profiler: Profiler, optional
+        Registra etapas read, load (cache) y parse de cada documento.
+        Con lotes, parse del primer documento incluye la espera (y lectura) de todo el lote.
+    hashes: dict, optional
+        Si se da, recibe text_hash del texto de cada documento leído (llave: nombre).
+
+    Yields
+    ------
+    tuple (Path, spacy.tokens.Doc)
+        En el mismo orden de filepaths.
+    """
+    profiler = profiler or NULL_PROFILER
+
+    def texts():
+        # cada archivo se lee una sola vez; los que están en cache pasan por
+        # pipe como texto vacío y su texto queda en el contexto por si falla el cache
+        for fpath in filepaths:
+            fpath = Path(fpath)
+            with profiler.stage(fpath.stem, 'read') as record:
+                text = read_text(fpath)
+                if profiler.enabled:
+                    record['bytes'] = fpath.stat().st_size
+            key = text_hash(text) if cache is not None or hashes is not None else None
+            if hashes is not None:
+                hashes[fpath.stem] = key
+            if cache is not None and key in cache:
+                yield '', (fpath, key, text)
+            else:
+                yield text, (fpath, key, None)
+
+    parsed = iter(lang.pipe(texts(), as_tuples=True,
+                            n_process=n_process, batch_size=batch_size))
+
+    while True:
+        inicio = time.perf_counter()
+        item = next(parsed, None)
+        if item is None:
+            return
+        doc, (fpath, key, text) = item
+
+        if text is not None:
+            with profiler.stage(fpath.stem, 'load') as record:
+                try:
+                    doc = cache.load(key)
+                except Exception as e:
+                    logging.info(f'Error leyendo cache de {fpath.stem}: {e}')
+                    doc = lang(text)
+                    cache.save(key, doc)
+                record['tokens'] = len(doc)
+            yield fpath, doc
+            continue
+
+        profiler.add(fpath.stem, 'parse', time.perf_counter() - inicio, tokens=len(doc))
+        if cache is not None:
+            cache.save(key, doc)
+
+        yield fpath, doc
+
+
+class Profiler:
+    """
+    Registra tiempo, tokens y bytes de cada etapa de cada documento,
+    y los guarda en json con resumen de los documentos más lentos.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, doc, name):
+        """
+        Mide tiempo de la etapa name del documento doc (None para todo el corpus).
+        El dict entregado puede recibir tokens y bytes procesados.
+        """
+        record = dict(doc=doc, stage=name)
+        inicio = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - inicio
+            self.records.append(record)
+
+    def add(self, doc, name, seconds, **stats):
+        """
+        Registra etapa name del documento doc medida fuera de stage.
+        """
+        self.records.append(dict(stats, doc=doc, stage=name, seconds=seconds))
+
+    def summary(self, top=10):
+        """
+        Segundos totales por etapa y documentos más lentos.
+
+        Returns
+        -------
+        dict (stages, slowest)
+        """
+        stages = {}
+        docs = {}
+        for record in self.records:
+            stages[record['stage']] = stages.get(record['stage'], 0) + record['seconds']
+            if record['doc'] is not None:
+                docs[record['doc']] = docs.get(record['doc'], 0) + record['seconds']
+
+        slowest = sorted(docs.items(), key=lambda item: item[1], reverse=True)[:top]
+
+        return dict(stages=stages, slowest=[dict(doc=d, seconds=s) for d, s in slowest])
+
+    def save(self, filepath):
+        """
+        Guarda registros y resumen en filepath, y escribe el resumen en el log.
+        """
+        summary = self.summary()
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+        with open(filepath, 'w', encoding='utf-8') as out:
+            json.dump(dict(summary=summary, records=self.records), out, indent=1)
+
+        for name, secs in summary['stages'].items():
+            logging.info(f'Etapa {name}: {secs:.2f} segundos')
+        for item in summary['slowest']:
+            logging.info(f'Documento lento {item["doc"]}: {item["seconds"]:.2f} segundos')
+
+
+class NullProfiler:
+    """
+    Profiler que no registra nada, usado cuando la instrumentación está apagada.
+    Quien mide tokens o bytes revisa enabled para no calcularlos.
+    """
+    enabled = False
+
+    class _Stage:
+        def __enter__(self):
+            return {}
+
+        def __exit__(self, *exc):
+            return False
+
+    _stage = _Stage()
+
+    def stage(self, doc, name):
+        return self._stage
+
+    def add(self, doc, name, seconds, **stats):
+        pass
+
+    def save(self, filepath):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def get_profiler(enabled=False):
+    """
+    Profiler si enabled o si está definida la variable de entorno ISREF_PROFILE,
+    de lo contrario NullProfiler.
+
+    Parameters
+    ----------
+    enabled: bool
+
+    Returns
+    -------
+    Profiler or NullProfiler
+    """
+    if enabled or os.environ.get('ISREF_PROFILE'):
+        return Profiler()
+
+    return NULL_PROFILER
+
+
+def load_stopwords(filepath, sheet, col='word'):
+    """
+    Lee lista de palabras a usar como stopwords.
+    Ubicadas en columna col de la hoja sheet del archivo Excel en filepath.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    sheet: str
+    col: str
+
+    Returns
+    -------
+    set
+       Stopwords. Se ignoran celdas vacías o que no son texto.
+    """
+    import pandas as pd
+
+    df = pd.read_excel(filepath, sheet_name=sheet)
+
+    return {w for w in df[col] if isinstance(w, str) and w}
+
+
+def hash_ids(words):
+    """
+    Ids del vocabulario de spacy (como vocab.strings[word]) de words, sin cargar
+    un modelo: el id de símbolo para palabras que son símbolos de spacy
+    (por ejemplo "number" o "root") y el hash de las demás.
+
+    Parameters
+    ----------
+    words: iterable of str
+
+    Returns
+    -------
+    numpy.ndarray
+        Ids uint64 ordenados y sin repetir.
+    """
+    import numpy as np
+    from spacy.strings import hash_string
+    from spacy.symbols import IDS
+
+    ids = [IDS[w] if w in IDS else hash_string(w) for w in words]
+
+    return np.unique(np.array(ids, dtype=np.uint64))
+
+
+class WordSet(frozenset):
+    """
+    Conjunto inmutable de palabras con sus ids de spacy en ids, para
+    comparar tokens por id sin convertirlos a texto.
+    """
+
+    def __new__(cls, words, ids=None):
+        self = super().__new__(cls, words)
+        self.ids = hash_ids(self) if ids is None else ids
+
+        return self
+
+    def __reduce__(self):
+        return type(self), (list(self), self.ids)
+
+    @property
+    def id_set(self):
+        """
+        ids como set de int, para buscar tokens uno por uno. Se calcula una sola vez.
+        """
+        id_set = self.__dict__.get('_id_set')
+        if id_set is None:
+            id_set = self._id_set = set(self.ids.tolist())
+
+        return id_set
+
+
+# cambiar si cambia el contenido de los archivos de compile_lexicon
+LEXICON_VERSION = 2
+LEXICON_KEYS = ('positive', 'negative', 'stopwords')
+
+
+def source_fingerprint(filepaths):
+    """
+    Huella barata de filepaths: ruta, tamaño y fecha de modificación.
+
+    Parameters
+    ----------
+    filepaths: list of str or Path or None
+
+    Returns
+    -------
+    str
+    """
+    files = []
+    for fpath in filepaths:
+        if fpath is not None:
+            stat = os.stat(fpath)
+            files.append([str(Path(fpath).resolve()), stat.st_size, stat.st_mtime_ns])
+
+    return text_hash(json.dumps(files))
+
+
+def compile_lexicon(filepath, wdfile=None, stopsfile=None, sheet='english', col='word'):
+    """
+    Compila palabras positivas y negativas de wdfile (json) y stopwords de la
+    columna col de la hoja sheet de stopsfile (excel) en un archivo npz en filepath,
+    con las palabras y sus ids de spacy.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    wdfile: str or Path, optional
+    stopsfile: str or Path, optional
+    sheet: str
+    col: str
+
+    Returns
+    -------
+    dict of WordSet (positive, negative, stopwords)
+    """
+    import numpy as np
+
+    words = dict(positive=[], negative=[], stopwords=[])
+    if wdfile is not None:
+        with open(wdfile, encoding='utf-8') as f:
+            diction = json.load(f)
+        words['positive'] = diction.get('positive') or []
+        words['negative'] = diction.get('negative') or []
+    if stopsfile is not None:
+        words['stopwords'] = load_stopwords(stopsfile, sheet, col=col)
+
+    lexicon = {key: WordSet(w for w in values if isinstance(w, str) and w)
+               for key, values in words.items()}
+
+    meta = dict(version=LEXICON_VERSION, sheet=sheet, col=col,
+                sources=source_fingerprint([wdfile, stopsfile]))
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for key, wordset in lexicon.items():
+        arrays[key] = np.array(sorted(wordset), dtype=str)
+        arrays[f'{key}_ids'] = wordset.ids
+
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(f'{filepath}.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, filepath)
+
+    return lexicon
+
+
+def load_lexicon(wdfile=None, stopsfile=None, sheet='english', col='word', directorio='lexicon'):
+    """
+    Palabras positivas, negativas y stopwords compiladas con compile_lexicon en
+    directorio. Se vuelven a compilar si no existen, si wdfile o stopsfile
+    cambiaron o si son de otra versión de LEXICON_VERSION.
+
+    Parameters
+    ----------
+    wdfile: str or Path, optional
+    stopsfile: str or Path, optional
+    sheet: str
+    col: str
+    directorio: str or Path
+
+    Returns
+    -------
+    dict of WordSet (positive, negative, stopwords)
+    """
+    import numpy as np
+
+    sources = [wdfile, stopsfile]
+    names = '-'.join(Path(fpath).stem for fpath in sources if fpath is not None)
+    key = config_hash(sources=[str(Path(fpath).resolve()) if fpath else None for fpath in sources],
+                      sheet=sheet, col=col)
+    filepath = Path(directorio, f'{names or "vacio"}-{key[:8]}.npz')
+
+    if filepath.is_file():
+        with np.load(filepath) as data:
+            meta = json.loads(str(data['meta']))
+            if (meta.get('version') == LEXICON_VERSION and
+                    meta.get('sources') == source_fingerprint(sources)):
+                return {k: WordSet(data[k].tolist(), data[f'{k}_ids']) for k in LEXICON_KEYS}
+
+    return compile_lexicon(filepath, wdfile, stopsfile, sheet=sheet, col=col)
+
+
+def process_tokens(container, other=None):
+    """
+    Procesa tokens del container, filtrando según criterios en other.
+
+    Parameters
+    ----------
+    container: spacy.tokens.Doc | spacy.tokens.Span
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Returns
+    -------
+    list of str
+    """
+    tokens = (tok for tok in container if tok.is_alpha)
+
+    if other:
+        if isinstance(other.get('stopwords'), WordSet):
+            stop_ids = other['stopwords'].id_set
+            tokens = (tok for tok in tokens if tok.lower not in stop_ids)
+        elif 'stopwords' in other:
+            tokens = (
+                tok for tok in tokens if tok.lower_ not in other['stopwords'])
+        if 'postags' in other:
+            tokens = (tok for tok in tokens if tok.pos_ in other['postags'])
+        if 'entities' in other:
+            tokens = (
+                tok for tok in tokens if tok.ent_type_ not in other['entities'])
+
+    wordlist = [tok.lower_ for tok in tokens]
+    if other and 'stemmer' in other:
+        wordlist = [other['stemmer'].stem(w) for w in wordlist]
+
+    return wordlist
+
+
+def token_mask(container, other=None):
+    """
+    Todas las palabras en minúscula (o sus raíces, si hay stemmer) del container
+    y cuáles pasan los filtros de other, como en process_tokens.
+
+    Parameters
+    ----------
+    container: spacy.tokens.Doc | spacy.tokens.Span
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Returns
+    -------
+    tuple (list of str, list of bool)
+    """
+    other = other or {}
+    stopwords = other.get('stopwords')
+    postags = other.get('postags')
+    entities = other.get('entities')
+
+    words, keep = [], []
+    for tok in container:
+        words.append(tok.lower_)
+        keep.append(tok.is_alpha and
+                    (stopwords is None or tok.lower_ not in stopwords) and
+                    (postags is None or tok.pos_ in postags) and
+                    (entities is None or tok.ent_type_ not in entities))
+    if 'stemmer' in other:
+        words = [other['stemmer'].stem(w) for w in words]
+
+    return words, keep
+
+
+class TokenFilter:
+    """
+    Criterios de other compilados a arreglos de ids (hash o símbolo) del vocabulario
+    de spacy, para filtrar todos los tokens de un documento con máscaras de numpy.
+    Guarda cache de id a palabra (o a su raíz, si hay stemmer).
+    """
+
+    def __init__(self, vocab, other=None):
+        other = other or {}
+        self.vocab = vocab
+        self.stopwords = self._ids(other.get('stopwords'))
+        self.postags = self._ids(other.get('postags'))
+        self.entities = self._ids(other.get('entities'))
+        self.stemmer = other.get('stemmer')
+        self.words = {}
+
+    def _ids(self, values):
+        import numpy as np
+
+        if values is None:
+            return None
+        if isinstance(values, WordSet):
+            return values.ids
+        ids = [self.vocab.strings[v] for v in values if isinstance(v, str) and v]
+
+        return np.array(ids, dtype=np.uint64)
+
+    def mask(self, doc):
+        """
+        Lowercase id de cada token de doc y máscara de tokens que pasan los filtros.
+
+        Parameters
+        ----------
+        doc: spacy.tokens.Doc
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+        """
+        import numpy as np
+        from spacy.attrs import ENT_TYPE, IS_ALPHA, LOWER, POS
+
+        attrs = doc.to_array([IS_ALPHA, LOWER, POS, ENT_TYPE]).reshape(-1, 4)
+        keep = attrs[:, 0] == 1
+        if self.stopwords is not None:
+            keep &= ~np.isin(attrs[:, 1], self.stopwords)
+        if self.postags is not None:
+            keep &= np.isin(attrs[:, 2], self.postags)
+        if self.entities is not None:
+            keep &= ~np.isin(attrs[:, 3], self.entities)
+
+        return attrs[:, 1], keep
+
+    def word(self, lower):
+        """
+        Palabra (o raíz) correspondiente al id lower.
+        """
+        word = self.words.get(lower)
+        if word is None:
+            word = self.vocab.strings[lower]
+            if self.stemmer is not None:
+                word = self.stemmer.stem(word)
+            self.words[lower] = word
+
+        return word
+
+
+# TokenFilter por vocab y contenido de other, los usados más recientemente al final
+_FILTERS = {}
+MAX_FILTERS = 16
+
+
+def filter_key(other=None):
+    """
+    Llave del contenido de los criterios en other: cambia si se modifica other
+    o alguno de sus conjuntos de palabras, aunque sean los mismos objetos.
+
+    Parameters
+    ----------
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Returns
+    -------
+    tuple
+    """
+    key = []
+    for name, value in sorted((other or {}).items()):
+        if name == 'stemmer':
+            key.append((name, id(value)))
+        else:
+            # frozenset (y WordSet) guarda su hash, no se vuelve a copiar
+            key.append((name, value if isinstance(value, frozenset) else frozenset(value)))
+
+    return tuple(key)
+
+
+def token_filter(vocab, other=None):
+    """
+    TokenFilter para vocab y other, compilado una sola vez por combinación
+    de vocab y contenido de other (ver filter_key).
+    Se guardan los MAX_FILTERS usados más recientemente.
 
     Parameters
     ----------
-    filepath: str or Path
+    vocab: spacy.vocab.Vocab
+    other: dict, optional (stopwords, postags, entities, stemmer)
 
     Returns
     -------
-    str
-       Texto de archivo en filepath
+    TokenFilter
     """
-    try:
-        with open(filepath, encoding='utf-8') as f:
-                text = f.read()
-    except Exception as e:
-        logging.info(f'Error leyendo {filepath}: {e}')
-        text = ''
+    key = (id(vocab), filter_key(other))
+    stemmer = (other or {}).get('stemmer')
+    cached = _FILTERS.pop(key, None)
+    if cached is None or cached[0] is not vocab or cached[1] is not stemmer:
+        cached = (vocab, stemmer, TokenFilter(vocab, other))
+    _FILTERS[key] = cached
+    while len(_FILTERS) > MAX_FILTERS:
+        del _FILTERS[next(iter(_FILTERS))]
 
-    return text
+    return cached[2]
 
 
-def load_stopwords(filepath, sheet, col='word'):
+def clear_token_filters():
     """
-    Lee lista de palabras a usar como stopwords.
-    Ubicadas en columna col de la hoja sheet del archivo Excel en filepath.
+    Libera los TokenFilter guardados por token_filter.
+    """
+    _FILTERS.clear()
+
+
+# palabras alfabéticas, como tokens con is_alpha de spacy
+WORD_PATTERN = re.compile(r'[^\W\d_]+')
+# palabras alfabéticas, números y signos de puntuación
+TOKEN_PATTERN = re.compile(r'[^\W\d_]+|[\d_]+|[^\w\s]')
+
+
+def fast_tokens(text, other=None):
+    """
+    Palabras en minúscula de text usando una expresión regular, sin spacy,
+    filtrando stopwords y aplicando stemmer según criterios en other.
+    No acepta filtros de postags ni entities, que requieren el modelo de spacy.
 
     Parameters
     ----------
-    filepath: str or Path
-    sheet: str
-    col: str
+    text: str
+    other: dict, optional (stopwords, stemmer)
 
     Returns
     -------
-    set
-       Stopwords
+    list of str
     """
-    df = pd.read_excel(filepath, sheet_name=sheet)
+    other = other or {}
+    if 'postags' in other or 'entities' in other:
+        raise ValueError('fast_tokens no puede filtrar postags ni entities')
 
-    return set(df[col])
+    words = WORD_PATTERN.findall(text.lower())
+    if 'stopwords' in other:
+        stopwords = other['stopwords']
+        words = [w for w in words if w not in stopwords]
+    if 'stemmer' in other:
+        words = [other['stemmer'].stem(w) for w in words]
 
+    return words
 
-def process_tokens(container, other=None):
+
+def fast_token_mask(text, other=None):
     """
-    Procesa tokens del container, filtrando según criterios en other.
+    Todas las palabras, números y signos de puntuación en minúscula (o sus raíces,
+    si hay stemmer) de text y cuáles son palabras que quedan en fast_tokens.
 
     Parameters
     ----------
-    container: spacy.tokens.Doc | spacy.tokens.Span
-    other: dict, optional (stopwords, postags, entities, stemmer)
+    text: str
+    other: dict, optional (stopwords, stemmer)
 
     Returns
     -------
-    list of str
+    tuple (list of str, list of bool)
     """
-    tokens = (tok for tok in container if tok.is_alpha)
-
-    if other:
-        if 'stopwords' in other:
-            tokens = (
-                tok for tok in tokens if tok.lower_ not in other['stopwords'])
-        if 'postags' in other:
-            tokens = (tok for tok in tokens if tok.pos_ in other['postags'])
-        if 'entities' in other:
-            tokens = (
-                tok for tok in tokens if tok.ent_type_ not in other['entities'])
+    other = other or {}
+    if 'postags' in other or 'entities' in other:
+        raise ValueError('fast_token_mask no puede filtrar postags ni entities')
 
-    wordlist = [tok.lower_ for tok in tokens]
-    if other and 'stemmer' in other:
-        wordlist = [other['stemmer'].stem(w) for w in wordlist]
+    words = TOKEN_PATTERN.findall(text.lower())
+    stopwords = other.get('stopwords', ())
+    keep = [w.isalpha() and w not in stopwords for w in words]
+    if 'stemmer' in other:
+        words = [other['stemmer'].stem(w) for w in words]
 
-    return wordlist
+    return words, keep
 
 
 def doc_sentences(document, other=None):
     """
     Itera sobre cada frase de document filtrando según criterios en other.
+    Filtra todos los tokens del documento de una vez con TokenFilter.
 
     Parameters
     ----------
@@ -156,31 +1239,209 @@ def doc_sentences(document, other=None):
     ------
     list of str
     """
+    tfilter = token_filter(document.vocab, other)
+    lowers, keep = tfilter.mask(document)
+    word = tfilter.word
+
+    for sent in document.sents:
+        ids = lowers[sent.start:sent.end][keep[sent.start:sent.end]]
+        yield [word(i) for i in ids.tolist()]
+
+
+def doc_sentence_masks(document, other=None):
+    """
+    Itera sobre cada frase de document con todas sus palabras y cuáles pasan
+    los filtros de other, para buscar expresiones de varias palabras sin juntar
+    palabras separadas por tokens filtrados.
+
+    Parameters
+    ----------
+    document: spacy.tokens.Doc
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Yields
+    ------
+    tuple (list of str, list of bool)
+    """
+    tfilter = token_filter(document.vocab, other)
+    lowers, keep = tfilter.mask(document)
+    word = tfilter.word
+
     for sent in document.sents:
+        yield ([word(i) for i in lowers[sent.start:sent.end].tolist()],
+               keep[sent.start:sent.end].tolist())
+
+
+def chunk_sentences(filepath, lang, size=100000, digest=None):
+    """
+    Procesa con lang el texto de archivo en filepath por bloques de párrafos,
+    sin cargar todo el documento. La última frase de cada bloque se procesa
+    de nuevo con el bloque siguiente, para no cortar frases entre bloques.
+    Si esa frase ya tiene más de size caracteres se entrega tal como quedó al
+    final del bloque, así que una frase más larga que size puede quedar partida
+    en dos; con size mucho mayor que las frases del texto el resultado es el
+    mismo que procesando el documento completo.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    lang: spacy.lang
+    size: int
+        Caracteres aproximados de cada bloque.
+    digest: hashlib sha1, optional
+        Como en read_chunks.
+
+    Yields
+    ------
+    spacy.tokens.Span
+    """
+    carry = ''
+    for chunk in read_chunks(filepath, size, digest):
+        doc = lang(carry + chunk)
+        sents = list(doc.sents)
+        if not sents:
+            carry = ''
+            continue
+
+        yield from sents[:-1]
+
+        carry = doc.text[sents[-1].start_char:]
+        if len(carry) > size:
+            yield sents[-1]
+            carry = ''
+
+    if carry:
+        yield from lang(carry).sents
+
+
+def chunk_doc_sentences(filepath, lang, other=None, size=100000, digest=None):
+    """
+    Itera sobre cada frase del documento en filepath, procesado por bloques,
+    filtrando según criterios en other.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    size: int
+    digest: hashlib sha1, optional
+        Como en read_chunks.
+
+    Yields
+    ------
+    list of str
+    """
+    for sent in chunk_sentences(filepath, lang, size, digest):
         yield process_tokens(sent, other)
 
 
-def model_ngrams(sentences):
+def chunk_doc_sentence_masks(filepath, lang, other=None, size=100000, digest=None):
+    """
+    Como doc_sentence_masks, para el documento en filepath procesado por bloques.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    size: int
+    digest: hashlib sha1, optional
+        Como en read_chunks.
+
+    Yields
+    ------
+    tuple (list of str, list of bool)
+    """
+    for sent in chunk_sentences(filepath, lang, size, digest):
+        yield token_mask(sent, other)
+
+
+def model_ngrams(sentences, ngrams=None):
     """
     Crea modelos Phraser a partir de frase iterables en sentences,
     para identificar ngramas recurrentes.
+    Bigramas se entrenan en una pasada sobre sentences y trigramas en una segunda
+    pasada sobre las frases ya unidas por el modelo de bigramas.
+    Si se da ngrams, actualiza sus modelos Phrases con las frases nuevas en sentences.
 
     Parameters
     ----------
-    sentences: iterable of list of str
+    sentences: iterable of list of str or callable
+        Debe poder recorrerse dos veces: lista, iterable re-iterable o función
+        que devuelve un iterable nuevo en cada llamada. Un generator se carga a memoria.
+    ngrams: dict, optional
+        Modelos creados antes con model_ngrams o load_ngrams.
 
     Returns
     -------
     dict
-        Modelos Phraser para bigramas y trigramas
+        Modelos Phraser para bigramas y trigramas, y modelos Phrases para actualizarlos
     """
-    big = Phrases(sentences, min_count=5, threshold=10)
+    from gensim.models import Phrases
+    from gensim.models.phrases import Phraser
+
+    if callable(sentences):
+        corpus = sentences
+    else:
+        if iter(sentences) is sentences:
+            sentences = list(sentences)
+        corpus = lambda: sentences
+
+    if ngrams is None:
+        big = Phrases(min_count=5, threshold=10)
+        trig = Phrases(min_count=5, threshold=10)
+    else:
+        big, trig = ngrams['phrases']['bigramas'], ngrams['phrases']['trigramas']
+
+    big.add_vocab(corpus())
     model_big = Phraser(big)
 
-    trig = Phrases(model_big[sentences], min_count=5, threshold=10)
+    trig.add_vocab(model_big[tokens] for tokens in corpus())
     model_trig = Phraser(trig)
 
-    return dict(bigramas=model_big, trigramas=model_trig)
+    return dict(bigramas=model_big, trigramas=model_trig,
+                phrases=dict(bigramas=big, trigramas=trig))
+
+
+def save_ngrams(ngrams, directory):
+    """
+    Guarda modelos Phrases de ngrams en directory, para cargarlos y actualizarlos después.
+
+    Parameters
+    ----------
+    ngrams: dict
+    directory: str or Path
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for name, model in ngrams['phrases'].items():
+        model.save(str(Path(directory, f'{name}.phrases')))
+
+
+def load_ngrams(directory):
+    """
+    Carga modelos guardados con save_ngrams.
+
+    Parameters
+    ----------
+    directory: str or Path
+
+    Returns
+    -------
+    dict or None
+        None si no hay modelos guardados en directory.
+    """
+    paths = {name: Path(directory, f'{name}.phrases') for name in ('bigramas', 'trigramas')}
+    if not all(p.is_file() for p in paths.values()):
+        return None
+
+    from gensim.models import Phrases
+    from gensim.models.phrases import Phraser
+
+    phrases = {name: Phrases.load(str(p)) for name, p in paths.items()}
+
+    return dict(bigramas=Phraser(phrases['bigramas']), trigramas=Phraser(phrases['trigramas']),
+                phrases=phrases)
 
 
 def iter_sentences(directory, lang, other=None):
@@ -206,19 +1467,43 @@ def iter_sentences(directory, lang, other=None):
         yield from doc_sentences(doc, other)
 
 
-def iter_documents(ngrams, directory, lang, other=None):
+def iter_doc_sentences(directory, lang, other=None, cache=None, filepaths=None):
     """
     Itera sobre cada documento en directory,
-    devolviendo lista de palabras de cada documento,
+    devolviendo lista de palabras de cada frase del documento,
     filtrando según criterios en other.
-    Listas de palabras pasan por modelos en ngrams.
 
     Parameters
     ----------
-    ngrams: dict (bigramas, trigramas)
     directory: str
     lang: spacy.lang
     other: dict, optional (stopwords, postags, entities, stemmer)
+    cache: DocCache, optional
+    filepaths: list of Path, optional
+        Documentos a procesar. Por defecto todos los de directory.
+
+    Yields
+    ------
+    list of list of str
+    """
+    if filepaths is None:
+        filepaths = ordered_filepaths(directory)
+
+    for fpath in filepaths:
+        doc = load_doc(fpath, lang, cache)
+
+        yield list(doc_sentences(doc, other))
+
+
+def ngram_documents(ngrams, documents):
+    """
+    Une frases de cada documento en documents en una lista de palabras,
+    pasando cada frase por modelos en ngrams.
+
+    Parameters
+    ----------
+    ngrams: dict (bigramas, trigramas)
+    documents: iterable of list of list of str
 
     Yields
     ------
@@ -227,41 +1512,429 @@ def iter_documents(ngrams, directory, lang, other=None):
     bigrams = ngrams['bigramas']
     trigrams = ngrams['trigramas']
 
-    for fpath in ordered_filepaths(directory):
-        text = read_text(fpath)
-        doc = lang(text)
-
+    for sentences in documents:
         words = []
-        for tokens in doc_sentences(doc, other):
+        for tokens in sentences:
             words.extend(trigrams[bigrams[tokens]])
 
         yield words
 
 
+def iter_documents(ngrams, directory, lang, other=None):
+    """
+    Itera sobre cada documento en directory,
+    devolviendo lista de palabras de cada documento,
+    filtrando según criterios en other.
+    Listas de palabras pasan por modelos en ngrams.
+
+    Parameters
+    ----------
+    ngrams: dict (bigramas, trigramas)
+    directory: str
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Yields
+    ------
+    list of str
+    """
+    yield from ngram_documents(ngrams, iter_doc_sentences(directory, lang, other))
+
+
+class TokenStore:
+    """
+    Almacén en disco de palabras filtradas, agrupadas por frase y documento.
+    Palabras se guardan como ids enteros en un arreglo memory-mapped,
+    con offsets que marcan dónde empieza cada frase y cada documento.
+    Permite recorrer el corpus muchas veces sin volver a procesarlo con spacy,
+    y agregar documentos nuevos al final. Guarda el hash del texto de cada
+    documento, para saber si cambió.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = Path(directorio)
+        self.vocab_path = self.directorio / 'vocab.json'
+        self.names_path = self.directorio / 'names.json'
+        self.hashes_path = self.directorio / 'hashes.json'
+        self.tokens_path = self.directorio / 'tokens.bin'
+        self.sents_path = self.directorio / 'sentences.npy'
+        self.docs_path = self.directorio / 'documents.npy'
+
+    def exists(self):
+        paths = (self.vocab_path, self.names_path, self.hashes_path, self.tokens_path,
+                 self.sents_path, self.docs_path)
+        return all(p.is_file() for p in paths)
+
+    def build(self, documents, names, hashes=None):
+        """
+        Escribe documents al almacén, un documento a la vez, reemplazando lo que haya.
+
+        Parameters
+        ----------
+        documents: iterable of list of list of str
+        names: list of str
+            Nombre de cada documento en documents.
+        hashes: list of str, optional
+            Hash del texto de cada documento en documents.
+        """
+        import numpy as np
+
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.vocab, self.names, self.hashes = [], [], []
+        self.sent_offsets = np.zeros(1, dtype=np.int64)
+        self.doc_offsets = np.zeros(1, dtype=np.int64)
+        # almacén vacío antes de reemplazar tokens, por si se interrumpe
+        self._save_index(self.vocab, self.names, self.hashes,
+                         self.sent_offsets, self.doc_offsets)
+
+        return self.append(documents, names, hashes)
+
+    def append(self, documents, names, hashes=None):
+        """
+        Agrega documents al final del almacén.
+
+        Parameters
+        ----------
+        documents: iterable of list of list of str
+        names: list of str
+            Nombre de cada documento en documents.
+        hashes: list of str, optional
+            Hash del texto de cada documento en documents.
+        """
+        import numpy as np
+
+        hashes = list(hashes) if hashes is not None else [None] * len(names)
+        vocab = {w: i for i, w in enumerate(self.vocab)}
+        sent_offsets = self.sent_offsets.tolist()
+        doc_offsets = self.doc_offsets.tolist()
+
+        # tokens de un append interrumpido quedan después del último offset guardado
+        self.tokens = None
+        with open(self.tokens_path, 'ab') as out:
+            out.truncate(sent_offsets[-1] * np.dtype(np.int32).itemsize)
+            for sentences in documents:
+                for tokens in sentences:
+                    ids = [vocab.setdefault(w, len(vocab)) for w in tokens]
+                    np.asarray(ids, dtype=np.int32).tofile(out)
+                    sent_offsets.append(sent_offsets[-1] + len(ids))
+                doc_offsets.append(len(sent_offsets) - 1)
+
+        self._save_index(list(vocab), list(self.names) + list(names),
+                         list(self.hashes) + hashes, sent_offsets, doc_offsets)
+
+        return self.load()
+
+    def _save_index(self, vocab, names, hashes, sent_offsets, doc_offsets):
+        """
+        Escribe offsets, vocabulario y nombres, cada uno a archivo temporal que luego
+        se renombra. names.json va al final: load ignora offsets de documentos
+        que no alcanzaron a quedar en names.json.
+        """
+        import numpy as np
+
+        for path, offsets in ((self.sents_path, sent_offsets), (self.docs_path, doc_offsets)):
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'wb') as out:
+                np.save(out, np.asarray(offsets, dtype=np.int64))
+            tmp.replace(path)
+
+        for path, data in ((self.vocab_path, vocab), (self.hashes_path, hashes),
+                           (self.names_path, names)):
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as out:
+                json.dump(data, out, ensure_ascii=False)
+            tmp.replace(path)
+
+    def load(self):
+        """
+        Abre el almacén: tokens memory-mapped y offsets en memoria.
+        """
+        import numpy as np
+
+        with open(self.vocab_path, encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        with open(self.names_path, encoding='utf-8') as f:
+            self.names = json.load(f)
+        with open(self.hashes_path, encoding='utf-8') as f:
+            self.hashes = json.load(f)[:len(self.names)]
+        # offsets escritos por un append que no alcanzó a guardar names.json
+        self.doc_offsets = np.load(self.docs_path)[:len(self.names) + 1]
+        self.sent_offsets = np.load(self.sents_path)[:self.doc_offsets[-1] + 1]
+        if self.sent_offsets[-1]:
+            self.tokens = np.memmap(self.tokens_path, dtype=np.int32, mode='r')
+        else:
+            self.tokens = np.zeros(0, dtype=np.int32)
+
+        return self
+
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+    def _sentence(self, index):
+        start, end = self.sent_offsets[index], self.sent_offsets[index + 1]
+        vocab = self.vocab
+
+        return [vocab[i] for i in self.tokens[start:end].tolist()]
+
+    def sentences(self, first=0):
+        """
+        Parameters
+        ----------
+        first: int
+            Primer documento a recorrer.
+
+        Yields
+        ------
+        list of str
+            Palabras de cada frase del corpus.
+        """
+        for index in range(self.doc_offsets[first], len(self.sent_offsets) - 1):
+            yield self._sentence(index)
+
+    def document(self, index):
+        """
+        Palabras de cada frase del documento en posición index.
+
+        Returns
+        -------
+        list of list of str
+        """
+        start, end = self.doc_offsets[index], self.doc_offsets[index + 1]
+
+        return [self._sentence(i) for i in range(start, end)]
+
+    def documents(self):
+        """
+        Yields
+        ------
+        list of list of str
+            Palabras de cada frase, agrupadas por documento.
+        """
+        for index in range(len(self)):
+            yield self.document(index)
+
+
 class MiCorpus:
     """
     Iterable: en cada iteración devuelve vectores bag-of-words, uno por documento.
-    Procesa un documento a la vez usando generators. Nunca carga todo el corpus a RAM.
+    Procesa cada documento con spacy una sola vez, guardando sus palabras filtradas
+    en un TokenStore. Iteraciones posteriores leen del almacén, sin cargar todo el corpus a RAM.
+    Modelos de ngramas se guardan con el almacén y se actualizan con documentos nuevos.
+    Con save y load se guarda diccionario y corpus en formato Matrix Market indexado,
+    que permite acceso directo a cada documento sin volver a procesar.
     """
 
-    def __init__(self, directorio, lenguaje, otros=None):
+    def __init__(self, directorio, lenguaje, otros=None, almacen=None):
         self.directorio = directorio
         self.lenguaje = lenguaje
         self.otros = otros
+        self.mm = None
 
-        self.ngramas = model_ngrams(iter_sentences(
-            self.directorio, self.lenguaje, self.otros))
+        # almacen debe corresponder a otros; si ya existe se reutiliza,
+        # procesando solo documentos de directorio nuevos o con otro texto.
+        if almacen is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix='micorpus-')
+            almacen = self._tmpdir.name
+        self.almacen = TokenStore(almacen)
+        dir_ngramas = self.almacen.directorio / 'ngramas'
 
-        self.diccionario = Dictionary(iter_documents(
-            self.ngramas, self.directorio, self.lenguaje, self.otros))
+        filepaths = list(ordered_filepaths(self.directorio))
+        names = [fpath.stem for fpath in filepaths]
+        hashes = [text_hash(read_text(fpath)) for fpath in filepaths]
+
+        if self.almacen.exists():
+            self.almacen.load()
+            self.ngramas = load_ngrams(dir_ngramas)
+        else:
+            self.almacen.build([], [])
+            self.ngramas = None
+        stored = list(zip(self.almacen.names, self.almacen.hashes))
+        current = list(zip(names, hashes))
+
+        first = len(stored)
+        if current[:first] == stored:
+            # sin cambios o solo documentos nuevos al final
+            nuevos = filepaths[first:]
+            if nuevos:
+                self.almacen.append(iter_doc_sentences(
+                    self.directorio, self.lenguaje, self.otros, filepaths=nuevos),
+                    names[first:], hashes[first:])
+        else:
+            # documentos borrados, modificados o nuevos entre los guardados:
+            # se reescribe el almacén en el orden de directorio
+            nuevos = self._rebuild(filepaths, names, hashes)
+
+        if self.ngramas is None or set(stored) - set(current):
+            # Phrases no permite descontar frases de documentos borrados o modificados
+            self.ngramas = model_ngrams(self.almacen.sentences)
+            save_ngrams(self.ngramas, dir_ngramas)
+        elif nuevos:
+            position = {name: i for i, name in enumerate(names)}
+            indices = [position[fpath.stem] for fpath in nuevos]
+            self.ngramas = model_ngrams(
+                lambda: (sent for i in indices for sent in self.almacen.document(i)),
+                self.ngramas)
+            save_ngrams(self.ngramas, dir_ngramas)
+
+        from gensim.corpora import Dictionary
+
+        self.nombres = list(self.almacen.names)
+        self.diccionario = Dictionary(ngram_documents(
+            self.ngramas, self.almacen.documents()))
         self.diccionario.filter_extremes(no_above=0.8)
         self.diccionario.filter_tokens(
             bad_ids=(tokid for tokid, freq in self.diccionario.dfs.items() if freq == 1))
         self.diccionario.compactify()
 
+    def _rebuild(self, filepaths, names, hashes):
+        """
+        Reescribe el almacén con los documentos en filepaths, en ese orden.
+        Documentos con el mismo hash que en el almacén anterior se copian sin
+        procesar; los demás se procesan con spacy.
+
+        Returns
+        -------
+        list of Path
+            Documentos procesados.
+        """
+        anterior = self.almacen
+        guardados = {(name, h): i for i, (name, h) in enumerate(zip(anterior.names, anterior.hashes))}
+        nuevos = [fpath for fpath, name, h in zip(filepaths, names, hashes)
+                  if (name, h) not in guardados]
+
+        def documents():
+            procesados = iter_doc_sentences(self.directorio, self.lenguaje, self.otros,
+                                            filepaths=nuevos)
+            for name, h in zip(names, hashes):
+                index = guardados.get((name, h))
+                yield anterior.document(index) if index is not None else next(procesados)
+
+        directorio = anterior.directorio
+        tmp = directorio.with_name(directorio.name + '.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        TokenStore(tmp).build(documents(), names, hashes)
+        # ngramas guardados siguen en el almacén reescrito
+        if (directorio / 'ngramas').is_dir():
+            shutil.copytree(directorio / 'ngramas', tmp / 'ngramas')
+
+        anterior.tokens = None
+        viejo = directorio.with_name(directorio.name + '.old')
+        shutil.rmtree(viejo, ignore_errors=True)
+        directorio.rename(viejo)
+        tmp.rename(directorio)
+        shutil.rmtree(viejo, ignore_errors=True)
+        self.almacen = TokenStore(directorio).load()
+
+        return nuevos
+
     def __iter__(self):
         """
         CorpusConsultivos es un streamed iterable.
         """
-        for tokens in iter_documents(self.ngramas, self.directorio, self.lenguaje, self.otros):
+        if self.mm is not None:
+            yield from self.mm
+            return
+
+        for tokens in ngram_documents(self.ngramas, self.almacen.documents()):
             yield self.diccionario.doc2bow(tokens)
+
+    def __len__(self):
+        return len(self.nombres)
+
+    def __getitem__(self, index):
+        """
+        Vector bag-of-words del documento en posición index (solo después de save o load).
+        """
+        if self.mm is None:
+            raise TypeError('Acceso por posición requiere MiCorpus guardado con save')
+
+        return self.mm[index]
+
+    def save(self, carpeta):
+        """
+        Guarda diccionario, ngramas y corpus Matrix Market indexado en carpeta,
+        con huella de directorio y otros para verificar que sigue vigente.
+
+        Parameters
+        ----------
+        carpeta: str or Path
+        """
+        from gensim.corpora import MmCorpus
+
+        carpeta = Path(carpeta)
+        carpeta.mkdir(parents=True, exist_ok=True)
+
+        self.diccionario.save(str(carpeta / 'diccionario.dict'))
+        save_ngrams(self.ngramas, carpeta / 'ngramas')
+        # a archivos temporales: self puede estar leyendo de un corpus.mm anterior
+        mmfile = carpeta / 'corpus.mm'
+        MmCorpus.serialize(str(mmfile) + '.tmp', self, id2word=self.diccionario,
+                           index_fname=str(mmfile) + '.index.tmp')
+        Path(str(mmfile) + '.tmp').replace(mmfile)
+        Path(str(mmfile) + '.index.tmp').replace(str(mmfile) + '.index')
+        self.mm = MmCorpus(str(mmfile))
+
+        meta = dict(directorio=directory_fingerprint(self.directorio),
+                    otros=config_hash(self.otros), nombres=self.nombres)
+        with open(carpeta / 'micorpus.json', 'w', encoding='utf-8') as out:
+            json.dump(meta, out, ensure_ascii=False)
+
+    @staticmethod
+    def is_current(carpeta, directorio, otros=None):
+        """
+        Indica si MiCorpus guardado en carpeta corresponde a los documentos
+        actuales de directorio y a otros.
+
+        Returns
+        -------
+        bool
+        """
+        try:
+            with open(Path(carpeta, 'micorpus.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return False
+
+        return (meta['directorio'] == directory_fingerprint(directorio) and
+                meta['otros'] == config_hash(otros))
+
+    @classmethod
+    def load(cls, carpeta, directorio, lenguaje, otros=None):
+        """
+        Carga MiCorpus guardado en carpeta si sigue vigente, sin procesar documentos.
+        Si no, lo crea (reutilizando el almacén de tokens en carpeta) y lo guarda.
+
+        Parameters
+        ----------
+        carpeta: str or Path
+        directorio: str
+        lenguaje: spacy.lang
+        otros: dict, optional (stopwords, postags, entities, stemmer)
+
+        Returns
+        -------
+        MiCorpus
+        """
+        carpeta = Path(carpeta)
+        if not cls.is_current(carpeta, directorio, otros):
+            almacen = carpeta / 'almacen' / config_hash(otros)
+            corpus = cls(directorio, lenguaje, otros, almacen=almacen)
+            corpus.save(carpeta)
+            return corpus
+
+        with open(carpeta / 'micorpus.json', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        from gensim.corpora import Dictionary, MmCorpus
+
+        corpus = cls.__new__(cls)
+        corpus.directorio = directorio
+        corpus.lenguaje = lenguaje
+        corpus.otros = otros
+        corpus.almacen = None
+        corpus.nombres = meta['nombres']
+        corpus.ngramas = load_ngrams(carpeta / 'ngramas')
+        corpus.diccionario = Dictionary.load(str(carpeta / 'diccionario.dict'))
+        corpus.mm = MmCorpus(str(carpeta / 'corpus.mm'))
+
+        return corpus
@@ -1,97 +1,1314 @@
 # coding: utf-8
+from array import array
 from collections import Counter
 from pathlib import Path
 import argparse
 import datetime
+import hashlib
 import json
 import logging
 import os
 
-import numpy as np
-import pandas as pd
-import plotly.offline as pyo
-import plotly.graph_objs as go
-import spacy
+import helpers as hp
+
+# numpy, scipy y pandas se importan en las funciones que los usan, para que
+# la ayuda de cli.py score no los cargue.
+
+
+def fss(tokens, pos, neg):
+    """
+    Calcula Financial Stability Sentiment index basado en tokens de un documento.
+
+    Parameters
+    ----------
+    tokens: list or iterable
+    pos: set
+    neg: set
+
+    Yields
+    ------
+    float
+    """
+    return fss_score(*fss_counts(tokens, pos, neg))
+
+
+def fss_counts(tokens, pos, neg):
+    """
+    Cuenta palabras positivas, negativas y totales en tokens.
+
+    Parameters
+    ----------
+    tokens: list or iterable
+    pos: set
+    neg: set
+
+    Returns
+    -------
+    tuple of int (emopos, emoneg, total)
+    """
+    fd = Counter(tokens)
+
+    emopos = sum(c for w, c in fd.items() if w in pos)
+    emoneg = sum(c for w, c in fd.items() if w in neg)
+    total = sum(fd.values())
+
+    return emopos, emoneg, total
+
+
+def fss_score(emopos, emoneg, total):
+    """
+    Calcula Financial Stability Sentiment index a partir de conteos de palabras.
+
+    Parameters
+    ----------
+    emopos: int
+    emoneg: int
+    total: int
+
+    Returns
+    -------
+    float
+    """
+    import numpy as np
+
+    emodiff = emoneg - emopos
+
+    try:
+        score = (emodiff / total)
+    except ZeroDivisionError:
+        score = np.nan
+    except Exception as e:
+        score = np.nan
+        logging.info('ERROR inesperado calculando FSS: {}'.format(e))
+
+    return score
+
+
+# palabras de una expresión encontrada después de la primera: no son positivas ni negativas,
+# pero se cuentan para que el total de palabras no cambie al juntarlas en una sola
+PHRASE_REST = ''
+
+
+class LexiconMatcher:
+    """
+    Expresiones de varias palabras de un diccionario, compiladas una sola vez
+    a un trie sobre todas las palabras, números y signos de puntuación de cada
+    expresión. merge recorre todos los tokens de una frase, antes de filtrarlos,
+    y reemplaza cada expresión encontrada (la más larga que empieza más a la
+    izquierda) por la expresión del diccionario, que así cuenta como una sola
+    palabra positiva o negativa.
+    """
+
+    def __init__(self, phrases, other=None):
+        # criterios que se pueden aplicar a texto sin spacy
+        other = {k: v for k, v in (other or {}).items() if k in ('stopwords', 'stemmer')}
+        self.trie = {}
+        self.phrases = []
+        for phrase in phrases:
+            if len(phrase.split()) < 2:
+                continue
+            key, keep = hp.fast_token_mask(phrase, other)
+            if not any(keep):
+                logging.info(f'Expresión ignorada, sin palabras propias después de filtrar: {phrase}')
+                continue
+
+            node = self.trie
+            for word in key:
+                node = node.setdefault(word, {})
+            node.setdefault(None, phrase)
+            self.phrases.append(phrase)
+
+    def __bool__(self):
+        return bool(self.phrases)
+
+    def merge(self, tokens, keep=None):
+        """
+        Palabras de tokens que pasan los filtros, con cada expresión encontrada
+        reemplazada por una sola palabra. Una expresión solo cuenta si alguna de
+        sus palabras pasa los filtros; las demás que pasan se cuentan como PHRASE_REST.
+
+        Parameters
+        ----------
+        tokens: list of str
+            Todas las palabras de la frase.
+        keep: list of bool, optional
+            Palabras de tokens que pasan los filtros. Si no se da, todas.
+
+        Returns
+        -------
+        list of str
+        """
+        n = len(tokens)
+        if keep is None:
+            keep = [True] * n
+
+        merged = []
+        i = 0
+        while i < n:
+            node, match = self.trie, None
+            for j in range(i, n):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if None in node:
+                    match = (j + 1, node[None])
+
+            kept = sum(keep[i:match[0]]) if match is not None else 0
+            if kept:
+                merged.append(match[1])
+                merged.extend([PHRASE_REST] * (kept - 1))
+                i = match[0]
+            else:
+                if keep[i]:
+                    merged.append(tokens[i])
+                i += 1
+
+        return merged
+
+    def sentences(self, sentences):
+        """
+        Aplica merge a cada frase en sentences.
+
+        Parameters
+        ----------
+        sentences: iterable of tuple (list of str, list of bool)
+            Todas las palabras de cada frase y cuáles pasan los filtros,
+            como en hp.doc_sentence_masks.
+
+        Yields
+        ------
+        list of str
+        """
+        for tokens, keep in sentences:
+            yield self.merge(tokens, keep)
+
+
+def lexicon_matcher(pos, neg, other=None):
+    """
+    LexiconMatcher de expresiones de varias palabras en pos y neg.
+
+    Parameters
+    ----------
+    pos: list or set or iterable
+    neg: list or set or iterable
+    other: dict, optional (stopwords, postags, entities, stemmer)
+
+    Returns
+    -------
+    LexiconMatcher or None
+        None si el diccionario solo tiene palabras sueltas.
+    """
+    matcher = LexiconMatcher(list(pos) + list(neg), other)
+
+    return matcher if matcher else None
+
+
+def sentences_fss(sentences, pos, neg, matcher=None):
+    """
+    Calcula Financial Stability Sentiment index de un documento,
+    acumulando conteos frase por frase sin juntar todas sus palabras.
+
+    Parameters
+    ----------
+    sentences: iterable of list of str
+        Con matcher, iterable of tuple (list of str, list of bool), como en hp.doc_sentence_masks.
+    pos: set
+    neg: set
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    float
+    """
+    if matcher is not None:
+        sentences = matcher.sentences(sentences)
+
+    emopos, emoneg, total = (0, 0, 0)
+    for tokens in sentences:
+        spos, sneg, stotal = fss_counts(tokens, pos, neg)
+        emopos += spos
+        emoneg += sneg
+        total += stotal
+
+    return fss_score(emopos, emoneg, total)
+
+
+def score_doc(fpath, pos, neg, lang, other=None, cache=None, chunk_size=None, matcher=None):
+    """
+    Calcula Financial Stability Sentiment index de un documento en fpath.
+
+    Parameters
+    ----------
+    fpath: str or Path
+    pos: list or set or iterable
+    neg: list or set or iterable
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    cache: hp.DocCache, optional
+    chunk_size: int, optional
+        Si se da, procesa el documento por bloques de chunk_size caracteres, sin cache.
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    float
+    """
+    if chunk_size:
+        if matcher is not None:
+            sentences = hp.chunk_doc_sentence_masks(fpath, lang, other, chunk_size)
+        else:
+            sentences = hp.chunk_doc_sentences(fpath, lang, other, chunk_size)
+        return sentences_fss(sentences, set(pos), set(neg), matcher)
+
+    doc = hp.load_doc(fpath, lang, cache)
+
+    return doc_fss(doc, pos, neg, other, matcher)
+
+
+def doc_fss(doc, pos, neg, other=None, matcher=None):
+    """
+    Calcula Financial Stability Sentiment index de un documento procesado.
+
+    Parameters
+    ----------
+    doc: spacy.tokens.Doc
+    pos: list or set or iterable
+    neg: list or set or iterable
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    float
+    """
+    if (matcher is None and isinstance(pos, hp.WordSet) and isinstance(neg, hp.WordSet)
+            and 'stemmer' not in (other or {})):
+        return fss_score(*id_counts(doc, pos, neg, other))
+
+    return sentences_fss(doc_words(doc, other, matcher), set(pos), set(neg))
+
+
+def doc_words(doc, other=None, matcher=None):
+    """
+    Palabras filtradas de cada frase de un documento procesado, con cada
+    expresión encontrada por matcher como una sola palabra.
+
+    Parameters
+    ----------
+    doc: spacy.tokens.Doc
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    iterable of list of str
+    """
+    if matcher is None:
+        return hp.doc_sentences(doc, other)
+
+    return matcher.sentences(hp.doc_sentence_masks(doc, other))
+
+
+def id_counts(doc, pos, neg, other=None):
+    """
+    Cuenta palabras positivas, negativas y totales de un documento procesado
+    comparando ids de spacy, sin convertir tokens a texto.
+    No aplica stemmer ni expresiones de varias palabras.
+
+    Parameters
+    ----------
+    doc: spacy.tokens.Doc
+    pos: hp.WordSet
+    neg: hp.WordSet
+    other: dict, optional (stopwords, postags, entities)
+
+    Returns
+    -------
+    tuple of int (emopos, emoneg, total)
+    """
+    import numpy as np
+
+    lowers, keep = hp.token_filter(doc.vocab, other).mask(doc)
+    ids = lowers[keep]
+
+    return (int(np.isin(ids, pos.ids).sum()), int(np.isin(ids, neg.ids).sum()),
+            int(ids.size))
+
+
+# cambiar si cambia el contenido de los archivos de save_sentences
+SENTENCES_VERSION = 3
+SENTENCE_COLUMNS = ['pos', 'neg', 'total', 'start_char', 'end_char']
+
+
+def sentence_tokens(doc, other=None, sentences=None):
+    """
+    Palabras de cada frase de un documento procesado, como índices a su
+    vocabulario, con cuáles pasan los filtros y la posición de la frase en el texto.
+    No dependen del diccionario.
+
+    Parameters
+    ----------
+    doc: spacy.tokens.Doc
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    sentences: list of tuple (list of str, list of bool), optional
+        Resultado de hp.doc_sentence_masks para doc, si ya se calculó.
+
+    Returns
+    -------
+    dict of numpy.ndarray (words, tokens, keep, offsets, start_char, end_char)
+        Palabras de la frase i: words[tokens[offsets[i]:offsets[i + 1]]].
+    """
+    import numpy as np
+
+    if sentences is None:
+        sentences = hp.doc_sentence_masks(doc, other)
+
+    vocab, tokens, keep, offsets, chars = {}, [], [], [0], []
+    for sent, (words, mask) in zip(doc.sents, sentences):
+        tokens.extend(vocab.setdefault(w, len(vocab)) for w in words)
+        keep.extend(mask)
+        offsets.append(len(tokens))
+        chars.append((sent.start_char, sent.end_char))
+    chars = np.array(chars, dtype=np.int64).reshape(-1, 2)
+
+    return dict(words=np.array(list(vocab), dtype=str),
+                tokens=np.array(tokens, dtype=np.int32),
+                keep=np.array(keep, dtype=bool),
+                offsets=np.array(offsets, dtype=np.int64),
+                start_char=chars[:, 0], end_char=chars[:, 1])
+
+
+def sentence_arrays(tokens, pos, neg, matcher=None):
+    """
+    Cuenta palabras positivas, negativas y totales de cada frase en tokens.
+
+    Parameters
+    ----------
+    tokens: dict of numpy.ndarray
+        Arreglos de sentence_tokens.
+    pos: set
+    neg: set
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Un arreglo por columna de SENTENCE_COLUMNS, un elemento por frase.
+    """
+    import numpy as np
+
+    offsets, keep = tokens['offsets'], tokens['keep']
+    arrays = dict(start_char=tokens['start_char'], end_char=tokens['end_char'])
+
+    if matcher is not None:
+        words = tokens['words'][tokens['tokens']].tolist()
+        keep = keep.tolist()
+        sents = ((words[a:b], keep[a:b])
+                 for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+        table = np.array([fss_counts(sent, pos, neg) for sent in matcher.sentences(sents)],
+                         dtype=np.int64).reshape(-1, 3)
+        arrays.update(pos=table[:, 0], neg=table[:, 1], total=table[:, 2])
+    else:
+        n = offsets.size - 1
+        sent = np.repeat(np.arange(n), np.diff(offsets))
+        words = tokens['words'].tolist()
+        for col, lexicon in (('pos', pos), ('neg', neg)):
+            member = np.array([w in lexicon for w in words], dtype=bool)
+            arrays[col] = np.bincount(sent[keep & member[tokens['tokens']]],
+                                      minlength=n).astype(np.int64)
+        arrays['total'] = np.bincount(sent[keep], minlength=n).astype(np.int64)
+
+    return {col: arrays[col] for col in SENTENCE_COLUMNS}
+
+
+def save_sentences(dirpath, name, tokens):
+    """
+    Guarda palabras por frase del documento name en dirpath/name.npz.
+
+    Parameters
+    ----------
+    dirpath: str or Path
+    name: str
+    tokens: dict of numpy.ndarray
+        Arreglos de sentence_tokens.
+    """
+    import numpy as np
+
+    os.makedirs(dirpath, exist_ok=True)
+    np.savez_compressed(os.path.join(dirpath, f'{name}.npz'),
+                        version=np.array(SENTENCES_VERSION), **tokens)
+
+
+def has_sentences(dirpath, name):
+    """
+    Indica si el documento name tiene palabras por frase guardadas en dirpath
+    con la versión actual de save_sentences.
+
+    Parameters
+    ----------
+    dirpath: str or Path
+    name: str
+
+    Returns
+    -------
+    bool
+    """
+    import numpy as np
+
+    try:
+        with np.load(os.path.join(dirpath, f'{name}.npz')) as data:
+            return 'version' in data.files and int(data['version']) == SENTENCES_VERSION
+    except FileNotFoundError:
+        return False
+
+
+def load_sentences(dirpath, name, pos, neg, matcher=None):
+    """
+    Cuenta palabras positivas, negativas y totales de cada frase del documento name
+    con las palabras guardadas con save_sentences, sin volver a procesar el documento.
+
+    Parameters
+    ----------
+    dirpath: str or Path
+    name: str
+    pos: set
+    neg: set
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    dict of numpy.ndarray or None
+        None si no hay palabras guardadas o son de otra versión.
+    """
+    import numpy as np
+
+    if not has_sentences(dirpath, name):
+        return None
+
+    with np.load(os.path.join(dirpath, f'{name}.npz')) as data:
+        tokens = {key: data[key] for key in data.files if key != 'version'}
+
+    return sentence_arrays(tokens, set(pos), set(neg), matcher)
+
+
+def rolling_fss(arrays, window):
+    """
+    Calcula Financial Stability Sentiment index de cada ventana de window frases consecutivas.
+
+    Parameters
+    ----------
+    arrays: dict of numpy.ndarray
+    window: int
+        Si es mayor que el número de frases, se usa una sola ventana con todas.
+
+    Returns
+    -------
+    numpy.ndarray
+        Un valor por ventana. np.nan si la ventana no tiene palabras.
+    """
+    import numpy as np
+
+    if window < 1:
+        raise ValueError(f'window debe ser al menos 1: {window}')
+
+    window = min(window, len(arrays['total']))
+    if window == 0:
+        return np.array([], dtype=np.float64)
+
+    emodiff = np.concatenate([[0], np.cumsum(arrays['neg'] - arrays['pos'])])
+    total = np.concatenate([[0], np.cumsum(arrays['total'])])
+    emodiff = emodiff[window:] - emodiff[:-window]
+    total = total[window:] - total[:-window]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = emodiff / total
+    scores[total == 0] = np.nan
+
+    return scores
+
+
+def section_fss(arrays, bounds):
+    """
+    Calcula Financial Stability Sentiment index de secciones de un documento.
+    Cada frase pertenece a la sección donde empieza.
+
+    Parameters
+    ----------
+    arrays: dict of numpy.ndarray
+    bounds: list of int
+        Carácter donde empieza cada sección, en orden creciente.
+
+    Returns
+    -------
+    numpy.ndarray
+        Un valor por sección. np.nan si la sección no tiene palabras.
+    """
+    import numpy as np
+
+    section = np.searchsorted(bounds, arrays['start_char'], side='right') - 1
+    inside = section >= 0
+    emodiff = np.bincount(section[inside], minlength=len(bounds),
+                          weights=(arrays['neg'] - arrays['pos'])[inside])
+    total = np.bincount(section[inside], minlength=len(bounds),
+                        weights=arrays['total'][inside])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = emodiff / total
+    scores[total == 0] = np.nan
+
+    return scores
+
+
+def top_sentences(arrays, n=10):
+    """
+    Frases que más contribuyen al Financial Stability Sentiment index del documento.
+
+    Parameters
+    ----------
+    arrays: dict of numpy.ndarray
+    n: int
+
+    Returns
+    -------
+    pandas.DataFrame (sentence, start_char, end_char, pos, neg, total, contribution)
+        Ordenado por valor absoluto de contribution. La suma de contribution
+        de todas las frases es el FSS del documento.
+    """
+    import numpy as np
+    import pandas as pd
+
+    contribution = (arrays['neg'] - arrays['pos']).astype(np.float64)
+    total = arrays['total'].sum()
+    if total:
+        contribution /= total
+    order = np.argsort(-np.abs(contribution), kind='stable')[:n]
+
+    top = pd.DataFrame({col: arrays[col][order]
+                        for col in ['start_char', 'end_char', 'pos', 'neg', 'total']})
+    top.insert(0, 'sentence', order)
+    top['contribution'] = contribution[order]
+
+    return top
+
+
+def word_counts(sentences):
+    """
+    Frecuencia de cada palabra en sentences.
+
+    Parameters
+    ----------
+    sentences: iterable of list of str
+
+    Returns
+    -------
+    collections.Counter
+    """
+    counts = Counter()
+    for tokens in sentences:
+        counts.update(tokens)
+
+    return counts
+
+
+class DocTermBuilder:
+    """
+    Matriz dispersa de frecuencias documento-palabra construida documento por
+    documento, guardando solo sus arreglos de índices y frecuencias.
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.indptr = array('q', [0])
+        self.indices = array('q')
+        self.data = array('q')
+
+    def add(self, words):
+        """
+        Agrega una fila con las frecuencias de words.
+
+        Parameters
+        ----------
+        words: list of str or dict (palabra, frecuencia)
+        """
+        for w, c in Counter(words).items():
+            self.indices.append(self.vocab.setdefault(w, len(self.vocab)))
+            self.data.append(c)
+        self.indptr.append(len(self.indices))
+
+    def matrix(self):
+        """
+        Returns
+        -------
+        tuple (scipy.sparse.csr_matrix, list of str)
+            Matriz (documentos x palabras) y vocabulario de sus columnas.
+        """
+        from scipy import sparse
+        import numpy as np
+
+        shape = (len(self.indptr) - 1, len(self.vocab))
+        arrays = [np.frombuffer(a, dtype=np.int64) if len(a) else np.zeros(0, dtype=np.int64)
+                  for a in (self.data, self.indices, self.indptr)]
+        counts = sparse.csr_matrix(tuple(arrays), shape=shape, dtype=np.int64, copy=True)
+
+        return counts, list(self.vocab)
+
+
+def doc_counts(doc, other=None, matcher=None):
+    """
+    Frecuencia de cada palabra filtrada de un documento procesado. Sin matcher
+    cuenta ids de spacy de los tokens con numpy y convierte a texto (o a su raíz,
+    si hay stemmer) solo cada id distinto.
+
+    Parameters
+    ----------
+    doc: spacy.tokens.Doc
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    matcher: LexiconMatcher, optional
+
+    Returns
+    -------
+    collections.Counter
+    """
+    import numpy as np
+
+    if matcher is not None:
+        return word_counts(doc_words(doc, other, matcher))
+
+    tfilter = hp.token_filter(doc.vocab, other)
+    lowers, keep = tfilter.mask(doc)
+    ids, freqs = np.unique(lowers[keep], return_counts=True)
+
+    counts = Counter()
+    for i, freq in zip(ids.tolist(), freqs.tolist()):
+        counts[tfilter.word(i)] += freq
+
+    return counts
+
+
+def doc_term_matrix(documents):
+    """
+    Construye matriz dispersa de frecuencias documento-palabra.
+
+    Parameters
+    ----------
+    documents: iterable of list of str or iterable of dict (palabra, frecuencia)
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, list of str)
+        Matriz (documentos x palabras) y vocabulario de sus columnas.
+    """
+    builder = DocTermBuilder()
+    for words in documents:
+        builder.add(words)
+
+    return builder.matrix()
+
+
+def lexicon_matrix(vocab, lexicons):
+    """
+    Construye matriz dispersa de pesos palabra-diccionario:
+    +1 para palabras negativas y -1 para positivas, una columna por diccionario.
+
+    Parameters
+    ----------
+    vocab: list of str
+    lexicons: list of tuple (pos, neg)
+
+    Returns
+    -------
+    scipy.sparse.csc_matrix
+        Matriz (palabras x diccionarios).
+    """
+    from scipy import sparse
+    import numpy as np
+
+    index = {w: i for i, w in enumerate(vocab)}
+    rows, cols, data = [], [], []
+    for col, (pos, neg) in enumerate(lexicons):
+        for words, weight in ((set(neg), 1), (set(pos), -1)):
+            for w in words:
+                if w != PHRASE_REST and w in index:
+                    rows.append(index[w])
+                    cols.append(col)
+                    data.append(weight)
 
-import helpers as hp
+    shape = (len(vocab), len(lexicons))
 
+    return sparse.csc_matrix((data, (rows, cols)), shape=shape, dtype=np.int64)
 
-def fss(tokens, pos, neg):
+
+def fss_matrix(counts, lexicons):
     """
-    Calcula Financial Stability Sentiment index basado en tokens de un documento.
+    Calcula Financial Stability Sentiment index de todos los documentos en counts,
+    para todos los diccionarios en lexicons.
 
     Parameters
     ----------
-    tokens: list or iterable
-    pos: set
-    neg: set
+    counts: scipy.sparse.csr_matrix (documentos x palabras)
+    lexicons: scipy.sparse.csc_matrix (palabras x diccionarios)
 
-    Yields
-    ------
-    float
+    Returns
+    -------
+    numpy.ndarray
+        Matriz (documentos x diccionarios). np.nan si el documento no tiene palabras.
     """
-    fd = Counter(tokens)
+    import numpy as np
 
-    emopos = sum(c for w, c in fd.items() if w in pos)
-    emoneg = sum(c for w, c in fd.items() if w in neg)
-    total = sum(fd.values())
+    total = np.asarray(counts.sum(axis=1), dtype=np.float64)
+    emodiff = (counts @ lexicons).toarray()
 
-    emodiff = emoneg - emopos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = emodiff / total
+    scores[total[:, 0] == 0] = np.nan
 
-    try:
-        score = (emodiff / total)
-    except ZeroDivisionError:
-        score = np.nan
-    except Exception as e:
-        score = np.nan
-        logging.info('ERROR inesperado calculando FSS: {}'.format(e))
+    return scores
 
-    return score
 
+def save_doc_terms(dirpath, counts, vocab, docnames):
+    """
+    Guarda matriz documento-palabra en dirpath, para recalcular FSS con otros
+    diccionarios sin volver a procesar documentos.
 
-def score_doc(fpath, pos, neg, lang, other=None):
+    Parameters
+    ----------
+    dirpath: str or Path
+    counts: scipy.sparse.csr_matrix
+    vocab: list of str
+    docnames: list of str
     """
-    Calcula Financial Stability Sentiment index de un documento en fpath.
+    from scipy import sparse
+
+    sparse.save_npz(os.path.join(dirpath, 'doc_terms.npz'), counts)
+    with open(os.path.join(dirpath, 'doc_terms.json'), 'w', encoding='utf-8') as out:
+        json.dump(dict(vocab=vocab, docs=docnames), out, ensure_ascii=False)
+
+
+def load_doc_terms(dirpath):
+    """
+    Lee matriz documento-palabra guardada con save_doc_terms.
 
     Parameters
     ----------
-    fpath: str or Path
+    dirpath: str or Path
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, list of str, list of str)
+        Matriz, vocabulario y nombres de documentos.
+    """
+    from scipy import sparse
+
+    counts = sparse.load_npz(os.path.join(dirpath, 'doc_terms.npz')).tocsr()
+    with open(os.path.join(dirpath, 'doc_terms.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+
+    return counts, meta['vocab'], meta['docs']
+
+
+def corpus_doc_terms(filepaths, lang, other=None, cache=None,
+                     n_process=1, batch_size=4, chunk_size=None, profiler=None,
+                     sentences=None, matcher=None, hashes=None):
+    """
+    Construye matriz documento-palabra de documentos en filepaths,
+    procesando documentos en lotes con lang.pipe.
+
+    Parameters
+    ----------
+    filepaths: iterable of str or Path
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    cache: hp.DocCache, optional
+    n_process: int
+    batch_size: int
+    chunk_size: int, optional
+        Si se da, procesa cada documento por bloques de chunk_size caracteres,
+        uno a la vez y sin cache.
+    profiler: hp.Profiler, optional
+    sentences: dict (dirpath), optional
+        Si se da, guarda palabras por frase de cada documento con save_sentences.
+        No se usa con chunk_size.
+    matcher: LexiconMatcher, optional
+        Si se da, cada expresión del diccionario encontrada cuenta como una palabra.
+    hashes: dict, optional
+        Si se da, recibe hp.text_hash del texto de cada documento (llave: nombre),
+        calculado al leerlo para procesarlo.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, list of str, list of str)
+        Matriz, vocabulario y nombres de documentos.
+    """
+    profiler = profiler or hp.NULL_PROFILER
+    docnames = []
+
+    def documents():
+        if chunk_size:
+            for fpath in filepaths:
+                fpath = Path(fpath)
+                docnames.append(fpath.stem)
+                with profiler.stage(fpath.stem, 'chunks') as record:
+                    digest = hashlib.sha1()
+                    if matcher is not None:
+                        sents = matcher.sentences(hp.chunk_doc_sentence_masks(
+                            fpath, lang, other, chunk_size, digest))
+                    else:
+                        sents = hp.chunk_doc_sentences(fpath, lang, other, chunk_size, digest)
+                    counts = word_counts(sents)
+                    if profiler.enabled:
+                        record['tokens'] = sum(counts.values())
+                if hashes is not None:
+                    hashes[fpath.stem] = digest.hexdigest()
+                yield counts
+            return
+
+        parsed = hp.iter_parsed(filepaths, lang, cache, n_process, batch_size, profiler, hashes)
+        for fpath, doc in parsed:
+            docnames.append(fpath.stem)
+            with profiler.stage(fpath.stem, 'filter') as record:
+                if sentences:
+                    masks = list(hp.doc_sentence_masks(doc, other))
+                if sentences and matcher is not None:
+                    counts = word_counts(matcher.sentences(masks))
+                else:
+                    counts = doc_counts(doc, other, matcher)
+                if profiler.enabled:
+                    record['tokens'] = sum(counts.values())
+            if sentences:
+                with profiler.stage(fpath.stem, 'sentences'):
+                    save_sentences(sentences['dirpath'], fpath.stem,
+                                   sentence_tokens(doc, sentences=masks))
+            yield counts
+
+    counts, vocab = doc_term_matrix(documents())
+
+    return counts, vocab, docnames
+
+
+def fast_doc_terms(filepaths, other=None, matcher=None):
+    """
+    Construye matriz documento-palabra de documentos en filepaths
+    con hp.fast_tokens, sin usar spacy.
+
+    Parameters
+    ----------
+    filepaths: iterable of str or Path
+    other: dict, optional (stopwords, stemmer)
+    matcher: LexiconMatcher, optional
+        Sin frases, las expresiones se buscan en todos los tokens del documento.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, list of str, list of str)
+        Matriz, vocabulario y nombres de documentos.
+    """
+    docnames = []
+
+    def documents():
+        for fpath in filepaths:
+            docnames.append(Path(fpath).stem)
+            text = hp.read_text(fpath)
+            if matcher is not None:
+                yield matcher.merge(*hp.fast_token_mask(text, other))
+            else:
+                yield hp.fast_tokens(text, other)
+
+    counts, vocab = doc_term_matrix(documents())
+
+    return counts, vocab, docnames
+
+
+def agreement_report(scores, fast_scores):
+    """
+    Compara por documento FSS calculado con spacy y con hp.fast_tokens.
+
+    Parameters
+    ----------
+    scores: list of dict (score, doc)
+    fast_scores: list of dict (score, doc)
+
+    Returns
+    -------
+    pandas.DataFrame (doc, score, score_fast, delta, abs_delta)
+    """
+    import pandas as pd
+
+    report = pd.DataFrame(scores).merge(
+        pd.DataFrame(fast_scores), on='doc', how='outer', suffixes=('', '_fast'))
+    report['delta'] = report['score_fast'] - report['score']
+    report['abs_delta'] = report['delta'].abs()
+
+    return report[['doc', 'score', 'score_fast', 'delta', 'abs_delta']]
+
+
+def merge_doc_terms(old, new, docnames):
+    """
+    Combina matrices documento-palabra old y new, dejando filas de docnames
+    en ese orden. Si un documento está en ambas, se usa la fila de new.
+    Se eliminan palabras que ya no aparecen en ningún documento.
+
+    Parameters
+    ----------
+    old: tuple (scipy.sparse.csr_matrix, list of str, list of str)
+    new: tuple (scipy.sparse.csr_matrix, list of str, list of str)
+    docnames: list of str
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, list of str, list of str)
+    """
+    from scipy import sparse
+    import numpy as np
+
+    (old_counts, old_vocab, old_docs), (new_counts, new_vocab, new_docs) = old, new
+
+    vocab = {w: i for i, w in enumerate(old_vocab)}
+    for w in new_vocab:
+        vocab.setdefault(w, len(vocab))
+    columns = np.array([vocab[w] for w in new_vocab], dtype=np.int64)
+
+    old_counts = sparse.csr_matrix(
+        (old_counts.data, old_counts.indices, old_counts.indptr),
+        shape=(old_counts.shape[0], len(vocab)))
+    new_counts = new_counts.tocoo()
+    new_counts = sparse.csr_matrix(
+        (new_counts.data, (new_counts.row, columns[new_counts.col])),
+        shape=(new_counts.shape[0], len(vocab)))
+
+    rows = {name: i for i, name in enumerate(old_docs + new_docs)}
+    counts = sparse.vstack([old_counts, new_counts]).tocsr()
+    counts = counts[[rows[name] for name in docnames]]
+
+    # palabras que solo estaban en documentos borrados o reemplazados
+    used = np.flatnonzero(counts.getnnz(axis=0))
+    vocab = list(vocab)
+
+    return counts[:, used], [vocab[i] for i in used], list(docnames)
+
+
+def score_corpus(directory, pos, neg, lang, other=None, cache=None,
+                 n_process=1, batch_size=4, doc_terms=None, matcher=None):
+    """
+    Calcula Financial Stability Sentiment index de cada documento en directory,
+    procesando documentos en lotes con lang.pipe.
+    FSS se calcula para todo el corpus sobre la matriz documento-palabra.
+
+    Parameters
+    ----------
+    directory: str or Path
     pos: list or set or iterable
     neg: list or set or iterable
     lang: spacy.lang
     other: dict, optional (stopwords, postags, entities, stemmer)
+    cache: hp.DocCache, optional
+    n_process: int
+    batch_size: int
+    doc_terms: str or Path, optional
+        Directorio donde guardar la matriz documento-palabra.
+    matcher: LexiconMatcher, optional
 
     Returns
     -------
-    float
+    list of dict (score, doc)
+        En el orden de hp.ordered_filepaths.
     """
-    text = hp.read_text(fpath)
-    doc = lang(text)
+    counts, vocab, docnames = corpus_doc_terms(
+        hp.ordered_filepaths(directory), lang, other, cache, n_process, batch_size,
+        matcher=matcher)
+    if doc_terms:
+        save_doc_terms(doc_terms, counts, vocab, docnames)
 
-    words = []
-    for tokens in hp.doc_sentences(doc, other):
-        words.extend(tokens)
+    scores = fss_matrix(counts, lexicon_matrix(vocab, [(pos, neg)]))
 
-    return fss(words, pos, neg)
+    return [dict(score=score, doc=name) for name, score in zip(docnames, scores[:, 0])]
 
 
-if __name__ == '__main__':
-    description = """Calcula ISREF de docs ubicados en dirdocs"""
-    parser = argparse.ArgumentParser(description=description)
+def load_grid(filepath, stopwords=None):
+    """
+    Lee grilla de diccionarios y configuraciones de filtros para sweep_scores.
+    Archivo json con llaves opcionales "lexicons" ({nombre: ruta de archivo json
+    de palabras positivas y negativas, relativa al archivo de la grilla}) y
+    "configs" ({nombre: {"stopwords": true, "postags": [...], "entities": [...],
+    "stemmer": "english"}}). "stopwords": true usa stopwords y "stemmer" es el
+    idioma de SnowballStemmer de nltk.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    stopwords: set, optional
+
+    Returns
+    -------
+    tuple (dict, dict)
+        Diccionarios {nombre: (pos, neg)} y configuraciones {nombre: other}.
+    """
+    filepath = Path(filepath)
+    with open(filepath, encoding='utf-8') as f:
+        grid = json.load(f)
+
+    lexicons = {}
+    for name, lexpath in grid.get('lexicons', {}).items():
+        with open(filepath.parent / lexpath, encoding='utf-8') as f:
+            diction = json.load(f)
+        lexicons[name] = (diction.get('positive'), diction.get('negative'))
+
+    configs = {}
+    for name, options in grid.get('configs', {}).items():
+        other = {}
+        if options.get('stopwords'):
+            other['stopwords'] = stopwords
+        for key in ('postags', 'entities'):
+            if options.get(key):
+                other[key] = options[key]
+        if options.get('stemmer'):
+            from nltk.stem import SnowballStemmer
+            other['stemmer'] = SnowballStemmer(options['stemmer'])
+        configs[name] = other
+
+    return lexicons, configs
+
+
+def sweep_doc_terms(filepaths, lang, configs, matchers, cache=None,
+                    n_process=1, batch_size=4, profiler=None):
+    """
+    Construye matrices documento-palabra de documentos en filepaths para cada
+    configuración de filtros en configs, procesando cada documento con spacy una sola vez.
+
+    Parameters
+    ----------
+    filepaths: iterable of str or Path
+    lang: spacy.lang
+        Con los componentes que necesitan todas las configuraciones.
+    configs: dict (nombre, other)
+    matchers: dict (nombre de configuración, dict (llave, LexiconMatcher or None))
+        Expresiones de varias palabras a buscar con cada configuración.
+    cache: hp.DocCache, optional
+    n_process: int
+    batch_size: int
+    profiler: hp.Profiler, optional
+
+    Returns
+    -------
+    dict ((configuración, llave), tuple (scipy.sparse.csr_matrix, list of str, list of str))
+        Matriz, vocabulario y nombres de documentos de cada variante.
+    """
+    profiler = profiler or hp.NULL_PROFILER
+    docnames = []
+    builders = {(cname, key): DocTermBuilder() for cname in configs for key in matchers[cname]}
+
+    try:
+        parsed = hp.iter_parsed(filepaths, lang, cache, n_process, batch_size, profiler)
+        for fpath, doc in parsed:
+            docnames.append(fpath.stem)
+            for cname, other in configs.items():
+                with profiler.stage(fpath.stem, f'filter:{cname}'):
+                    masks = None
+                    for key, matcher in matchers[cname].items():
+                        if matcher is None:
+                            counts = doc_counts(doc, other)
+                        else:
+                            if masks is None:
+                                masks = list(hp.doc_sentence_masks(doc, other))
+                            counts = word_counts(matcher.sentences(masks))
+                        builders[(cname, key)].add(counts)
+    finally:
+        # un TokenFilter por configuración de la grilla
+        hp.clear_token_filters()
+
+    doc_terms = {}
+    for variant in list(builders):
+        counts, vocab = builders.pop(variant).matrix()
+        doc_terms[variant] = (counts, vocab, list(docnames))
+
+    return doc_terms
+
+
+def sweep_scores(filepaths, lang, lexicons, configs, cache=None,
+                 n_process=1, batch_size=4, profiler=None):
+    """
+    Calcula Financial Stability Sentiment index de documentos en filepaths
+    para cada combinación de diccionario y configuración de filtros,
+    procesando cada documento con spacy una sola vez.
+
+    Parameters
+    ----------
+    filepaths: iterable of str or Path
+    lang: spacy.lang
+        Con los componentes que necesitan todas las configuraciones.
+    lexicons: dict (nombre, tuple (pos, neg))
+    configs: dict (nombre, other)
+    cache: hp.DocCache, optional
+    n_process: int
+    batch_size: int
+    profiler: hp.Profiler, optional
+
+    Returns
+    -------
+    pandas.DataFrame (doc, lexicon, config, score)
+    """
+    import pandas as pd
+
+    profiler = profiler or hp.NULL_PROFILER
+
+    # diccionarios sin expresiones de varias palabras comparten matriz (llave None)
+    matchers, keys = {}, {}
+    for cname, other in configs.items():
+        matchers[cname], keys[cname] = {}, {}
+        for lname, (pos, neg) in lexicons.items():
+            matcher = lexicon_matcher(pos, neg, other)
+            key = lname if matcher is not None else None
+            matchers[cname][key] = matcher
+            keys[cname][lname] = key
+
+    doc_terms = sweep_doc_terms(filepaths, lang, configs, matchers, cache,
+                                n_process, batch_size, profiler)
+
+    results = []
+    with profiler.stage(None, 'score'):
+        for (cname, key), (counts, vocab, docnames) in doc_terms.items():
+            names = [lname for lname in lexicons if keys[cname][lname] == key]
+            fssm = fss_matrix(counts, lexicon_matrix(vocab, [lexicons[n] for n in names]))
+            for j, lname in enumerate(names):
+                results.append(pd.DataFrame(
+                    dict(doc=docnames, lexicon=lname, config=cname, score=fssm[:, j])))
+
+    table = pd.concat(results, ignore_index=True)
+    table['lexicon'] = pd.Categorical(table['lexicon'], categories=list(lexicons))
+    table['config'] = pd.Categorical(table['config'], categories=list(configs))
+    table = table.sort_values(['config', 'lexicon'], kind='mergesort').reset_index(drop=True)
+
+    return table[['doc', 'lexicon', 'config', 'score']].astype(dict(lexicon=str, config=str))
+
+
+def manifest_config(other=None, parser=False, matcher=None):
+    """
+    Huella de la configuración con que se construye la matriz documento-palabra,
+    guardada en manifest.json para saber qué documentos procesar de nuevo.
+
+    Parameters
+    ----------
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    parser: bool
+    matcher: LexiconMatcher, optional
+        La matriz incluye expresiones encontradas por matcher.
+
+    Returns
+    -------
+    str
+    """
+    options = dict(parser=parser)
+    if matcher is not None:
+        options['phrases'] = sorted(matcher.phrases)
+
+    return hp.config_hash(other, **options)
+
+
+def plot_isref(isref, filename):
+    """
+    Genera gráfica html del ISREF de cada documento.
+
+    Parameters
+    ----------
+    isref: pandas.DataFrame (score, doc)
+    filename: str
+    """
+    import pandas as pd
+    import plotly.offline as pyo
+    import plotly.graph_objs as go
+
+    fechas = pd.to_datetime(isref['doc'], format='%Y-%m-%d')
+
+    trace = go.Scatter(x=fechas, y=isref['score'],
+                       line=dict(width=2, color='#b04553'),
+                       marker=dict(size=8, color='#b04553'),
+                       mode='lines+markers',
+                       hoverinfo='text',
+                       hovertext=['Doc: {d:%Y-%m-%d}<br>ISREF: {i:.3f}'.format(
+                           d=d, i=i) for d, i in zip(fechas, isref['score'])],
+                       name='ISREF'
+                       )
+
+    axis = dict(
+        showline=True,
+        zeroline=True,
+        showgrid=True,
+        gridcolor='#ffffff',
+        automargin=True
+    )
+
+    layout = dict(title='Sentimiento de Reportes de Estabilidad Financiera',
+                  xaxis=dict(axis, **dict(title='Fecha')),
+                  yaxis=dict(axis, **dict(title='ISREF')),
+                  showlegend=False,
+                  autosize=True,
+                  plot_bgcolor='rgba(228, 222, 249, 0.65)'
+                  )
+
+    fig = dict(data=[trace], layout=layout)
+    pyo.plot(fig, show_link=False, filename=filename, auto_open=False)
+
+
+def add_arguments(parser):
+    """
+    Agrega a parser los argumentos de línea de comandos de isref.
+    """
     desc_dirdocs = "Ubicación de los documentos"
     parser.add_argument("dirdocs", help=desc_dirdocs)
     desc_wdfile = "Ubicación de archivo json de palabras positivas y negativas"
     parser.add_argument("wdfile", help=desc_wdfile)
     desc_stopsfile = "Ubicación de archivo excel de palabras a ignorar (stopwords)"
     parser.add_argument("stopsfile", help=desc_stopsfile)
-    args = parser.parse_args()
+    desc_cache = "Ubicación del cache de documentos procesados (default: <dirdocs>/cache)"
+    parser.add_argument("--cache", help=desc_cache)
+    desc_nocache = "No usar cache de documentos procesados"
+    parser.add_argument("--no-cache", action="store_true", help=desc_nocache)
+    desc_jobs = "Número de procesos para procesar documentos con spacy"
+    parser.add_argument("--jobs", type=int, default=1, help=desc_jobs)
+    desc_batch = "Número de documentos por lote de spacy"
+    parser.add_argument("--batch-size", type=int, default=4, help=desc_batch)
+    desc_parser = "Segmentar frases con el parser de spacy en lugar del sentencizer"
+    parser.add_argument("--parser", action="store_true", help=desc_parser)
+    desc_rescore = "Recalcular con matriz documento-palabra guardada, sin procesar documentos"
+    parser.add_argument("--rescore", action="store_true", help=desc_rescore)
+    desc_full = "Recalcular todos los documentos, ignorando resultados de corridas anteriores"
+    parser.add_argument("--full", action="store_true", help=desc_full)
+    desc_chunk = "Procesar cada documento por bloques de este número de caracteres, sin cache"
+    parser.add_argument("--chunk-size", type=int, help=desc_chunk)
+    # --agreement ya calcula el modo rápido para compararlo con spacy
+    fast = parser.add_mutually_exclusive_group()
+    desc_fast = ("Tokenizar con expresión regular, sin spacy (ignora filtros de entities y "
+                 "postags). Resultados en isref_fast.csv")
+    fast.add_argument("--fast", action="store_true", help=desc_fast)
+    desc_agreement = "Comparar por documento FSS con spacy y con tokenización rápida"
+    fast.add_argument("--agreement", action="store_true", help=desc_agreement)
+    desc_profile = "Registrar tiempos por documento y etapa en metrics/ (también con ISREF_PROFILE=1)"
+    parser.add_argument("--profile", action="store_true", help=desc_profile)
+    desc_sentences = "Guardar palabras por frase de cada documento en sentences/ (no con --chunk-size)"
+    parser.add_argument("--sentences", action="store_true", help=desc_sentences)
+    desc_sweep = ("Archivo json con grilla de diccionarios y configuraciones de filtros: "
+                  "calcula ISREF de cada combinación procesando cada documento una vez")
+    parser.add_argument("--sweep", help=desc_sweep)
+    desc_noplot = "No generar gráfica html (evita importar plotly)"
+    parser.add_argument("--no-plot", action="store_true", help=desc_noplot)
+    desc_store = ("Formato de resultados: csv (isref.csv) o parquet "
+                  "(particionado por corpus y configuración, en --store-dir)")
+    parser.add_argument("--store", choices=['csv', 'parquet'], default='csv', help=desc_store)
+    desc_storedir = "Ubicación del almacén parquet de resultados (default: resultados)"
+    parser.add_argument("--store-dir", default='resultados', help=desc_storedir)
+
+
+def main(args):
+    """
+    Calcula ISREF de docs ubicados en args.dirdocs y genera tabla y gráfica.
+    """
+    from scipy import sparse
+    import numpy as np
+    import pandas as pd
 
     dir_docs = args.dirdocs
     wdlist = args.wdfile
     pathstops = args.stopsfile
 
-    nlp = spacy.load('en_md')
-
     dir_corpus = os.path.join(dir_docs, 'corpus')
     dir_output = os.path.join('isref', Path(dir_docs).name)
     dir_logs = os.path.join(dir_output, 'logs')
@@ -104,11 +1321,10 @@ if __name__ == '__main__':
     logging.basicConfig(format=log_format, datefmt=log_datefmt,
                         level=logging.INFO, filename=logfile, filemode='w')
 
-    with open(wdlist, encoding='utf-8') as f:
-        diction = json.load(f, encoding='utf-8')
-
-    positive = diction.get('positive')
-    negative = diction.get('negative')
+    # palabras y stopwords compiladas en lexicon/, se recompilan si cambian los archivos
+    words = hp.load_lexicon(wdlist, pathstops, 'english', col='word')
+    positive = words['positive']
+    negative = words['negative']
 
     # opciones para incluir en extra
     # stemmer=SnowballStemmer('spanish')
@@ -116,57 +1332,177 @@ if __name__ == '__main__':
     # (stopwords=stops, entities=ents, postags=tags, stemmer=stemmer)
 
     #tags = ['NOUN', 'VERB', 'ADJ', 'ADV', 'ADP','AUX', 'DET', 'PRON']
-    stops = hp.load_stopwords(pathstops, 'english', col='word')
+    profiler = hp.get_profiler(args.profile)
+
+    stops = words['stopwords']
     ents = ['PER', 'ORG']
     extra = dict(stopwords=stops, entities=ents, )
 
-    scores = []
-    for fpath in hp.ordered_filepaths(dir_corpus):
-        result = {}
-        score = score_doc(fpath, positive, negative, nlp, extra)
-        result['score'] = score
-        result['doc'] = fpath.stem
-        scores.append(result)
+    # tokenización rápida solo puede filtrar stopwords y aplicar stemmer
+    fast_extra = {k: v for k, v in extra.items() if k not in ('postags', 'entities')}
+
+    # expresiones de varias palabras, compiladas una vez para todos los documentos
+    matcher = lexicon_matcher(positive, negative, extra)
+    if matcher is not None:
+        logging.info(f'Expresiones de varias palabras en diccionario: {len(matcher.phrases)}')
+    lexicon = hp.config_hash(dict(positive=positive, negative=negative))
+
+    if args.sweep:
+        # diccionario de wdfile y configuración extra se incluyen en la grilla
+        lexicons, configs = load_grid(args.sweep, stops)
+        lexicons = dict({Path(wdlist).stem: (positive, negative)}, **lexicons)
+        configs = dict(dict(default=extra), **configs)
+
+        needs = {key: True for other in configs.values() for key in other}
+        nlp = hp.load_language('en_md', needs, parser=args.parser)
+        cache = None
+        if not args.no_cache:
+            cache = hp.DocCache(args.cache or os.path.join(dir_docs, 'cache'), nlp)
+
+        sweep = sweep_scores(hp.ordered_filepaths(dir_corpus), nlp, lexicons, configs, cache,
+                             n_process=args.jobs, batch_size=args.batch_size, profiler=profiler)
+        with profiler.stage(None, 'write'):
+            sweep.to_csv(os.path.join(dir_output, 'isref_sweep.csv'),
+                         index=False, encoding='utf-8')
+
+        logging.info(f'Usando documentos en directorio: {Path(dir_docs).name}')
+        logging.info(f'Diccionarios: {list(lexicons)}')
+        logging.info(f'Configuraciones: {list(configs)}')
+        logging.info(f'Pipeline de spacy: {nlp.pipe_names}')
+        profiler.save(os.path.join(dir_output, 'metrics', '{}.json'.format(rundate)))
+        return
+
+    if args.fast:
+        counts, vocab, docnames = fast_doc_terms(
+            hp.ordered_filepaths(dir_corpus), fast_extra, matcher)
+        fssm = fss_matrix(counts, lexicon_matrix(vocab, [(positive, negative)]))
+        scores = [dict(score=score, doc=name)
+                  for name, score in zip(docnames, fssm[:, 0])]
+        pipeline = None
+        extra = fast_extra
+        logging.info('Tokenización rápida, sin spacy')
+    elif args.rescore:
+        counts, vocab, docnames = load_doc_terms(dir_output)
+        if matcher is not None:
+            missing = set(matcher.phrases) - set(vocab)
+            if missing:
+                logging.warning(f'Expresiones que no están en la matriz guardada (sin ocurrencias '
+                                f'o matriz calculada sin ellas): {sorted(missing)}')
+        fssm = fss_matrix(counts, lexicon_matrix(vocab, [(positive, negative)]))
+        scores = [dict(score=score, doc=name)
+                  for name, score in zip(docnames, fssm[:, 0])]
+        pipeline = None
+    else:
+        # solo se procesan documentos nuevos, modificados o con otra configuración.
+        # Cambios en el archivo de palabras se recalculan con la matriz documento-palabra.
+        manifest = hp.Manifest(os.path.join(dir_output, 'manifest.json'))
+        config = manifest_config(extra, args.parser, matcher)
+
+        # hash guardado de archivos sin cambios de tamaño ni fecha; los demás se
+        # procesan y su hash se calcula al leerlos, así cada archivo se lee una vez
+        filepaths = list(hp.ordered_filepaths(dir_corpus))
+        docnames = [fpath.stem for fpath in filepaths]
+        stats = {fpath.stem: hp.file_stat(fpath) for fpath in filepaths}
+        hashes = {name: manifest.known_hash(name, stats[name]) for name in docnames}
+
+        try:
+            previous = load_doc_terms(dir_output)
+        except FileNotFoundError:
+            previous = (sparse.csr_matrix((0, 0), dtype=np.int64), [], [])
+
+        # con --sentences también se procesan documentos sin palabras por frase guardadas.
+        # No dependen del archivo de palabras, que se aplica al leerlas con load_sentences
+        sentences = None
+        if args.sentences and args.chunk_size:
+            logging.warning('--sentences no se usa con --chunk-size')
+        elif args.sentences:
+            sentences = dict(dirpath=os.path.join(dir_output, 'sentences'))
+
+        tokenized = set(previous[2])
+        stale = [fpath for fpath in filepaths
+                 if args.full or fpath.stem not in tokenized or hashes[fpath.stem] is None or
+                 not manifest.is_current(fpath.stem, hash=hashes[fpath.stem], config=config) or
+                 (sentences and not has_sentences(sentences['dirpath'], fpath.stem))]
+
+        pipeline = None
+        new = (sparse.csr_matrix((0, 0), dtype=np.int64), [], [])
+        if stale:
+            nlp = hp.load_language('en_md', extra, parser=args.parser)
+            pipeline = nlp.pipe_names
+            cache = None
+            if not args.no_cache:
+                cache = hp.DocCache(args.cache or os.path.join(dir_docs, 'cache'), nlp)
+
+            new = corpus_doc_terms(stale, nlp, extra, cache,
+                                   n_process=args.jobs, batch_size=args.batch_size,
+                                   chunk_size=args.chunk_size, profiler=profiler,
+                                   sentences=sentences, matcher=matcher, hashes=hashes)
+
+        counts, vocab, docnames = merge_doc_terms(previous, new, docnames)
+        save_doc_terms(dir_output, counts, vocab, docnames)
+        with profiler.stage(None, 'score'):
+            fssm = fss_matrix(counts, lexicon_matrix(vocab, [(positive, negative)]))
+
+        scores = []
+        for name, score in zip(docnames, fssm[:, 0]):
+            manifest.update(name, score, hash=hashes[name], stat=stats[name], config=config,
+                            lexicon=lexicon)
+            scores.append(dict(score=score, doc=name))
+        manifest.prune(docnames)
+        manifest.save()
 
-    isref = pd.DataFrame(scores)
-    isref.dropna(subset=['score'], inplace=True)
-    isref.to_csv(os.path.join(dir_output, 'isref.csv'),
-                 index=False, encoding='utf-8')
+        logging.info(f'Documentos procesados en esta corrida: {len(stale)}')
+
+    if args.agreement:
+        counts, vocab, docnames = fast_doc_terms(
+            hp.ordered_filepaths(dir_corpus), fast_extra, matcher)
+        fssm = fss_matrix(counts, lexicon_matrix(vocab, [(positive, negative)]))
+        fast_scores = [dict(score=score, doc=name)
+                       for name, score in zip(docnames, fssm[:, 0])]
+        report = agreement_report(scores, fast_scores)
+        report.to_csv(os.path.join(dir_output, 'isref_agreement.csv'),
+                      index=False, encoding='utf-8')
+        logging.info(f'Diferencia absoluta media con tokenización rápida: '
+                     f'{report["abs_delta"].mean():.6f}')
+        logging.info(f'Diferencia absoluta máxima con tokenización rápida: '
+                     f'{report["abs_delta"].max():.6f}')
+        logging.info(f'Correlación con tokenización rápida: '
+                     f'{report["score"].corr(report["score_fast"]):.4f}')
+
+    # resultados aproximados de --fast no reemplazan los calculados con spacy
+    outname = 'isref_fast' if args.fast else 'isref'
+
+    with profiler.stage(None, 'write'):
+        isref = pd.DataFrame(scores)
+        isref.dropna(subset=['score'], inplace=True)
+        if args.store == 'parquet':
+            # una partición por corpus y configuración (filtros, diccionario, modo)
+            run = dict(options=sorted(extra), parser=args.parser, fast=args.fast,
+                       lexicon=Path(wdlist).name)
+            store = hp.ResultStore(args.store_dir)
+            store.upsert('isref', Path(dir_docs).name,
+                         hp.config_hash(extra, words=lexicon, **run), isref,
+                         keep=isref['doc'], description=run)
+        else:
+            isref.to_csv(os.path.join(dir_output, f'{outname}.csv'),
+                         index=False, encoding='utf-8')
 
     logging.info(f'Usando documentos en directorio: {Path(dir_docs).name}')
     logging.info(f'Usando archivo de palabras: {Path(wdlist).name}')
     logging.info(f'ISREF calculado para {len(isref.index)} documentos.')
     logging.info(f'Preprocesamiento usa: {list(extra.keys())}')
+    logging.info(f'Pipeline de spacy: {pipeline}')
 
     # generar gráfica del ISREF
-    fechas = pd.to_datetime(isref['doc'], format='%Y-%m-%d')
-
-    trace = go.Scatter(x=fechas, y=isref['score'],
-                       line=dict(width=2, color='#b04553'),
-                       marker=dict(size=8, color='#b04553'),
-                       mode='lines+markers',
-                       hoverinfo='text',
-                       hovertext=['Doc: {d:%Y-%m-%d}<br>ISREF: {i:.3f}'.format(
-                           d=d, i=i) for d, i in zip(fechas, isref['score'])],
-                       name='ISREF'
-                       )
+    if not args.no_plot:
+        with profiler.stage(None, 'plot'):
+            plot_isref(isref, os.path.join(dir_output, f'{outname}.html'))
 
-    axis = dict(
-        showline=True,
-        zeroline=True,
-        showgrid=True,
-        gridcolor='#ffffff',
-        automargin=True
-    )
+    profiler.save(os.path.join(dir_output, 'metrics', '{}.json'.format(rundate)))
 
-    layout = dict(title='Sentimiento de Reportes de Estabilidad Financiera',
-                  xaxis=dict(axis, **dict(title='Fecha')),
-                  yaxis=dict(axis, **dict(title='ISREF')),
-                  showlegend=False,
-                  autosize=True,
-                  plot_bgcolor='rgba(228, 222, 249, 0.65)'
-                  )
 
-    fig = dict(data=[trace], layout=layout)
-    filename = os.path.join(dir_output, 'isref.html')
-    plturl = pyo.plot(fig, show_link=False, filename=filename, auto_open=False)
+if __name__ == '__main__':
+    description = """Calcula ISREF de docs ubicados en dirdocs"""
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,16 +1,13 @@
 # coding: utf-8
+from collections import Counter
 from pathlib import Path
 import argparse
 import datetime
+import hashlib
+import json
 import logging
 import os
 
-import numpy as np
-import pandas as pd
-import plotly.offline as pyo
-import plotly.graph_objs as go
-import spacy
-
 import helpers as hp
 
 
@@ -49,6 +46,91 @@ def count_syllables(word):
     return count
 
 
+class SyllableTable:
+    """
+    Tabla de sílabas por palabra, compartida entre documentos y corridas.
+    Cada palabra distinta se cuenta una sola vez con count_syllables.
+    Se guarda en json con máximo maxsize palabras, conservando las más usadas.
+    """
+
+    def __init__(self, filepath=None, maxsize=200000):
+        self.filepath = Path(filepath) if filepath else None
+        self.maxsize = maxsize
+        self.syllables = {}
+        self.uses = Counter()
+
+        if self.filepath and self.filepath.is_file():
+            with open(self.filepath, encoding='utf-8') as f:
+                for word, (nsyll, uses) in json.load(f).items():
+                    self.syllables[word] = nsyll
+                    self.uses[word] = uses
+
+    def count(self, frequencies):
+        """
+        Total de sílabas de las palabras en frequencies.
+
+        Parameters
+        ----------
+        frequencies: dict (palabra, frecuencia)
+
+        Returns
+        -------
+        int
+        """
+        total = sum(freq * self.lookup(word) for word, freq in frequencies.items())
+        self.register(frequencies)
+
+        return total
+
+    def lookup(self, word):
+        """
+        Sílabas de word, contándolas solo si no está en la tabla.
+
+        Parameters
+        ----------
+        word: str
+
+        Returns
+        -------
+        int
+        """
+        nsyll = self.syllables.get(word)
+        if nsyll is None:
+            nsyll = self.syllables[word] = count_syllables(word)
+
+        return nsyll
+
+    def register(self, frequencies):
+        """
+        Suma frequencies al uso de cada palabra, que decide cuáles se conservan.
+
+        Parameters
+        ----------
+        frequencies: dict (palabra, frecuencia)
+        """
+        self.uses.update(frequencies)
+        if len(self.syllables) > 2 * self.maxsize:
+            self.trim()
+
+    def trim(self):
+        """
+        Deja en la tabla solo las maxsize palabras más usadas.
+        """
+        self.uses = Counter(dict(self.uses.most_common(self.maxsize)))
+        self.syllables = {w: self.syllables[w] for w in self.uses}
+
+    def save(self):
+        if not self.filepath:
+            return
+
+        self.trim()
+        table = {w: [self.syllables[w], uses] for w, uses in self.uses.items()}
+        tmp = self.filepath.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as out:
+            json.dump(table, out, ensure_ascii=False)
+        tmp.replace(self.filepath)
+
+
 def flesch_reading_ease(asl, asxw):
     """
     Calcula el Flesch Reading Ease score.
@@ -118,89 +200,383 @@ def flesch_kincaid_grade(asl, asxw):
     return round(fkg, 1)
 
 
-def doc_readability(fpath, lang, other=None):
+def gunning_fog(asl, pcw):
     """
-    Calcula Flesch Reading Ease y Flesch Kincaid de documento en fpath.
+    Calcula el Gunning Fog index.
 
     Parameters
     ----------
-    fpath: str of Path
-    lang: spacy.lang
-    other: dict, optional (stopwords, postags, entities, stemmer)
+    asl: float (average sentence length)
+    pcw: float (percentage of complex words)
 
     Returns
     -------
-    dict (reading_ease, kincaid_grade, grade, sentences, words)
+    float
     """
-    nsent, nwords, nsyll = (0, 0, 0)
-    text = hp.read_text(fpath)
-    doc = lang(text)
+    # https://en.wikipedia.org/wiki/Gunning_fog_index
+    fog = 0.4 * (asl + pcw)
+
+    return round(fog, 1)
 
-    for tokens in hp.doc_sentences(doc, other):
-        if tokens:
-            nsent += 1
-            nwords += len(tokens)
-            nsyll += sum(count_syllables(w) for w in tokens)
 
+def smog_grade(npoly, nsent):
+    """
+    Calcula el SMOG grade.
+
+    Parameters
+    ----------
+    npoly: int (number of polysyllables)
+    nsent: int (number of sentences)
+
+    Returns
+    -------
+    float
+    """
+    import numpy as np
+
+    # https://en.wikipedia.org/wiki/SMOG
     try:
-        asl = nwords / nsent
+        smog = 1.0430 * np.sqrt(npoly * 30 / nsent) + 3.1291
     except ZeroDivisionError:
-        asl = np.nan
+        smog = np.nan
+
+    return round(smog, 1)
+
+
+def coleman_liau(lpw, spw):
+    """
+    Calcula el Coleman-Liau index.
+
+    Parameters
+    ----------
+    lpw: float (average letters per 100 words)
+    spw: float (average sentences per 100 words)
+
+    Returns
+    -------
+    float
+    """
+    # https://en.wikipedia.org/wiki/Coleman%E2%80%93Liau_index
+    cli = 0.0588 * lpw - 0.296 * spw - 15.8
+
+    return round(cli, 1)
+
+
+def automated_readability(acxw, asl):
+    """
+    Calcula el Automated Readability Index.
+
+    Parameters
+    ----------
+    acxw: float (average characters per word)
+    asl: float (average sentence length)
+
+    Returns
+    -------
+    float
+    """
+    # https://en.wikipedia.org/wiki/Automated_readability_index
+    ari = 4.71 * acxw + 0.5 * asl - 21.43
+
+    return round(ari, 1)
+
+
+def is_complex(word, nsyll):
+    """
+    Indica si word es palabra compleja para Gunning Fog: tres o más sílabas,
+    sin contar las que llegan a tres solo por los sufijos -es, -ed o -ing.
+
+    Parameters
+    ----------
+    word: str
+    nsyll: int
+
+    Returns
+    -------
+    bool
+    """
+    if nsyll < 3:
+        return False
+
+    for suffix in ('es', 'ed', 'ing'):
+        if word.endswith(suffix) and len(word) > len(suffix) + 2:
+            return count_syllables(word[:-len(suffix)]) >= 3
+
+    return True
+
+
+def ratio(num, den):
+    """
+    num / den, o np.nan si den es cero.
+    """
+    import numpy as np
 
     try:
-        asxw = nsyll / nwords
+        return num / den
     except ZeroDivisionError:
-        asxw = np.nan
+        return np.nan
 
-    fre = flesch_reading_ease(asl, asxw)
-    fkg = flesch_kincaid_grade(asl, asxw)
-    grade = fre_to_grade(fre)
 
-    return dict(reading_ease=fre, kincaid_grade=fkg, grade=grade, sentences=nsent, words=nwords)
+class ReadabilityStats:
+    """
+    Acumula, en una sola pasada sobre las frases de un documento,
+    las estadísticas que usan todas las medidas de complejidad:
+    frases, palabras y tabla de frecuencias de palabras. Sílabas, polisílabas,
+    palabras complejas y caracteres se calculan por palabra distinta.
+    """
 
+    def __init__(self):
+        self.sentences = 0
+        self.words = 0
+        self.frequencies = Counter()
 
-if __name__ == '__main__':
-    description = """Calcula Complejidad del Lenguaje de docs ubicados en dirdocs"""
-    parser = argparse.ArgumentParser(description=description)
-    desc_dirdocs = "Ubicación de los documentos"
-    parser.add_argument("dirdocs", help=desc_dirdocs)
-    args = parser.parse_args()
+    def add(self, tokens):
+        """
+        Suma una frase de palabras tokens. Frases vacías no cuentan.
 
-    dir_docs = args.dirdocs
+        Parameters
+        ----------
+        tokens: list of str
+        """
+        if tokens:
+            self.sentences += 1
+            self.words += len(tokens)
+            self.frequencies.update(tokens)
+
+    def totals(self, syllables):
+        """
+        Parameters
+        ----------
+        syllables: SyllableTable
+
+        Returns
+        -------
+        dict (sentences, words, syllables, polysyllables, complex_words, characters)
+        """
+        nsyll, npoly, ncomplex, nchars = (0, 0, 0, 0)
+        for word, freq in self.frequencies.items():
+            wsyll = syllables.lookup(word)
+            nsyll += freq * wsyll
+            nchars += freq * len(word)
+            if wsyll >= 3:
+                npoly += freq
+                if is_complex(word, wsyll):
+                    ncomplex += freq
+        syllables.register(self.frequencies)
+
+        return dict(sentences=self.sentences, words=self.words, syllables=nsyll,
+                    polysyllables=npoly, complex_words=ncomplex, characters=nchars)
+
+    def scores(self, syllables):
+        """
+        Calcula todas las medidas de complejidad con las estadísticas acumuladas.
+
+        Parameters
+        ----------
+        syllables: SyllableTable
+
+        Returns
+        -------
+        dict (reading_ease, kincaid_grade, grade, sentences, words,
+              gunning_fog, smog, coleman_liau, ari)
+        """
+        stats = self.totals(syllables)
+        nsent, nwords = stats['sentences'], stats['words']
+
+        asl = ratio(nwords, nsent)
+        asxw = ratio(stats['syllables'], nwords)
+        acxw = ratio(stats['characters'], nwords)
+
+        fre = flesch_reading_ease(asl, asxw)
+        fkg = flesch_kincaid_grade(asl, asxw)
+        grade = fre_to_grade(fre)
+        fog = gunning_fog(asl, 100 * ratio(stats['complex_words'], nwords))
+        smog = smog_grade(stats['polysyllables'], nsent)
+        cli = coleman_liau(100 * acxw, 100 * ratio(nsent, nwords))
+        ari = automated_readability(acxw, asl)
+
+        return dict(reading_ease=fre, kincaid_grade=fkg, grade=grade,
+                    sentences=nsent, words=nwords,
+                    gunning_fog=fog, smog=smog, coleman_liau=cli, ari=ari)
+
+
+def doc_readability(fpath, lang, other=None, cache=None, syllables=None, chunk_size=None):
+    """
+    Calcula medidas de complejidad de documento en fpath.
 
-    nlp = spacy.load('en_md')
+    Parameters
+    ----------
+    fpath: str of Path
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    cache: hp.DocCache, optional
+    syllables: SyllableTable, optional
+    chunk_size: int, optional
+        Si se da, procesa el documento por bloques de chunk_size caracteres, sin cache.
 
-    dir_corpus = os.path.join(dir_docs, 'corpus')
-    dir_output = os.path.join('readability', Path(dir_docs).name)
-    dir_logs = os.path.join(dir_output, 'logs')
-    os.makedirs(dir_logs, exist_ok=True)
+    Returns
+    -------
+    dict (reading_ease, kincaid_grade, grade, sentences, words,
+          gunning_fog, smog, coleman_liau, ari)
+    """
+    if chunk_size:
+        return sentences_readability(
+            hp.chunk_doc_sentences(fpath, lang, other, chunk_size), syllables)
 
-    rundate = f'{datetime.date.today():%Y-%m-%d}'
-    logfile = os.path.join(dir_logs, '{}.log'.format(rundate))
-    log_format = '%(asctime)s : %(levelname)s : %(message)s'
-    log_datefmt = '%Y-%m-%d %H:%M:%S'
-    logging.basicConfig(format=log_format, datefmt=log_datefmt,
-                        level=logging.INFO, filename=logfile, filemode='w')
+    doc = hp.load_doc(fpath, lang, cache)
 
-    ents = ['PER', 'ORG']
-    extra = dict(entities=ents, )
+    return parsed_readability(doc, other, syllables)
+
+
+def parsed_readability(doc, other=None, syllables=None):
+    """
+    Calcula medidas de complejidad de un documento procesado,
+    en una sola pasada sobre sus frases.
+
+    Parameters
+    ----------
+    doc: spacy.tokens.Doc
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    syllables: SyllableTable, optional
+
+    Returns
+    -------
+    dict (reading_ease, kincaid_grade, grade, sentences, words,
+          gunning_fog, smog, coleman_liau, ari)
+    """
+    return sentences_readability(hp.doc_sentences(doc, other), syllables)
+
+
+def sentences_readability(sentences, syllables=None):
+    """
+    Calcula medidas de complejidad acumulando estadísticas frase por frase.
+
+    Parameters
+    ----------
+    sentences: iterable of list of str
+    syllables: SyllableTable, optional
+
+    Returns
+    -------
+    dict (reading_ease, kincaid_grade, grade, sentences, words,
+          gunning_fog, smog, coleman_liau, ari)
+    """
+    if syllables is None:
+        syllables = SYLLABLES
+
+    stats = ReadabilityStats()
+    for tokens in sentences:
+        stats.add(tokens)
+
+    return stats.scores(syllables)
+
+
+def corpus_readability(directory, lang, other=None, cache=None,
+                       n_process=1, batch_size=4, filepaths=None, syllables=None,
+                       chunk_size=None, profiler=None, hashes=None):
+    """
+    Calcula medidas de complejidad de cada documento en directory,
+    procesando documentos en lotes con lang.pipe.
+
+    Parameters
+    ----------
+    directory: str or Path
+    lang: spacy.lang
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    cache: hp.DocCache, optional
+    n_process: int
+    batch_size: int
+    filepaths: list of Path, optional
+        Documentos a procesar. Por defecto todos los de directory.
+    syllables: SyllableTable, optional
+    chunk_size: int, optional
+        Si se da, procesa cada documento por bloques de chunk_size caracteres,
+        uno a la vez y sin cache.
+    profiler: hp.Profiler, optional
+    hashes: dict, optional
+        Si se da, recibe hp.text_hash del texto de cada documento (llave: nombre),
+        calculado al leerlo para procesarlo.
+
+    Returns
+    -------
+    list of dict (reading_ease, kincaid_grade, grade, sentences, words,
+                  gunning_fog, smog, coleman_liau, ari, doc)
+        En el orden de hp.ordered_filepaths.
+    """
+    if filepaths is None:
+        filepaths = hp.ordered_filepaths(directory)
+    profiler = profiler or hp.NULL_PROFILER
 
     scores = []
-    for fpath in hp.ordered_filepaths(dir_corpus):
-        results = doc_readability(fpath, nlp, extra)
+    if chunk_size:
+        for fpath in filepaths:
+            with profiler.stage(Path(fpath).stem, 'chunks') as record:
+                digest = hashlib.sha1()
+                results = sentences_readability(
+                    hp.chunk_doc_sentences(fpath, lang, other, chunk_size, digest), syllables)
+                record['tokens'] = results['words']
+            if hashes is not None:
+                hashes[Path(fpath).stem] = digest.hexdigest()
+            results['doc'] = Path(fpath).stem
+            scores.append(results)
+
+        return scores
+
+    parsed = hp.iter_parsed(filepaths, lang, cache, n_process, batch_size, profiler, hashes)
+    for fpath, doc in parsed:
+        sentences = hp.doc_sentences(doc, other)
+        if profiler.enabled:
+            # con instrumentación, filtrar y calcular se miden por separado
+            with profiler.stage(fpath.stem, 'filter') as record:
+                sentences = list(sentences)
+                record['tokens'] = sum(len(tokens) for tokens in sentences)
+        with profiler.stage(fpath.stem, 'score'):
+            results = sentences_readability(sentences, syllables)
         results['doc'] = fpath.stem
         scores.append(results)
 
-    readability = pd.DataFrame(scores)
-    readability.to_csv(os.path.join(dir_output, 'readability.csv'),
-                       index=False, encoding='utf-8')
+    return scores
 
-    logging.info(f'Usando documentos en directorio: {Path(dir_docs).name}')
-    logging.info(
-        f'Complejidad de lenguaje calculada para {len(readability.index)} documentos.')
-    logging.info(f'Preprocesamiento usa: {list(extra.keys())}')
 
-   # generar gráfica de Complejidad del Lenguaje
+# tabla de sílabas en memoria, usada si no se indica otra
+SYLLABLES = SyllableTable()
+
+# columnas de readability.csv y su formato en la tabla html
+COLUMNS = dict(doc=None, grade=None, kincaid_grade='.1f', reading_ease='.2f',
+               sentences=None, words=',', gunning_fog='.1f', smog='.1f',
+               coleman_liau='.1f', ari='.1f')
+
+
+def manifest_config(other=None, parser=False):
+    """
+    Huella de la configuración con que se calculan las medidas,
+    guardada en manifest.json para saber qué documentos procesar de nuevo.
+
+    Parameters
+    ----------
+    other: dict, optional (stopwords, postags, entities, stemmer)
+    parser: bool
+
+    Returns
+    -------
+    str
+    """
+    return hp.config_hash(other, parser=parser, columns=list(COLUMNS))
+
+
+def plot_readability(readability, filename):
+    """
+    Genera gráfica html y tabla de Complejidad del Lenguaje de cada documento.
+
+    Parameters
+    ----------
+    readability: pandas.DataFrame (columnas en COLUMNS)
+    filename: str
+    """
+    import pandas as pd
+    import plotly.offline as pyo
+    import plotly.graph_objs as go
+
     fechas = pd.to_datetime(readability['doc'], format='%Y-%m-%d')
     kink = readability['kincaid_grade']
     ease = readability['reading_ease']
@@ -228,13 +604,13 @@ if __name__ == '__main__':
 
     table = go.Table(
         domain=dict(x=[0, 1.0], y=[0, 0.5]),
-        columnorder=[0, 1, 2, 3, 4, 5],
+        columnorder=list(range(len(COLUMNS))),
         header=dict(values=['<b>{}</b>'.format(c) for c in readability.columns],
                     fill=dict(color='#C2D4FF')
                     ),
         cells=dict(values=[readability[c] for c in readability.columns],
                    fill=dict(color=['#C2D4FF', '#F5F8FF']),
-                   format=[None, None, '.1f', '.2f', None, ','],)
+                   format=list(COLUMNS.values()),)
     )
 
     axis = dict(
@@ -260,6 +636,128 @@ if __name__ == '__main__':
     )
 
     fig = dict(data=[trace_grade, trace_ease, table], layout=layout)
+    pyo.plot(fig, show_link=False, filename=filename, auto_open=False)
+
+
+def add_arguments(parser):
+    """
+    Agrega a parser los argumentos de línea de comandos de readability.
+    """
+    desc_dirdocs = "Ubicación de los documentos"
+    parser.add_argument("dirdocs", help=desc_dirdocs)
+    desc_cache = "Ubicación del cache de documentos procesados (default: <dirdocs>/cache)"
+    parser.add_argument("--cache", help=desc_cache)
+    desc_nocache = "No usar cache de documentos procesados"
+    parser.add_argument("--no-cache", action="store_true", help=desc_nocache)
+    desc_jobs = "Número de procesos para procesar documentos con spacy"
+    parser.add_argument("--jobs", type=int, default=1, help=desc_jobs)
+    desc_batch = "Número de documentos por lote de spacy"
+    parser.add_argument("--batch-size", type=int, default=4, help=desc_batch)
+    desc_parser = "Segmentar frases con el parser de spacy en lugar del sentencizer"
+    parser.add_argument("--parser", action="store_true", help=desc_parser)
+    desc_full = "Recalcular todos los documentos, ignorando resultados de corridas anteriores"
+    parser.add_argument("--full", action="store_true", help=desc_full)
+    desc_chunk = "Procesar cada documento por bloques de este número de caracteres, sin cache"
+    parser.add_argument("--chunk-size", type=int, help=desc_chunk)
+    desc_profile = "Registrar tiempos por documento y etapa en metrics/ (también con ISREF_PROFILE=1)"
+    parser.add_argument("--profile", action="store_true", help=desc_profile)
+    desc_noplot = "No generar gráfica html (evita importar plotly)"
+    parser.add_argument("--no-plot", action="store_true", help=desc_noplot)
+    desc_store = ("Formato de resultados: csv (readability.csv) o parquet "
+                  "(particionado por corpus y configuración, en --store-dir)")
+    parser.add_argument("--store", choices=['csv', 'parquet'], default='csv', help=desc_store)
+    desc_storedir = "Ubicación del almacén parquet de resultados (default: resultados)"
+    parser.add_argument("--store-dir", default='resultados', help=desc_storedir)
+
+
+def main(args):
+    """
+    Calcula Complejidad del Lenguaje de docs ubicados en args.dirdocs y genera tabla y gráfica.
+    """
+    import pandas as pd
+
+    dir_docs = args.dirdocs
+
+    dir_corpus = os.path.join(dir_docs, 'corpus')
+    dir_output = os.path.join('readability', Path(dir_docs).name)
+    dir_logs = os.path.join(dir_output, 'logs')
+    os.makedirs(dir_logs, exist_ok=True)
 
-    f = os.path.join(dir_output, 'readability.html')
-    pltfile = pyo.plot(fig, show_link=False, filename=f, auto_open=False)
+    rundate = f'{datetime.date.today():%Y-%m-%d}'
+    logfile = os.path.join(dir_logs, '{}.log'.format(rundate))
+    log_format = '%(asctime)s : %(levelname)s : %(message)s'
+    log_datefmt = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(format=log_format, datefmt=log_datefmt,
+                        level=logging.INFO, filename=logfile, filemode='w')
+
+    profiler = hp.get_profiler(args.profile)
+
+    ents = ['PER', 'ORG']
+    extra = dict(entities=ents, )
+
+    # solo se procesan documentos nuevos, modificados o con otra configuración
+    manifest = hp.Manifest(os.path.join(dir_output, 'manifest.json'))
+    config = manifest_config(extra, args.parser)
+
+    # hash guardado de archivos sin cambios de tamaño ni fecha; los demás se
+    # procesan y su hash se calcula al leerlos, así cada archivo se lee una vez
+    filepaths = list(hp.ordered_filepaths(dir_corpus))
+    stats = {fpath.stem: hp.file_stat(fpath) for fpath in filepaths}
+    hashes = {name: manifest.known_hash(name, stat) for name, stat in stats.items()}
+    stale = [fpath for fpath in filepaths
+             if args.full or hashes[fpath.stem] is None or
+             not manifest.is_current(fpath.stem, hash=hashes[fpath.stem], config=config)]
+
+    pipeline = None
+    if stale:
+        nlp = hp.load_language('en_md', extra, parser=args.parser)
+        pipeline = nlp.pipe_names
+        cache = None
+        if not args.no_cache:
+            cache = hp.DocCache(args.cache or os.path.join(dir_docs, 'cache'), nlp)
+
+        syllables = SyllableTable(os.path.join('readability', 'syllables.json'))
+        for results in corpus_readability(dir_corpus, nlp, extra, cache,
+                                          n_process=args.jobs, batch_size=args.batch_size,
+                                          filepaths=stale, syllables=syllables,
+                                          chunk_size=args.chunk_size, profiler=profiler,
+                                          hashes=hashes):
+            name = results.pop('doc')
+            manifest.update(name, results, hash=hashes[name], stat=stats[name], config=config)
+        syllables.save()
+
+    scores = [dict(manifest.result(fpath.stem), doc=fpath.stem) for fpath in filepaths]
+    manifest.prune(hashes)
+    manifest.save()
+
+    with profiler.stage(None, 'write'):
+        readability = pd.DataFrame(scores, columns=list(COLUMNS))
+        if args.store == 'parquet':
+            run = dict(options=sorted(extra), parser=args.parser)
+            store = hp.ResultStore(args.store_dir)
+            store.upsert('readability', Path(dir_docs).name, config, readability,
+                         keep=readability['doc'], description=run)
+        else:
+            readability.to_csv(os.path.join(dir_output, 'readability.csv'),
+                               index=False, encoding='utf-8')
+
+    logging.info(f'Usando documentos en directorio: {Path(dir_docs).name}')
+    logging.info(
+        f'Complejidad de lenguaje calculada para {len(readability.index)} documentos.')
+    logging.info(f'Preprocesamiento usa: {list(extra.keys())}')
+    logging.info(f'Pipeline de spacy: {pipeline}')
+    logging.info(f'Documentos procesados en esta corrida: {len(stale)}')
+
+   # generar gráfica de Complejidad del Lenguaje
+    if not args.no_plot:
+        with profiler.stage(None, 'plot'):
+            plot_readability(readability, os.path.join(dir_output, 'readability.html'))
+
+    profiler.save(os.path.join(dir_output, 'metrics', '{}.json'.format(rundate)))
+
+
+if __name__ == '__main__':
+    description = """Calcula Complejidad del Lenguaje de docs ubicados en dirdocs"""
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    main(parser.parse_args())
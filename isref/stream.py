@@ -0,0 +1,366 @@
+# coding: utf-8
+"""Modulo para extraer y calcular indicadores de documentos nuevos sin archivos intermedios."""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import asyncio
+import csv
+import datetime
+import functools
+import logging
+import os
+
+import extraction as ex
+import helpers as hp
+import isref as isr
+import readability as rd
+
+# columnas de los resultados en stream/<corpus>/<fecha>.csv
+RESULT_COLUMNS = ['doc', 'score'] + list(rd.COLUMNS)[1:]
+
+
+class TextScorer:
+    """
+    Calcula ISREF y medidas de complejidad de un texto extraído, procesándolo
+    con spacy una sola vez. Con cache, los documentos procesados quedan
+    disponibles para isref.py y readability.py.
+    """
+
+    def __init__(self, lenguaje, positive, negative, isref_extra=None,
+                 readability_extra=None, cache=None, syllables=None):
+        self.lenguaje = lenguaje
+        self.positive = hp.WordSet(positive)
+        self.negative = hp.WordSet(negative)
+        self.isref_extra = isref_extra
+        self.readability_extra = readability_extra
+        self.cache = cache
+        self.syllables = syllables
+        self.matcher = isr.lexicon_matcher(positive, negative, isref_extra)
+
+    def __call__(self, name, text):
+        """
+        Parameters
+        ----------
+        name: str
+        text: str
+
+        Returns
+        -------
+        dict (doc, score, reading_ease, kincaid_grade, grade, sentences, words,
+              gunning_fog, smog, coleman_liau, ari)
+        """
+        doc = hp.parse_text(text, self.lenguaje, self.cache, name=name)
+        results = dict(doc=name, score=isr.doc_fss(doc, self.positive, self.negative,
+                                                   self.isref_extra, self.matcher))
+        results.update(rd.parsed_readability(doc, self.readability_extra, self.syllables))
+
+        return results
+
+
+async def extract_all(filepaths, queue, client, executor, workers):
+    """
+    Extrae texto de filepaths con hasta workers llamadas a TIKA a la vez y pone
+    (filepath, info) en queue. Si queue está llena las extracciones esperan, así que
+    en memoria hay como máximo workers + queue.maxsize textos. Al terminar pone None.
+
+    Parameters
+    ----------
+    filepaths: iterable of Path
+    queue: asyncio.Queue
+    client: extraction.TikaClient
+    executor: concurrent.futures.ThreadPoolExecutor
+    workers: int
+    """
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(workers)
+
+    async def extract_one(fpath):
+        async with semaphore:
+            info = await loop.run_in_executor(executor, ex.safe_extract, fpath, client)
+            await queue.put((fpath, info))
+
+    await asyncio.gather(*(extract_one(fpath) for fpath in filepaths))
+    await queue.put(None)
+
+
+async def score_all(queue, score, executor, save=None, record=None):
+    """
+    Consume textos de queue hasta recibir None y calcula indicadores con score
+    en executor, sin bloquear las extracciones.
+
+    Parameters
+    ----------
+    queue: asyncio.Queue
+    score: callable (nombre, texto) -> dict
+    executor: concurrent.futures.ThreadPoolExecutor
+    save: callable (filepath, info), optional
+        Se llama con cada extracción exitosa, después de calcular sus indicadores.
+    record: callable (filepath, dict), optional
+        Se llama con los indicadores de cada documento, después de save.
+
+    Returns
+    -------
+    tuple (list of dict, int)
+        Resultados de cada documento y número de documentos sin texto.
+    """
+    loop = asyncio.get_event_loop()
+    results, failed = [], 0
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+
+        fpath, info = item
+        if not (info and info.get('text')):
+            failed += 1
+            continue
+        result = await loop.run_in_executor(executor, score, fpath.stem, info['text'])
+        if save is not None:
+            save(fpath, info)
+        if record is not None:
+            record(fpath, result)
+        results.append(result)
+
+    return results, failed
+
+
+def stream_scores(filepaths, score, client, workers=4, queue_size=8, save=None, record=None):
+    """
+    Extrae texto de filepaths con TIKA y calcula indicadores a medida que
+    llegan los textos, sin esperar a que termine la extracción de todos.
+
+    Parameters
+    ----------
+    filepaths: iterable of Path
+    score: callable (nombre, texto) -> dict
+    client: extraction.TikaClient
+    workers: int
+        Extracciones simultáneas.
+    queue_size: int
+        Textos extraídos en espera de ser procesados.
+    save: callable (filepath, info), optional
+    record: callable (filepath, dict), optional
+
+    Returns
+    -------
+    tuple (list of dict, int)
+        Resultados ordenados por documento y número de documentos sin texto.
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    extractors = ThreadPoolExecutor(max_workers=workers)
+    scorer = ThreadPoolExecutor(max_workers=1)
+    producer = asyncio.ensure_future(
+        extract_all(filepaths, queue, client, extractors, workers), loop=loop)
+    try:
+        results, failed = loop.run_until_complete(score_all(queue, score, scorer, save, record))
+        loop.run_until_complete(producer)
+    finally:
+        # si score_all falla, extract_all quedaría esperando espacio en queue
+        if not producer.done():
+            producer.cancel()
+            loop.run_until_complete(asyncio.gather(producer, return_exceptions=True))
+        extractors.shutdown()
+        scorer.shutdown()
+
+    return sorted(results, key=lambda r: r['doc']), failed
+
+
+def append_result(filepath, fpath, result):
+    """
+    Agrega fila con indicadores result de documento fpath a filepath (csv
+    con columnas RESULT_COLUMNS), para no perder avance si la corrida se interrumpe.
+
+    Parameters
+    ----------
+    filepath: str or Path
+    fpath: Path
+    result: dict
+    """
+    new = not os.path.isfile(filepath)
+    with open(filepath, 'a', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+        if new:
+            writer.writeheader()
+        writer.writerow(result)
+
+
+def scored_docs(dir_results):
+    """
+    Documentos con indicadores en algún csv de resultados de dir_results.
+
+    Parameters
+    ----------
+    dir_results: str or Path
+
+    Returns
+    -------
+    set of str
+    """
+    done = set()
+    for filepath in Path(dir_results).glob('*.csv'):
+        with open(filepath, newline='', encoding='utf-8') as f:
+            done.update(row['doc'] for row in csv.DictReader(f) if row.get('doc'))
+
+    return done
+
+
+def pending_files(dir_input, dir_output, dir_results=None):
+    """
+    Documentos en dir_input sin texto en dir_output ni fila en procesados.csv.
+
+    Parameters
+    ----------
+    dir_input: str or Path
+    dir_output: str or Path
+    dir_results: str or Path, optional
+        También se omiten documentos con indicadores en los resultados de
+        dir_results, aunque no se haya guardado su texto.
+
+    Returns
+    -------
+    list of Path
+    """
+    done = set()
+    procfile = os.path.join(dir_output, 'procesados.csv')
+    if os.path.isfile(procfile):
+        with open(procfile, newline='', encoding='utf-8') as f:
+            done = {Path(row[0]).stem for row in csv.reader(f) if row}
+    if dir_results is not None:
+        done |= scored_docs(dir_results)
+
+    return sorted(f for f in Path(dir_input).iterdir()
+                  if f.suffix.lower() in ex.FORMATOS and f.stem not in done and
+                  not os.path.isfile(os.path.join(dir_output, f'{f.stem}.txt')))
+
+
+def add_arguments(parser):
+    """
+    Agrega a parser los argumentos de línea de comandos de stream.
+    """
+    desc_dirinput = "Ubicación de los documentos"
+    parser.add_argument("dirinput", help=desc_dirinput)
+    desc_wdfile = "Ubicación de archivo json de palabras positivas y negativas"
+    parser.add_argument("wdfile", help=desc_wdfile)
+    desc_stopsfile = "Ubicación de archivo excel de palabras a ignorar (stopwords)"
+    parser.add_argument("stopsfile", help=desc_stopsfile)
+    desc_workers = "Número de documentos a extraer en paralelo"
+    parser.add_argument("--workers", type=int, default=4, help=desc_workers)
+    desc_queue = "Textos extraídos en espera de ser procesados con spacy"
+    parser.add_argument("--queue", type=int, default=8, help=desc_queue)
+    desc_server = "URL del TIKA Rest Server (default: TIKA_SERVER_ENDPOINT o http://localhost:9998)"
+    parser.add_argument("--server", help=desc_server)
+    desc_sample = "Caracteres de texto usados para detectar idioma (0: todo el texto)"
+    parser.add_argument("--sample", type=int, default=20000, help=desc_sample)
+    desc_notext = "No guardar texto extraído en corpus/"
+    parser.add_argument("--no-text", action="store_true", help=desc_notext)
+    desc_noprocessed = "No agregar documentos extraídos a corpus/procesados.csv"
+    parser.add_argument("--no-processed", action="store_true", help=desc_noprocessed)
+    desc_cache = "Ubicación del cache de documentos procesados (default: <dirinput>/cache)"
+    parser.add_argument("--cache", help=desc_cache)
+    desc_nocache = "No usar cache de documentos procesados"
+    parser.add_argument("--no-cache", action="store_true", help=desc_nocache)
+    desc_parser = "Segmentar frases con el parser de spacy en lugar del sentencizer"
+    parser.add_argument("--parser", action="store_true", help=desc_parser)
+    desc_store = ("Agregar resultados al almacén parquet (particionado por corpus "
+                  "y configuración, en --store-dir)")
+    parser.add_argument("--store", choices=['csv', 'parquet'], default='csv', help=desc_store)
+    desc_storedir = "Ubicación del almacén parquet de resultados (default: resultados)"
+    parser.add_argument("--store-dir", default='resultados', help=desc_storedir)
+
+
+def main(args):
+    """
+    Extrae texto de documentos nuevos en args.dirinput y calcula su ISREF y
+    Complejidad del Lenguaje a medida que se extraen.
+    """
+    import pandas as pd
+
+    dir_input = args.dirinput
+    dir_corpus = os.path.join(dir_input, 'corpus')
+    os.makedirs(dir_corpus, exist_ok=True)
+    dir_output = os.path.join('stream', Path(dir_input).name)
+    dir_logs = os.path.join(dir_output, 'logs')
+    os.makedirs(dir_logs, exist_ok=True)
+
+    rundate = f'{datetime.date.today():%Y-%m-%d}'
+    logfile = os.path.join(dir_logs, '{}.log'.format(rundate))
+    log_format = '%(asctime)s : %(levelname)s : %(message)s'
+    log_datefmt = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(format=log_format, datefmt=log_datefmt,
+                        level=logging.INFO, filename=logfile, filemode='w')
+
+    words = hp.load_lexicon(args.wdfile, args.stopsfile, 'english', col='word')
+    positive = words['positive']
+    negative = words['negative']
+
+    # mismas opciones que isref.py y readability.py
+    stops = words['stopwords']
+    ents = ['PER', 'ORG']
+    isref_extra = dict(stopwords=stops, entities=ents, )
+    readability_extra = dict(entities=ents, )
+
+    pendientes = pending_files(dir_input, dir_corpus, dir_output)
+    logging.info(f'Documentos nuevos: {len(pendientes)}')
+    if not pendientes:
+        return
+
+    nlp = hp.load_language('en_md', isref_extra, parser=args.parser)
+    cache = None
+    if not args.no_cache:
+        cache = hp.DocCache(args.cache or os.path.join(dir_input, 'cache'), nlp)
+    os.makedirs('readability', exist_ok=True)
+    syllables = rd.SyllableTable(os.path.join('readability', 'syllables.json'))
+    score = TextScorer(nlp, positive, negative, isref_extra, readability_extra,
+                       cache, syllables)
+
+    save = None
+    if not (args.no_text and args.no_processed):
+        save = functools.partial(ex.save_extracted, dir_output=dir_corpus,
+                                 text=not args.no_text, processed=not args.no_processed)
+
+    # cada documento se agrega a los resultados del día apenas se calcula
+    resfile = os.path.join(dir_output, f'{rundate}.csv')
+    record = functools.partial(append_result, resfile)
+
+    client = ex.TikaClient(args.server, workers=args.workers, sample=args.sample)
+    try:
+        results, failed = stream_scores(pendientes, score, client, args.workers, args.queue,
+                                        save, record)
+    finally:
+        syllables.save()
+
+    # una fila por documento en los resultados del día, la última calculada
+    scores = pd.DataFrame(results, columns=RESULT_COLUMNS)
+    if os.path.isfile(resfile):
+        daily = pd.read_csv(resfile, dtype=dict(doc=str), encoding='utf-8')
+        daily = daily.drop_duplicates('doc', keep='last').sort_values('doc')
+        tmp = f'{resfile}.tmp'
+        daily.to_csv(tmp, index=False, encoding='utf-8')
+        os.replace(tmp, resfile)
+
+    if args.store == 'parquet':
+        # mismas particiones que isref.py y readability.py
+        store = hp.ResultStore(args.store_dir)
+        lexicon = hp.config_hash(dict(positive=positive, negative=negative))
+        run = dict(options=sorted(isref_extra), parser=args.parser, fast=False,
+                   lexicon=Path(args.wdfile).name)
+        isref = scores[['score', 'doc']].dropna(subset=['score'])
+        store.upsert('isref', Path(dir_input).name,
+                     hp.config_hash(isref_extra, words=lexicon, **run), isref, description=run)
+        run = dict(options=sorted(readability_extra), parser=args.parser)
+        store.upsert('readability', Path(dir_input).name,
+                     rd.manifest_config(readability_extra, args.parser),
+                     scores[list(rd.COLUMNS)], description=run)
+
+    logging.info(f'Usando documentos en directorio: {Path(dir_input).name}')
+    logging.info(f'Indicadores calculados para {len(results)} documentos, {failed} sin texto')
+    logging.info(f'Bytes enviados a TIKA: {client.bytes_sent}, recibidos: {client.bytes_received}')
+    logging.info(f'Pipeline de spacy: {nlp.pipe_names}')
+
+
+if __name__ == '__main__':
+    description = """Extrae y calcula indicadores de documentos nuevos en dirinput"""
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+# coding: utf-8
+"""Modulo para crear corpus y modelos de tópicos de documentos."""
+from pathlib import Path
+import argparse
+import datetime
+import logging
+import os
+
+import helpers as hp
+
+
+def train_topics(corpus, num_topics, passes=10, seed=0):
+    """
+    Entrena modelo LDA de num_topics tópicos sobre corpus.
+
+    Parameters
+    ----------
+    corpus: hp.MiCorpus
+    num_topics: int
+    passes: int
+    seed: int
+
+    Returns
+    -------
+    gensim.models.LdaModel
+    """
+    from gensim.models import LdaModel
+
+    return LdaModel(corpus, num_topics=num_topics, id2word=corpus.diccionario,
+                    passes=passes, random_state=seed)
+
+
+def add_arguments(parser):
+    """
+    Agrega a parser los argumentos de línea de comandos de topics.
+    """
+    desc_dirdocs = "Ubicación de los documentos"
+    parser.add_argument("dirdocs", help=desc_dirdocs)
+    desc_stopsfile = "Ubicación de archivo excel de palabras a ignorar (stopwords)"
+    parser.add_argument("stopsfile", help=desc_stopsfile)
+    desc_topics = "Número de tópicos del modelo LDA (0: solo crear diccionario y corpus)"
+    parser.add_argument("--topics", type=int, default=0, help=desc_topics)
+    desc_passes = "Pasadas sobre el corpus al entrenar el modelo LDA"
+    parser.add_argument("--passes", type=int, default=10, help=desc_passes)
+    desc_parser = "Segmentar frases con el parser de spacy en lugar del sentencizer"
+    parser.add_argument("--parser", action="store_true", help=desc_parser)
+
+
+def main(args):
+    """
+    Crea diccionario, ngramas y corpus de docs ubicados en args.dirdocs
+    y, si se pide, modelo LDA de tópicos.
+    """
+    dir_docs = args.dirdocs
+    pathstops = args.stopsfile
+
+    dir_corpus = os.path.join(dir_docs, 'corpus')
+    dir_output = os.path.join('modelos', Path(dir_docs).name)
+    dir_logs = os.path.join(dir_output, 'logs')
+    os.makedirs(dir_logs, exist_ok=True)
+
+    rundate = f'{datetime.date.today():%Y-%m-%d}'
+    logfile = os.path.join(dir_logs, '{}.log'.format(rundate))
+    log_format = '%(asctime)s : %(levelname)s : %(message)s'
+    log_datefmt = '%Y-%m-%d %H:%M:%S'
+    logging.basicConfig(format=log_format, datefmt=log_datefmt,
+                        level=logging.INFO, filename=logfile, filemode='w')
+
+    stops = hp.load_lexicon(stopsfile=pathstops, sheet='english', col='word')['stopwords']
+    tags = ['NOUN', 'VERB', 'ADJ', 'ADV', 'ADP', 'AUX', 'DET', 'PRON']
+    ents = ['PER', 'ORG']
+    extra = dict(stopwords=stops, postags=tags, entities=ents, )
+
+    # spacy solo se carga si el corpus guardado no corresponde a los documentos
+    nlp = None
+    if not hp.MiCorpus.is_current(dir_output, dir_corpus, extra):
+        nlp = hp.load_language('en_md', extra, parser=args.parser)
+    corpus = hp.MiCorpus.load(dir_output, dir_corpus, nlp, extra)
+
+    logging.info(f'Usando documentos en directorio: {Path(dir_docs).name}')
+    logging.info(f'Documentos en corpus: {len(corpus)}')
+    logging.info(f'Palabras en diccionario: {len(corpus.diccionario)}')
+    logging.info(f'Corpus procesado en esta corrida: {nlp is not None}')
+
+    if args.topics:
+        lda = train_topics(corpus, args.topics, passes=args.passes)
+        lda.save(os.path.join(dir_output, f'lda_{args.topics}.model'))
+        for topic, words in lda.show_topics(num_topics=args.topics, num_words=10):
+            logging.info(f'Tópico {topic}: {words}')
+
+
+if __name__ == '__main__':
+    description = """Crea corpus y modelos de tópicos de docs ubicados en dirdocs"""
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    main(parser.parse_args())
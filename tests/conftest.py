@@ -0,0 +1,19 @@
+# coding: utf-8
+"""Los scripts de isref/ se importan como módulos sueltos (import helpers as hp)."""
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'isref'))
+
+
+@pytest.fixture
+def stub_tika():
+    """URL de un servidor que responde como TIKA Rest Server."""
+    import benchmarks as bm
+
+    server, url = bm.serve_stub_tika()
+    yield url
+    server.shutdown()
+    server.server_close()
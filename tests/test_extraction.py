@@ -0,0 +1,86 @@
+# coding: utf-8
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import shutil
+import sys
+
+import pytest
+
+import extraction as ex
+
+DOCS = {'2019-06.pdf': 'Financial stability report.\n\nRisks remain elevated.',
+        '2019-12.docx': 'Segundo reporte, con acentos: información.',
+        'notas.txt': 'No es un formato a extraer.'}
+
+
+@pytest.fixture
+def dir_docs(tmpdir):
+    directory = Path(str(tmpdir), 'docs')
+    directory.mkdir()
+    for name, text in DOCS.items():
+        (directory / name).write_text(text, encoding='utf-8')
+
+    return directory
+
+
+def extract_dir(directory, **options):
+    ex.main(Namespace(dirinput=str(directory), **options))
+    corpus = directory / 'corpus'
+    texts = {f.name: f.read_text(encoding='utf-8') for f in corpus.glob('*.txt')}
+    rows = sorted((corpus / 'procesados.csv').read_text(encoding='utf-8').splitlines())
+
+    return texts, rows
+
+
+def test_get_metavalue_takes_first_of_repeated_values():
+    meta = {'Creation-Date': ['', '2019-06-30', '2019-07-01'], 'date': '2018'}
+    assert ex.get_metavalue(meta, ex.KCDT) == '2019-06-30'
+    assert ex.get_metavalue({'date': '2018'}, ex.KCDT) == '2018'
+
+
+def test_client_writes_same_output_as_tika_library(dir_docs, stub_tika, monkeypatch):
+    pytest.importorskip('tika')
+    # la librería tika lee servidor y modo cliente al importarse
+    monkeypatch.setenv('TIKA_SERVER_ENDPOINT', stub_tika)
+    monkeypatch.setenv('TIKA_CLIENT_ONLY', 'True')
+    for name in [m for m in sys.modules if m == 'tika' or m.startswith('tika.')]:
+        monkeypatch.delitem(sys.modules, name)
+
+    copia = dir_docs.parent / 'copia'
+    shutil.copytree(dir_docs, copia)
+
+    texts, rows = extract_dir(dir_docs, workers=None, server=None, sample=20000)
+    client_texts, client_rows = extract_dir(copia, workers=2, server=stub_tika, sample=10)
+
+    assert set(texts) == {'2019-06.txt', '2019-12.txt'}
+    assert client_texts == texts
+    assert client_rows == rows
+    assert rows[0] == '2019-06.txt,2019-06-30T00:00:00Z,en,1'
+
+
+def test_client_counts_bytes(dir_docs, stub_tika):
+    client = ex.TikaClient(stub_tika, sample=12)
+    info = ex.extract(str(dir_docs / '2019-06.pdf'), client=client)
+
+    assert info['text'] == DOCS['2019-06.pdf']
+    assert info['lang'] == 'en'
+    assert client.bytes_sent == len(DOCS['2019-06.pdf']) + len('Financial')
+    assert client.bytes_received > len(info['text'])
+
+
+def test_bounded_map_keeps_order_and_window():
+    pending = []
+
+    def fn(item):
+        pending.append(item)
+        return item * 2
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = []
+        for item, result in ex.bounded_map(executor, fn, range(10), window=3):
+            # no se envían más de window tareas por delante de la que se entrega
+            assert len(pending) <= item + 3
+            results.append((item, result))
+
+    assert results == [(i, 2 * i) for i in range(10)]
@@ -0,0 +1,84 @@
+# coding: utf-8
+import pytest
+
+import helpers as hp
+import isref as isr
+
+
+def test_hash_ids_match_vocab_for_spacy_symbols():
+    spacy = pytest.importorskip('spacy')
+    nlp = spacy.blank('en')
+    words = ['number', 'root', 'agent', 'credit']
+
+    assert sorted(hp.hash_ids(words).tolist()) == sorted(nlp.vocab.strings[w] for w in words)
+
+    doc = nlp('number of credit number')
+    pos, neg = hp.WordSet(['credit']), hp.WordSet(['number'])
+    assert isr.id_counts(doc, pos, neg) == (1, 2, 4)
+
+
+def test_token_filter_follows_changes_to_other():
+    spacy = pytest.importorskip('spacy')
+    nlp = spacy.blank('en')
+    nlp.add_pipe('sentencizer')
+    doc = nlp('the bank of the nation is strong')
+    extra = dict(stopwords={'the'})
+
+    assert list(hp.doc_sentences(doc, extra)) == [['bank', 'of', 'nation', 'is', 'strong']]
+
+    extra['stopwords'] = {'the', 'of', 'is'}
+    assert list(hp.doc_sentences(doc, extra)) == [hp.process_tokens(doc, extra)]
+
+    extra['stopwords'].add('strong')
+    assert list(hp.doc_sentences(doc, extra)) == [['bank', 'nation']]
+
+
+def test_parsed_and_chunked_hashes_match_text_hash(tmpdir):
+    spacy = pytest.importorskip('spacy')
+    nlp = spacy.blank('en')
+    nlp.add_pipe('sentencizer')
+    fpath = tmpdir.join('doc.txt')
+    fpath.write_text('First sentence here.\n\nSecond paragraph, longer. ' * 20, encoding='utf-8')
+    expected = {'doc': hp.text_hash(hp.read_text(str(fpath)))}
+
+    for chunk_size in (None, 200):
+        hashes = {}
+        isr.corpus_doc_terms([str(fpath)], nlp, chunk_size=chunk_size, hashes=hashes)
+        assert hashes == expected
+
+
+CHUNK_TEXT = '\n\n'.join(
+    'Profits rose in quarter {0}. Losses fell sharply and the outlook improved. '
+    'Costs were {0} percent lower than expected.\nDemand stayed weak in region {0}.'.format(i)
+    for i in range(30))
+
+
+@pytest.mark.parametrize('chunk_size', [200, 500])
+def test_chunked_scores_match_whole_document(tmpdir, chunk_size):
+    spacy = pytest.importorskip('spacy')
+    import readability as rd
+    nlp = spacy.blank('en')
+    nlp.add_pipe('sentencizer')
+    fpath = tmpdir.join('doc.txt')
+    fpath.write_text(CHUNK_TEXT, encoding='utf-8')
+
+    whole = isr.corpus_doc_terms([str(fpath)], nlp)
+    chunked = isr.corpus_doc_terms([str(fpath)], nlp, chunk_size=chunk_size)
+    lexicon = (['profits', 'improved', 'outlook'], ['losses'])
+    fss = [isr.fss_matrix(m, isr.lexicon_matrix(v, [lexicon]))[0, 0]
+           for m, v, _ in (whole, chunked)]
+    assert fss[0] == pytest.approx(fss[1])
+    assert dict(zip(whole[1], whole[0].toarray()[0])) == \
+        dict(zip(chunked[1], chunked[0].toarray()[0]))
+
+    assert rd.doc_readability(str(fpath), nlp) == \
+        rd.doc_readability(str(fpath), nlp, chunk_size=chunk_size)
+
+
+def test_read_chunks_replaces_invalid_bytes_like_read_text(tmpdir):
+    fpath = tmpdir.join('doc.txt')
+    fpath.write_binary(b'caf\xe9 ok\n\n' * 50)
+    text = hp.read_text(str(fpath))
+
+    assert '�' in text
+    assert ''.join(hp.read_chunks(str(fpath), size=64)) == text
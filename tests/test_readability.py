@@ -0,0 +1,78 @@
+# coding: utf-8
+import json
+
+import pytest
+
+import readability as rd
+
+PASSAGE = [['the', 'cat', 'sat', 'on', 'the', 'mat'],
+           ['government', 'regulations', 'are', 'complicated']]
+
+
+def baseline_totals(sentences):
+    # un count_syllables por palabra, como antes de SyllableTable
+    totals = dict(sentences=0, words=0, syllables=0, polysyllables=0, complex_words=0,
+                  characters=0)
+    for tokens in sentences:
+        totals['sentences'] += 1
+        for word in tokens:
+            nsyll = rd.count_syllables(word)
+            totals['words'] += 1
+            totals['syllables'] += nsyll
+            totals['characters'] += len(word)
+            totals['polysyllables'] += nsyll >= 3
+            totals['complex_words'] += rd.is_complex(word, nsyll)
+
+    return totals
+
+
+def test_syllable_table_totals_match_count_syllables(tmpdir):
+    text = ('The committee reviewed the revised regulations carefully, and the '
+            'reviewed regulations were published immediately after the meeting. '
+            'Readers liked the simple language.').lower()
+    sentences = [s.replace(',', '').split() for s in text.split('. ')]
+
+    stats = rd.ReadabilityStats()
+    for tokens in sentences:
+        stats.add(tokens)
+    expected = baseline_totals(sentences)
+
+    table = rd.SyllableTable(str(tmpdir.join('syllables.json')), maxsize=5)
+    assert stats.totals(table) == expected
+    table.save()
+    assert len(json.loads(tmpdir.join('syllables.json').read_text('utf-8'))) == 5
+
+    # tabla cargada de disco (y recortada) da los mismos totales
+    table = rd.SyllableTable(str(tmpdir.join('syllables.json')))
+    assert stats.totals(table) == expected
+
+
+def test_readability_scores_match_hand_computed_values():
+    stats = rd.ReadabilityStats()
+    for tokens in PASSAGE:
+        stats.add(tokens)
+    stats.add([])
+
+    # sílabas: the, cat, sat, on, mat y are 1; government 3, regulations 4,
+    # complicated 4 (polisílabas y complejas); 18 sílabas y 52 letras en 10 palabras
+    assert stats.totals(rd.SyllableTable()) == dict(
+        sentences=2, words=10, syllables=18, polysyllables=3, complex_words=3,
+        characters=52)
+
+    scores = stats.scores(rd.SyllableTable())
+    # asl = 5, asxw = 1.8, acxw = 5.2
+    assert scores['sentences'] == 2
+    assert scores['words'] == 10
+    # 206.835 - 1.015 * 5 - 84.6 * 1.8
+    assert scores['reading_ease'] == pytest.approx(49.48)
+    assert scores['grade'] == 'College'
+    # 0.39 * 5 + 11.8 * 1.8 - 15.59
+    assert scores['kincaid_grade'] == pytest.approx(7.6)
+    # 0.4 * (5 + 100 * 3 / 10)
+    assert scores['gunning_fog'] == pytest.approx(14.0)
+    # 1.0430 * sqrt(3 * 30 / 2) + 3.1291
+    assert scores['smog'] == pytest.approx(10.1)
+    # 0.0588 * 520 - 0.296 * 20 - 15.8
+    assert scores['coleman_liau'] == pytest.approx(8.9)
+    # 4.71 * 5.2 + 0.5 * 5 - 21.43
+    assert scores['ari'] == pytest.approx(5.6)
@@ -0,0 +1,81 @@
+# coding: utf-8
+from pathlib import Path
+import asyncio
+
+import pytest
+
+import extraction as ex
+import stream as st
+
+DOCS = {'2019-06.pdf': 'Financial stability report.',
+        '2019-12.pdf': 'Risks remain elevated.',
+        '2020-06.pdf': 'Banks are resilient.'}
+
+
+@pytest.fixture
+def dir_docs(tmpdir):
+    directory = Path(str(tmpdir), 'docs')
+    directory.mkdir()
+    for name, text in DOCS.items():
+        (directory / name).write_text(text, encoding='utf-8')
+
+    return directory
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+def test_stream_scores_saves_after_scoring(dir_docs, stub_tika, loop):
+    events = []
+
+    def score(name, text):
+        events.append(('score', name))
+        return dict(doc=name, score=len(text))
+
+    def save(fpath, info):
+        events.append(('save', fpath.stem))
+
+    def record(fpath, result):
+        events.append(('record', fpath.stem))
+
+    client = ex.TikaClient(stub_tika)
+    filepaths = sorted(dir_docs.glob('*.pdf'))
+    results, failed = st.stream_scores(filepaths, score, client, workers=2, queue_size=1,
+                                       save=save, record=record)
+
+    assert failed == 0
+    assert results == [dict(doc=Path(n).stem, score=len(t)) for n, t in sorted(DOCS.items())]
+    for name in (Path(n).stem for n in DOCS):
+        steps = [e[0] for e in events if e[1] == name]
+        assert steps == ['score', 'save', 'record']
+
+
+def test_stream_scores_stops_extraction_when_scoring_fails(dir_docs, stub_tika, loop):
+    saved = []
+
+    def score(name, text):
+        raise ValueError(name)
+
+    client = ex.TikaClient(stub_tika)
+    filepaths = sorted(dir_docs.glob('*.pdf'))
+    with pytest.raises(ValueError):
+        st.stream_scores(filepaths, score, client, workers=1, queue_size=1,
+                         save=lambda fpath, info: saved.append(fpath))
+
+    assert saved == []
+
+
+def test_pending_files_skips_scored_docs(dir_docs, tmpdir):
+    dir_results = Path(str(tmpdir), 'stream')
+    dir_results.mkdir()
+    st.append_result(dir_results / '2020-01-01.csv', dir_docs / '2019-06.pdf',
+                     dict(doc='2019-06', score=0.5))
+
+    pending = st.pending_files(dir_docs, dir_docs / 'corpus', dir_results)
+
+    assert [f.name for f in pending] == ['2019-12.pdf', '2020-06.pdf']